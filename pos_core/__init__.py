@@ -0,0 +1,6 @@
+"""Core data engines for the POS system; nothing here imports Tk, so they run headless."""
+
+from pos_core.store import DataStore, FileLock
+from pos_core.sync import SyncClient, SyncServer
+
+__all__ = ["DataStore", "FileLock", "SyncClient", "SyncServer"]
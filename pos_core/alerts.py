@@ -0,0 +1,96 @@
+"""Low-stock alerts, kept up to date from store change notifications."""
+
+import heapq
+
+from pos_core.store import DataStore
+
+DEFAULT_REORDER_POINT = 5
+
+
+class LowStockIndex:
+    """Products at or below their reorder point, maintained incrementally"""
+
+    def __init__(self, store, default_reorder_point=DEFAULT_REORDER_POINT):
+        self.store = store
+        self.default_reorder_point = default_reorder_point
+        # barcode -> (stock, reorder point) for products that need reordering
+        self.low = {}
+        self._listeners = []
+        self.rebuild()
+        store.subscribe(self._on_change)
+
+    def reorder_point(self, product):
+        point = product.get("reorder_point")
+        return self.default_reorder_point if point is None else point
+
+    def rebuild(self):
+        """Full pass over the catalogue; only needed at startup and after a reload"""
+        self.low.clear()
+        for barcode in self.store.products:
+            self._update(barcode)
+
+    def set_default_reorder_point(self, point):
+        if point != self.default_reorder_point:
+            self.default_reorder_point = point
+            self.rebuild()
+            self._fire()
+
+    def _update(self, barcode):
+        product = self.store.products.get(barcode)
+        if product is None:
+            self.low.pop(barcode, None)
+            return
+        stock = product.get("stock", 0)
+        point = self.reorder_point(product)
+        if stock <= point:
+            self.low[barcode] = (stock, point)
+        else:
+            self.low.pop(barcode, None)
+
+    def _on_change(self, records):
+        changed = DataStore.changed_barcodes(records)
+        if changed is None:
+            self.rebuild()
+        elif changed:
+            for barcode in changed:
+                self._update(barcode)
+        else:
+            return
+        self._fire()
+
+    # ----- queries -----
+
+    @property
+    def count(self):
+        return len(self.low)
+
+    @property
+    def out_of_stock(self):
+        return sum(1 for stock, _ in self.low.values() if stock <= 0)
+
+    def report(self, limit=None):
+        """Low products, emptiest first: dicts with stock, reorder point and shortfall"""
+        entries = ((stock - point, stock, barcode) for barcode, (stock, point) in self.low.items())
+        ordered = heapq.nsmallest(limit, entries) if limit else sorted(entries)
+        report = []
+        for _, stock, barcode in ordered:
+            product = self.store.products[barcode]
+            point = self.reorder_point(product)
+            report.append({
+                "barcode": barcode,
+                "name": product["name"],
+                "stock": stock,
+                "reorder_point": point,
+                "shortfall": point - stock,
+            })
+        return report
+
+    # ----- badge notifications -----
+
+    def subscribe(self, callback):
+        """Call callback(index) whenever the set of low products may have changed"""
+        self._listeners.append(callback)
+
+    def _fire(self):
+        for callback in list(self._listeners):
+            callback(self)
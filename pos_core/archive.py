@@ -0,0 +1,524 @@
+"""Columnar, compressed archive for sales older than the retention window."""
+
+import array
+import itertools
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+
+from pos_core.saleindex import SortedTable, date_key, hash_key
+from pos_core.store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = "sales_archive"
+INDEX_FILE = "index.json"
+MAGIC = b"POSSEG1\n"
+EPOCH = date(1970, 1, 1).toordinal()
+
+SALE_AMOUNTS = ("subtotal", "discount", "total", "payment", "change")
+LINE_FIELDS = ("barcode", "name", "price", "quantity")
+TABLES = ("ids", "dates", "barcodes", "cashiers")
+
+
+def epoch_day(text):
+    return datetime.strptime(text[:10], "%Y-%m-%d").toordinal() - EPOCH
+
+
+def day_text(day):
+    return date.fromordinal(day + EPOCH).isoformat()
+
+
+def _pack(typecode, values):
+    column = array.array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _unpack(typecode, data):
+    column = array.array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def _amount_column(values):
+    """(typecode, scale, integers) for a list of amounts"""
+    if all(isinstance(v, int) or float(v).is_integer() for v in values):
+        return "q", 1, [int(v) for v in values]
+    return "q", 100, [int(round(v * 100)) for v in values]
+
+
+def _amount(value, scale):
+    return value if scale == 1 else value / scale
+
+
+class SalesArchive:
+    """Archived sales: segment files plus a date index"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.index = self._load_index()
+        self._tables = {}
+        self._decoded = (None, None)
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        return {"cutoff": None, "segments": []}
+
+    def refresh(self):
+        self.index = self._load_index()
+        self._decoded = (None, None)
+
+    def close(self):
+        for table in self._tables.values():
+            table.close()
+        self._tables.clear()
+
+    @property
+    def cutoff(self):
+        """Sales dated before this day are archived (None when nothing is)"""
+        return self.index["cutoff"]
+
+    # ----- writing -----
+
+    def write_segment(self, sales, name):
+        """Encode sales into one segment file; returns its index entry"""
+        sales = sorted(sales, key=lambda s: s["date"])
+        dictionary = {}
+        columns = {
+            "day": [], "second": [], "line_count": [],
+            "line_product": [], "line_quantity": [], "line_price": [],
+        }
+        amounts = {field: [] for field in SALE_AMOUNTS}
+        sale_extras, line_extras = [], []
+        items_sold = 0
+
+        for sale in sales:
+            columns["day"].append(epoch_day(sale["date"]))
+            clock = sale["date"][11:19] or "00:00:00"
+            hours, minutes, seconds = (int(part) for part in clock.split(":"))
+            columns["second"].append(hours * 3600 + minutes * 60 + seconds)
+            for field in SALE_AMOUNTS:
+                amounts[field].append(sale.get(field, 0) or 0)
+            extra = {k: v for k, v in sale.items() if k not in SALE_AMOUNTS and k not in ("date", "items")}
+            if len(sale["date"]) > 19:
+                extra["date"] = sale["date"]
+            sale_extras.append(extra)
+
+            items = sale.get("items", [])
+            columns["line_count"].append(len(items))
+            for item in items:
+                key = (item["barcode"], item.get("name", ""))
+                product = dictionary.setdefault(key, len(dictionary))
+                columns["line_product"].append(product)
+                columns["line_quantity"].append(item["quantity"])
+                columns["line_price"].append(item["price"])
+                line_extras.append({k: v for k, v in item.items() if k not in LINE_FIELDS})
+                items_sold += item["quantity"]
+
+        blobs = {}
+        header = {"count": len(sales), "lines": len(columns["line_product"]), "columns": {}}
+
+        def add(name, typecode, values, scale=None):
+            data = zlib.compress(_pack(typecode, values), 6)
+            header["columns"][name] = {"type": typecode, "scale": scale, "length": len(data)}
+            blobs[name] = data
+
+        def add_json(name, values):
+            data = zlib.compress(json.dumps(values, separators=(",", ":")).encode("utf-8"), 6)
+            header["columns"][name] = {"type": "json", "scale": None, "length": len(data)}
+            blobs[name] = data
+
+        # Delta-encoded days compress to almost nothing
+        days = columns["day"]
+        add("day", "i", [days[0]] + [b - a for a, b in zip(days, days[1:])] if days else [])
+        add("second", "i", columns["second"])
+        add("line_count", "i", columns["line_count"])
+        add("line_product", "i", columns["line_product"])
+        add("line_quantity", "i", columns["line_quantity"])
+        typecode, scale, values = _amount_column(columns["line_price"])
+        add("line_price", typecode, values, scale)
+        for field in SALE_AMOUNTS:
+            typecode, scale, values = _amount_column(amounts[field])
+            add(field, typecode, values, scale)
+        add_json("products", [list(key) for key in dictionary])
+        add_json("sale_extra", sale_extras if any(sale_extras) else [])
+        add_json("line_extra", line_extras if any(line_extras) else [])
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        path = os.path.join(self.directory, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            for column in header["columns"]:
+                f.write(blobs[column])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        return {
+            "file": name,
+            "min_day": day_text(min(days)) if days else None,
+            "max_day": day_text(max(days)) if days else None,
+            "count": len(sales),
+            "lines": header["lines"],
+            "items": items_sold,
+            "total": sum(sale.get("total", 0) or 0 for sale in sales),
+            "bytes": os.path.getsize(path),
+        }
+
+    def archive(self, sales, cutoff):
+        """Archive the sales dated before cutoff ("YYYY-MM-DD"); returns the rest"""
+        previous = self.cutoff
+        if previous and cutoff < previous:
+            cutoff = previous
+        old, keep = [], []
+        late = duplicates = 0
+        for sale in sales:
+            day = sale["date"][:10]
+            if day >= cutoff:
+                keep.append(sale)
+            elif previous is None or day >= previous:
+                old.append(sale)
+            elif self.holds(sale):
+                duplicates += 1
+            else:
+                old.append(sale)
+                late += 1
+        if late:
+            logger.warning("Archiving %s sales that arrived after their days were archived", late)
+        if duplicates:
+            logger.info("Dropped %s sales from the store that were archived already", duplicates)
+
+        by_month = {}
+        for sale in old:
+            by_month.setdefault(sale["date"][:7], []).append(sale)
+        entries = []
+        existing = {entry["file"] for entry in self.index["segments"]}
+        first = len(self.index["segments"])
+        tables = {kind: [] for kind in TABLES}
+        for month, month_sales in sorted(by_month.items()):
+            n = 1
+            while f"segment_{month}_{n}.seg" in existing:
+                n += 1
+            # Rows are in date order; write_segment's own sort keeps it
+            month_sales.sort(key=lambda s: s["date"])
+            _table_entries(month_sales, first + len(entries), tables)
+            entries.append(self.write_segment(month_sales, f"segment_{month}_{n}.seg"))
+
+        segments = self.index["segments"] + entries
+        names = self._write_tables(len(segments), tables)
+        self._save_index({"cutoff": cutoff, "segments": segments, **names})
+        logger.info("Archived %s sales before %s into %s segments", len(old), cutoff, len(entries))
+        return keep
+
+    def _save_index(self, index):
+        self.index = index
+        write_json_atomic(self.index_path, index)
+        # Tables of older versions; one still mapped elsewhere goes next time
+        live = {index.get(f"{kind}_index") for kind in TABLES}
+        for name in list(self._tables):
+            if name not in live:
+                self._tables.pop(name).close()
+        for name in os.listdir(self.directory):
+            if name.endswith(".idx") and name not in live:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _write_tables(self, segment_count, tables, merge=True):
+        """Write the index tables ({kind: new entries}) for segment_count segments; returns their names"""
+        if merge and any(self.index.get(f"{kind}_index") is None for kind in TABLES):
+            # Nothing to merge into yet (or only some tables): index from scratch
+            self.rebuild_indexes()
+        names = {}
+        for kind, entries in tables.items():
+            name = f"{kind}_{segment_count:06d}.idx"
+            base = self._table(kind) if merge else None
+            SortedTable.write(os.path.join(self.directory, name), base, entries)
+            names[f"{kind}_index"] = name
+        return names
+
+    def rebuild_indexes(self):
+        """Rewrite the ID, date and barcode tables from the segments themselves"""
+        self.close()
+        tables = {kind: [] for kind in TABLES}
+        for number, entry in enumerate(self.index["segments"]):
+            if entry["count"]:
+                _table_entries(self.read_segment(entry["file"]), number, tables)
+        names = self._write_tables(len(self.index["segments"]), tables, merge=False)
+        self._save_index(dict(self.index, **names))
+        logger.info("Rebuilt sale indexes over %s archived sales", len(tables["dates"]))
+
+    def _table(self, kind):
+        """A mapped index table, built first for archives that predate it"""
+        name = self.index.get(f"{kind}_index")
+        if name is None:
+            if not any(entry["count"] for entry in self.index["segments"]):
+                return None
+            self.rebuild_indexes()
+            name = self.index[f"{kind}_index"]
+        table = self._tables.get(name)
+        if table is None:
+            table = self._tables[name] = SortedTable(os.path.join(self.directory, name))
+        return table
+
+    # ----- reading -----
+
+    def segments(self, start=None, end=None):
+        """Index entries of segments that may hold sales dated start..end (inclusive)"""
+        for entry in self.index["segments"]:
+            if entry["count"] == 0:
+                continue
+            if start and entry["max_day"] < start[:10]:
+                continue
+            if end and entry["min_day"] > end[:10]:
+                continue
+            yield entry
+
+    def _columns(self, name):
+        """A segment's decoded columns, plus running day/line offsets per sale"""
+        with open(os.path.join(self.directory, name), "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{name} is not a sales segment")
+            header_length, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+            columns = {}
+            for column, info in header["columns"].items():
+                data = zlib.decompress(f.read(info["length"]))
+                if info["type"] == "json":
+                    columns[column] = json.loads(data)
+                else:
+                    columns[column] = _unpack(info["type"], data)
+        columns["scales"] = {column: info["scale"] for column, info in header["columns"].items()}
+        columns["count"] = header["count"]
+        columns["days"] = list(itertools.accumulate(columns["day"]))
+        columns["first_line"] = [0] + list(itertools.accumulate(columns["line_count"]))
+        return columns
+
+    @staticmethod
+    def _sale(columns, i):
+        """Rebuild sale i of a segment from its columns"""
+        scales = columns["scales"]
+        products = columns["products"]
+        line_extras = columns["line_extra"]
+        second = columns["second"][i]
+        sale = {"date": f"{day_text(columns['days'][i])} "
+                        f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}"}
+        items = []
+        for line in range(columns["first_line"][i], columns["first_line"][i + 1]):
+            barcode, name = products[columns["line_product"][line]]
+            item = {
+                "barcode": barcode,
+                "name": name,
+                "price": _amount(columns["line_price"][line], scales["line_price"]),
+                "quantity": columns["line_quantity"][line],
+            }
+            if line_extras:
+                item.update(line_extras[line])
+            items.append(item)
+        sale["items"] = items
+        for field in SALE_AMOUNTS:
+            sale[field] = _amount(columns[field][i], scales[field])
+        if columns["sale_extra"]:
+            sale.update(columns["sale_extra"][i])
+        return sale
+
+    def read_segment(self, name):
+        """Decode a segment back into sale dicts"""
+        columns = self._columns(name)
+        return [self._sale(columns, i) for i in range(columns["count"])]
+
+    def read_sale(self, number, row):
+        """One sale by segment number and row; the last segment read stays decoded"""
+        name = self.index["segments"][number]["file"]
+        if self._decoded[0] != name:
+            self._decoded = (name, self._columns(name))
+        return self._sale(self._decoded[1], row)
+
+    def find(self, sale_id):
+        """The archived sale with this id, or None"""
+        table = self._table("ids")
+        if table is None:
+            return None
+        key = hash_key(sale_id)
+        start, end = table.range(key, key)
+        for _, number, row in table.entries(start, end):
+            # Hashes can collide; the sale itself settles it
+            sale = self.read_sale(number, row)
+            if sale.get("id") == sale_id:
+                return sale
+        return None
+
+    def holds(self, sale):
+        """Whether a sale dated before the cutoff is archived already (left in the store by a crash)"""
+        if not self.cutoff or sale["date"][:10] >= self.cutoff:
+            return False
+        if sale.get("id"):
+            return self.find(sale["id"]) is not None
+        # Sales from before sale ids: the same time, total and lines
+        lines = _lines(sale)
+        return any(archived.get("total") == sale.get("total") and _lines(archived) == lines
+                   for archived in self.between(sale["date"], sale["date"]))
+
+    def returns_of(self, sale_id):
+        """Archived returns made against the sale with this id"""
+        table = self._table("ids")
+        if table is None:
+            return []
+        key = hash_key(sale_id)
+        start, end = table.range(key, key)
+        returns = (self.read_sale(number, row) for _, number, row in table.entries(start, end))
+        return [sale for sale in returns if sale.get("return_of") == sale_id]
+
+    def keyed(self, kind, text, start=None, end=None, newest_first=False):
+        """Archived sales filed under text in the barcodes/cashiers table, dated start..end
+
+        Segments outside the date range are skipped on the index alone. Keys
+        are hashes, so the caller still checks each sale really matches.
+        """
+        table = self._table(kind)
+        if table is None:
+            return
+        key = hash_key(text)
+        low, high = table.range(key, key)
+        positions = range(high - 1, low - 1, -1) if newest_first else range(low, high)
+        wanted = {number for number, entry in enumerate(self.index["segments"])
+                  if entry["count"] and not (start and entry["max_day"] < start[:10])
+                  and not (end and entry["min_day"] > end[:10])}
+        for position in positions:
+            (_, number, row), = table.entries(position, position + 1)
+            if number not in wanted:
+                continue
+            sale = self.read_sale(number, row)
+            if start and sale["date"] < start:
+                continue
+            if end and sale["date"][:len(end)] > end:
+                continue
+            yield sale
+
+    def keyed_count(self, kind, text):
+        """Upper bound on the archived sales filed under text (hashes can collide)"""
+        table = self._table(kind)
+        if table is None:
+            return 0
+        key = hash_key(text)
+        low, high = table.range(key, key)
+        return high - low
+
+    def with_barcode(self, barcode):
+        """Archived sales with a line for barcode, newest first"""
+        for sale in self.keyed("barcodes", barcode, newest_first=True):
+            if any(item["barcode"] == barcode for item in sale["items"]):
+                yield sale
+
+    def _date_range(self, start, end):
+        table = self._table("dates")
+        if table is None:
+            return None, 0, 0
+        low = date_key(start) if start else -2 ** 63
+        high = date_key(end, end=True) if end else 2 ** 63 - 1
+        return (table,) + table.range(low, high)
+
+    def between(self, start=None, end=None, offset=0, limit=None):
+        """Archived sales dated start..end (inclusive) through the date table, oldest first
+
+        offset/limit pick a slice of the matches without reading the others.
+        """
+        table, low, high = self._date_range(start, end)
+        if table is not None:
+            low = min(low + offset, high)
+            if limit is not None:
+                high = min(high, low + limit)
+            for _, number, row in table.entries(low, high):
+                yield self.read_sale(number, row)
+
+    def count(self, start=None, end=None):
+        """Number of archived sales dated start..end, without decoding any"""
+        _, low, high = self._date_range(start, end)
+        return high - low
+
+    def iter_sales(self, start=None, end=None):
+        """Archived sales dated start..end ("YYYY-MM-DD[ HH:MM:SS]", inclusive)"""
+        for entry in self.segments(start, end):
+            for sale in self.read_segment(entry["file"]):
+                if start and sale["date"] < start:
+                    continue
+                if end and sale["date"][:len(end)] > end:
+                    continue
+                yield sale
+
+    def summary(self):
+        """All-time archived totals from the index alone"""
+        segments = self.index["segments"]
+        return {
+            "count": sum(entry["count"] for entry in segments),
+            "lines": sum(entry["lines"] for entry in segments),
+            "items": sum(entry["items"] for entry in segments),
+            "total": sum(entry["total"] for entry in segments),
+            "bytes": sum(entry["bytes"] for entry in segments),
+        }
+
+
+def _table_entries(sales, number, tables):
+    """Add index table entries for a segment's (date-ordered) sales
+
+    A return is filed under the ID of the sale it refunds as well as its own,
+    so the returns against a sale are found with the same lookup.
+    """
+    for row, sale in enumerate(sales):
+        for sale_id in (sale.get("id"), sale.get("return_of")):
+            if sale_id:
+                tables["ids"].append((hash_key(sale_id), number, row))
+        tables["dates"].append((date_key(sale["date"]), number, row))
+        for barcode in {item["barcode"] for item in sale.get("items", ())}:
+            tables["barcodes"].append((hash_key(barcode), number, row))
+        if sale.get("cashier"):
+            tables["cashiers"].append((hash_key(sale["cashier"]), number, row))
+
+
+def _lines(sale):
+    return sorted((item["barcode"], item["quantity"], item["price"]) for item in sale["items"])
+
+
+def archive_store(store, retention_days, today=None):
+    """Move the store's sales older than retention_days into its archive"""
+    cutoff = ((today or date.today()) - timedelta(days=retention_days)).isoformat()
+    archive = SalesArchive(store.path(ARCHIVE_DIR))
+    with store.lock:
+        store.poll()
+        if not any(sale["date"][:10] < cutoff for sale in store.sales):
+            return archive, 0
+        before = len(store.sales)
+        keep = archive.archive(store.sales, cutoff)
+        # Every till reloads the trimmed history
+        store.replace_all(sales=keep)
+    return archive, before - len(keep)
+
+
+def all_sales(store, archive, start=None, end=None):
+    """Archived sales followed by the store's own, optionally limited to a date range"""
+    yield from archive.iter_sales(start, end)
+    for sale in store.sales:
+        if archive.holds(sale):
+            # Left here by a crash mid-archive; sales synced in late are not archived yet
+            continue
+        if start and sale["date"] < start:
+            continue
+        if end and sale["date"][:len(end)] > end:
+            continue
+        yield sale
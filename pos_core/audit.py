@@ -0,0 +1,180 @@
+"""Append-only audit trail of who changed what, written in the background."""
+
+import bisect
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from pos_core.store import FileLock
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DIR = "audit"
+LOCK_FILE = "audit.lock"
+FLUSH_SECONDS = 1.0
+BATCH = 200
+
+
+class AuditLog:
+    """Buffered writer and indexed reader for the audit files"""
+
+    def __init__(self, directory, till_id="till-1"):
+        self.directory = directory
+        self.till_id = till_id
+        os.makedirs(directory, exist_ok=True)
+        self.lock = FileLock(os.path.join(directory, LOCK_FILE))
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Index: entries in the order read, (ts, position) sorted, positions per actor/action
+        self.entries = []
+        self.times = []
+        self.by_actor = {}
+        self.by_action = {}
+        self._offsets = {}
+        self._index_lock = threading.Lock()
+        self._loaded = False
+
+    # ----- writing -----
+
+    def record(self, actor, action, target=None, **details):
+        """Queue one entry; returns at once"""
+        entry = {
+            "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "till": self.till_id,
+            "actor": actor or "",
+            "action": action,
+            "target": target,
+            "details": details,
+        }
+        with self._buffer_lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= BATCH
+        if full:
+            self._wake.set()
+        return entry
+
+    def flush(self):
+        """Write out the buffered entries; returns how many were written"""
+        with self._buffer_lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return 0
+        by_file = {}
+        for entry in entries:
+            by_file.setdefault(self._file_for(entry["ts"]), []).append(entry)
+        try:
+            with self.lock:
+                for path, batch in by_file.items():
+                    data = "".join(json.dumps(entry) + "\n" for entry in batch).encode("utf-8")
+                    with open(path, "ab") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+        except OSError:
+            # Put them back for the next attempt, ahead of anything newer
+            with self._buffer_lock:
+                self._buffer[:0] = entries
+            raise
+        return len(entries)
+
+    def _file_for(self, ts):
+        return os.path.join(self.directory, f"audit_{ts[:7]}.jsonl")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the background writer and write out what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Audit log write failed: {e}")
+
+    # ----- reading -----
+
+    def refresh(self):
+        """Index whatever has been appended since the last look (by any till)"""
+        with self._index_lock:
+            names = sorted(name for name in os.listdir(self.directory)
+                           if name.startswith("audit_") and name.endswith(".jsonl"))
+            for name in names:
+                path = os.path.join(self.directory, name)
+                offset = self._offsets.get(name, 0)
+                if os.path.getsize(path) <= offset:
+                    continue
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            # Still being written
+                            break
+                        offset += len(line)
+                        if line.strip():
+                            self._index(json.loads(line))
+                self._offsets[name] = offset
+            self._loaded = True
+
+    def _index(self, entry):
+        position = len(self.entries)
+        self.entries.append(entry)
+        bisect.insort(self.times, (entry["ts"], position))
+        self.by_actor.setdefault(entry["actor"], []).append(position)
+        self.by_action.setdefault(entry["action"], []).append(position)
+
+    def query(self, actor=None, action=None, start=None, end=None, limit=500):
+        """Entries matching the filters, newest first
+
+        start/end are "YYYY-MM-DD[ HH:MM:SS]", inclusive. The smallest of the
+        actor, action and time indexes is walked, so a filter over a long
+        history only reads the entries it could match.
+        """
+        self.flush()
+        self.refresh()
+        low = bisect.bisect_left(self.times, (start,)) if start else 0
+        high = bisect.bisect_right(self.times, (end + "\uffff",)) if end else len(self.times)
+        candidates = [(max(high - low, 0), None)]
+        if actor is not None:
+            candidates.append((len(self.by_actor.get(actor, ())), self.by_actor.get(actor, [])))
+        if action is not None:
+            candidates.append((len(self.by_action.get(action, ())), self.by_action.get(action, [])))
+        _, positions = min(candidates, key=lambda candidate: candidate[0])
+        if positions is None:
+            positions = [position for _, position in self.times[low:high]]
+        found = []
+        for position in positions:
+            entry = self.entries[position]
+            if (actor is not None and entry["actor"] != actor) \
+                    or (action is not None and entry["action"] != action) \
+                    or (start and entry["ts"] < start) \
+                    or (end and entry["ts"][:len(end)] > end):
+                continue
+            found.append(entry)
+        found.sort(key=lambda entry: entry["ts"], reverse=True)
+        return found[:limit]
+
+    def actors(self):
+        if not self._loaded:
+            self.refresh()
+        return sorted(self.by_actor)
+
+    def actions(self):
+        if not self._loaded:
+            self.refresh()
+        return sorted(self.by_action)
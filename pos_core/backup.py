@@ -0,0 +1,313 @@
+"""Incremental, deduplicated backups in content-defined chunks."""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zlib
+from datetime import datetime
+
+from pos_core.snapshot import take_snapshot, MANIFEST_FILE
+from pos_core.store import DataStore, write_json_atomic, PRODUCTS_FILE, SALES_FILE, CHECKPOINT_FILE
+
+logger = logging.getLogger(__name__)
+
+CHUNK_DIR = "chunks"
+SNAPSHOT_DIR = "snapshots"
+
+MIN_CHUNK = 8 * 1024
+MAX_CHUNK = 256 * 1024
+# Cut at roughly one in 256 candidate points past MIN_CHUNK
+CUT_MASK = 0xFF
+CUT_WINDOW = 32
+# Candidate cut points: line ends and the gaps between JSON objects/lists
+_CUT_POINTS = re.compile(rb"\n|\}, |\], ")
+
+
+class BackupError(Exception):
+    """Raised when a snapshot is missing or its data does not check out"""
+
+
+def split_chunks(data):
+    """Yield content-defined chunks of data"""
+    start = 0
+    size = len(data)
+    while start < size:
+        end = None
+        if size - start > MIN_CHUNK:
+            for match in _CUT_POINTS.finditer(data, start + MIN_CHUNK, min(size, start + MAX_CHUNK)):
+                cut = match.end()
+                if zlib.crc32(data[cut - CUT_WINDOW:cut]) & CUT_MASK == 0:
+                    end = cut
+                    break
+        if end is None:
+            end = min(size, start + MAX_CHUNK)
+        yield data[start:end]
+        start = end
+
+
+class BackupRepository:
+    """Content-addressed chunk store plus snapshot manifests"""
+
+    def __init__(self, directory, compression=6):
+        self.directory = directory
+        self.compression = compression
+        self.chunk_dir = os.path.join(directory, CHUNK_DIR)
+        self.snapshot_dir = os.path.join(directory, SNAPSHOT_DIR)
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    # ----- chunks -----
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def _put_chunk(self, chunk):
+        """Store a chunk unless it is already there; returns (digest, bytes written)"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = zlib.compress(chunk, self.compression)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(packed)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return digest, len(packed)
+
+    def _get_chunk(self, digest):
+        try:
+            with open(self._chunk_path(digest), "rb") as f:
+                chunk = zlib.decompress(f.read())
+        except (OSError, zlib.error) as e:
+            raise BackupError(f"Chunk {digest} is missing or damaged: {e}")
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise BackupError(f"Chunk {digest} does not match its checksum")
+        return chunk
+
+    # ----- snapshots -----
+
+    def snapshots(self):
+        """Manifests of every snapshot, oldest first"""
+        manifests = []
+        for name in sorted(os.listdir(self.snapshot_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.snapshot_dir, name), "r") as f:
+                    manifests.append(json.load(f))
+        return manifests
+
+    def latest(self):
+        names = sorted(n for n in os.listdir(self.snapshot_dir) if n.endswith(".json"))
+        return self.load(names[-1][:-5]) if names else None
+
+    def load(self, snapshot_id):
+        path = os.path.join(self.snapshot_dir, f"{snapshot_id}.json")
+        if not os.path.exists(path):
+            raise BackupError(f"No snapshot {snapshot_id}")
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _new_id(self):
+        snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        candidate, n = snapshot_id, 1
+        while os.path.exists(os.path.join(self.snapshot_dir, f"{candidate}.json")):
+            n += 1
+            candidate = f"{snapshot_id}_{n}"
+        return candidate
+
+    def backup(self, files, label="", meta=None, skip_unchanged=False):
+        """Snapshot files ({name: path or bytes}); returns the manifest
+
+        With skip_unchanged, nothing is written (and None is returned) when
+        every file matches the latest snapshot.
+        """
+        previous = self.latest()
+        previous_files = previous["files"] if previous else {}
+        entries = {}
+        stored = 0
+        for name, source in files.items():
+            entry, written = self._backup_file(name, source, previous_files.get(name))
+            if entry is not None:
+                entries[name] = entry
+                stored += written
+
+        if skip_unchanged and previous is not None and all(
+                previous_files.get(name, {}).get("sha256") == entry["sha256"]
+                for name, entry in entries.items()) and set(entries) == set(previous_files):
+            return None
+
+        manifest = {
+            "id": self._new_id(),
+            "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "label": label,
+            "meta": meta or {},
+            "size": sum(entry["size"] for entry in entries.values()),
+            "stored_bytes": stored,
+            "files": entries,
+        }
+        write_json_atomic(os.path.join(self.snapshot_dir, f"{manifest['id']}.json"), manifest)
+        logger.info("Backup %s: %s bytes, %s new", manifest["id"], manifest["size"], stored)
+        return manifest
+
+    def _backup_file(self, name, source, previous):
+        if isinstance(source, bytes):
+            data, stat = source, None
+        else:
+            try:
+                stat = os.stat(source)
+            except OSError:
+                return None, 0
+            if (previous is not None and previous.get("mtime_ns") == stat.st_mtime_ns
+                    and previous["size"] == stat.st_size):
+                # Untouched since the last snapshot, e.g. an old journal generation
+                return previous, 0
+            with open(source, "rb") as f:
+                data = f.read()
+
+        chunks = []
+        written = 0
+        for chunk in split_chunks(data):
+            digest, size = self._put_chunk(chunk)
+            chunks.append(digest)
+            written += size
+        entry = {
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "chunks": chunks,
+        }
+        if stat is not None:
+            entry["mtime_ns"] = stat.st_mtime_ns
+        return entry, written
+
+    # ----- restore -----
+
+    def read_file(self, snapshot_id, name):
+        """A file's contents as of a snapshot (checked against its sha256)"""
+        entry = self.load(snapshot_id)["files"].get(name)
+        if entry is None:
+            raise BackupError(f"Snapshot {snapshot_id} has no {name}")
+        data = b"".join(self._get_chunk(digest) for digest in entry["chunks"])
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise BackupError(f"{name} in snapshot {snapshot_id} does not match its checksum")
+        return data
+
+    def restore(self, snapshot_id, directory, names=None):
+        """Write a snapshot's files into directory; returns the names restored"""
+        manifest = self.load(snapshot_id)
+        os.makedirs(directory, exist_ok=True)
+        restored = []
+        for name in manifest["files"]:
+            if names is not None and name not in names:
+                continue
+            data = self.read_file(snapshot_id, name)
+            path = os.path.join(directory, *name.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            restored.append(name)
+        return restored
+
+    def verify(self, snapshot_id):
+        """List the problems found in a snapshot (empty when every file checks out)"""
+        problems = []
+        for name in self.load(snapshot_id)["files"]:
+            try:
+                self.read_file(snapshot_id, name)
+            except BackupError as e:
+                problems.append(str(e))
+        return problems
+
+    # ----- housekeeping -----
+
+    def prune(self, keep):
+        """Keep the newest `keep` snapshots and delete chunks nothing refers to"""
+        manifests = self.snapshots()
+        for manifest in manifests[:-keep] if keep else manifests:
+            os.remove(os.path.join(self.snapshot_dir, f"{manifest['id']}.json"))
+        return self.collect_garbage()
+
+    def collect_garbage(self):
+        live = set()
+        for manifest in self.snapshots():
+            for entry in manifest["files"].values():
+                live.update(entry["chunks"])
+        removed = 0
+        for prefix in os.listdir(self.chunk_dir):
+            folder = os.path.join(self.chunk_dir, prefix)
+            for digest in os.listdir(folder):
+                if digest not in live:
+                    os.remove(os.path.join(folder, digest))
+                    removed += 1
+        return removed
+
+
+# ----- store helpers -----
+
+def backup_store(repository, store, extra_files=None, label="", skip_unchanged=False):
+    """Snapshot a store's files plus extra_files ({name: path}) into the repository
+
+    The files are taken from a consistent online snapshot, so the store lock
+    is only held while it is linked, not while chunks are compressed.
+    """
+    snapshot = take_snapshot(store, extra_files=extra_files)
+    try:
+        with open(os.path.join(snapshot, MANIFEST_FILE), "r") as f:
+            taken = json.load(f)
+        files = {name: os.path.join(snapshot, *name.split("/")) for name in taken["files"]}
+        return repository.backup(files, label=label, meta={"seq": taken["seq"], "till": store.till_id},
+                                 skip_unchanged=skip_unchanged)
+    finally:
+        shutil.rmtree(snapshot, ignore_errors=True)
+
+
+def load_store_state(repository, snapshot_id):
+    """(products, sales) as of a snapshot, replayed from its checkpoint and journal"""
+    names = [name for name in repository.load(snapshot_id)["files"]
+             if name in (PRODUCTS_FILE, SALES_FILE, CHECKPOINT_FILE) or name.startswith("journal_")]
+    directory = tempfile.mkdtemp(prefix="pos_restore_")
+    try:
+        repository.restore(snapshot_id, directory, names)
+        store = DataStore(directory, durable=False)
+        return dict(store.products), list(store.sales)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class BackupScheduler:
+    """Runs a backup callable every interval seconds on a background thread"""
+
+    def __init__(self, run_backup, interval):
+        self.run_backup = run_backup
+        self.interval = interval
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_result = self.run_backup()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Scheduled backup failed: {e}")
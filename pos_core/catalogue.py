@@ -0,0 +1,279 @@
+"""Memory-mapped binary catalogue snapshot, written at checkpoints and opened without parsing."""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+from pos_core.records import Product
+
+MAGIC = b"POSCAT1\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIqqIIQQQQ")
+# barcode/name/type/extra (offset, length) pairs, flags, price, stock
+RECORD = struct.Struct("<IIIIIIIIIdd")
+SLOT = struct.Struct("<I")
+
+HAS_NAME = 1
+HAS_PRICE = 2
+PRICE_INT = 4
+HAS_STOCK = 8
+STOCK_INT = 16
+HAS_TYPE = 32
+HAS_EXTRA = 64
+
+
+def catalogue_name(generation):
+    return f"catalogue_{generation:06d}.bin"
+
+
+def _number(value):
+    """(present, is_int) for a price/stock value the record can hold"""
+    if type(value) is int and abs(value) < 2 ** 53:
+        return True, True
+    if type(value) is float:
+        return True, False
+    return False, False
+
+
+def write_catalogue(path, products, generation, seq):
+    """Write products ({barcode: mapping}) as a catalogue snapshot file"""
+    heap = bytearray()
+    strings = {}
+
+    def put(text):
+        offset = strings.get(text)
+        data = text.encode("utf-8")
+        if offset is None:
+            offset = strings[text] = len(heap)
+            heap.extend(data)
+        return offset, len(data)
+
+    records = bytearray()
+    barcodes = []
+    for barcode, product in products.items():
+        flags = 0
+        extra = {}
+        name_ref = type_ref = extra_ref = (0, 0)
+        price = stock = 0.0
+        for key, value in product.items():
+            if key == "barcode":
+                continue
+            if key == "name" and type(value) is str:
+                flags |= HAS_NAME
+                name_ref = put(value)
+            elif key == "type" and type(value) is str:
+                flags |= HAS_TYPE
+                type_ref = put(value)
+            elif key == "price" and _number(value)[0]:
+                flags |= HAS_PRICE | (PRICE_INT if _number(value)[1] else 0)
+                price = float(value)
+            elif key == "stock" and _number(value)[0]:
+                flags |= HAS_STOCK | (STOCK_INT if _number(value)[1] else 0)
+                stock = float(value)
+            else:
+                extra[key] = value
+        if extra:
+            flags |= HAS_EXTRA
+            extra_ref = put(json.dumps(extra))
+        barcode_ref = put(barcode)
+        barcodes.append(barcode.encode("utf-8"))
+        records += RECORD.pack(*barcode_ref, *name_ref, *type_ref, *extra_ref, flags, price, stock)
+
+    table_size = 8
+    while table_size < 2 * len(barcodes):
+        table_size *= 2
+    mask = table_size - 1
+    table = [0] * table_size
+    for index, key in enumerate(barcodes):
+        slot = zlib.crc32(key) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = index + 1
+
+    records_offset = HEADER.size
+    table_offset = records_offset + len(records)
+    heap_offset = table_offset + table_size * SLOT.size
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, generation, seq, len(barcodes), table_size,
+                            records_offset, table_offset, heap_offset, len(heap)))
+        f.write(records)
+        f.write(struct.pack(f"<{table_size}I", *table))
+        f.write(heap)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class CatalogueFile:
+    """Read-only view of one catalogue snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.generation, self.seq, self.count, table_size,
+         self._records, self._table, self._heap, _) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a catalogue snapshot")
+        self._mask = table_size - 1
+
+    def close(self):
+        self._mm.close()
+
+    def _string(self, offset, length):
+        start = self._heap + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def barcode_at(self, index):
+        offset, length = struct.unpack_from("<II", self._mm, self._records + index * RECORD.size)
+        return self._string(offset, length)
+
+    def index_of(self, barcode):
+        key = barcode.encode("utf-8")
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            entry, = SLOT.unpack_from(self._mm, self._table + slot * SLOT.size)
+            if not entry:
+                return None
+            index = entry - 1
+            offset, length = struct.unpack_from("<II", self._mm, self._records + index * RECORD.size)
+            start = self._heap + offset
+            if length == len(key) and self._mm[start:start + length] == key:
+                return index
+            slot = (slot + 1) & self._mask
+
+    def product_at(self, index, barcode=None):
+        (barcode_offset, barcode_length, name_offset, name_length, type_offset, type_length,
+         extra_offset, extra_length, flags, price, stock) = RECORD.unpack_from(
+            self._mm, self._records + index * RECORD.size)
+        data = {"barcode": barcode or self._string(barcode_offset, barcode_length)}
+        if flags & HAS_NAME:
+            data["name"] = self._string(name_offset, name_length)
+        if flags & HAS_PRICE:
+            data["price"] = int(price) if flags & PRICE_INT else price
+        if flags & HAS_STOCK:
+            data["stock"] = int(stock) if flags & STOCK_INT else stock
+        if flags & HAS_TYPE:
+            data["type"] = self._string(type_offset, type_length)
+        if flags & HAS_EXTRA:
+            data.update(json.loads(self._string(extra_offset, extra_length)))
+        return Product.from_dict(data)
+
+
+class _Items(ItemsView):
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+
+class _Values(ValuesView):
+    def __iter__(self):
+        for _, product in self._mapping._iter_items():
+            yield product
+
+
+class CatalogueView(MutableMapping):
+    """Products mapping: a mapped catalogue file plus an overlay of changes (assign products back)"""
+
+    def __init__(self):
+        self._base = None
+        self._overlay = {}
+        self._deleted = set()
+        # Products added since the snapshot, in the order they were added
+        self._new = {}
+
+    def load_base(self, path):
+        """Switch to a new snapshot file, dropping all changes held on top"""
+        base = CatalogueFile(path)
+        self.clear()
+        self._base = base
+        return base
+
+    @property
+    def generation(self):
+        return self._base.generation if self._base is not None else None
+
+    def _in_base(self, barcode):
+        return self._base is not None and barcode not in self._deleted and \
+            self._base.index_of(barcode) is not None
+
+    def __getitem__(self, barcode):
+        product = self._overlay.get(barcode)
+        if product is not None:
+            return product
+        if self._base is not None and barcode not in self._deleted:
+            index = self._base.index_of(barcode)
+            if index is not None:
+                return self._base.product_at(index, barcode)
+        raise KeyError(barcode)
+
+    def get(self, barcode, default=None):
+        try:
+            return self[barcode]
+        except KeyError:
+            return default
+
+    def __contains__(self, barcode):
+        if barcode in self._overlay:
+            return True
+        return self._in_base(barcode)
+
+    def __setitem__(self, barcode, product):
+        # A product deleted from the snapshot and added again is still in it
+        if barcode not in self._overlay and (self._base is None or self._base.index_of(barcode) is None):
+            self._new[barcode] = None
+        self._overlay[barcode] = product
+        self._deleted.discard(barcode)
+
+    def __delitem__(self, barcode):
+        if barcode in self._overlay:
+            del self._overlay[barcode]
+            if barcode in self._new:
+                del self._new[barcode]
+                return
+            self._deleted.add(barcode)
+        elif self._in_base(barcode):
+            self._deleted.add(barcode)
+        else:
+            raise KeyError(barcode)
+
+    def _iter_items(self):
+        if self._base is not None:
+            for index in range(self._base.count):
+                barcode = self._base.barcode_at(index)
+                if barcode in self._deleted:
+                    continue
+                product = self._overlay.get(barcode)
+                yield barcode, product if product is not None else self._base.product_at(index, barcode)
+        for barcode in list(self._new):
+            yield barcode, self._overlay[barcode]
+
+    def __iter__(self):
+        if self._base is not None:
+            for index in range(self._base.count):
+                barcode = self._base.barcode_at(index)
+                if barcode not in self._deleted:
+                    yield barcode
+        yield from list(self._new)
+
+    def __len__(self):
+        base = self._base.count - len(self._deleted) if self._base is not None else 0
+        return base + len(self._new)
+
+    def items(self):
+        return _Items(self)
+
+    def values(self):
+        return _Values(self)
+
+    def clear(self):
+        if self._base is not None:
+            self._base.close()
+        self._base = None
+        self._overlay.clear()
+        self._deleted.clear()
+        self._new.clear()
@@ -0,0 +1,294 @@
+"""Command line for bulk and nightly jobs; runs without Tk (see README for the commands)."""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from pos_core.archive import ARCHIVE_DIR, SalesArchive, archive_store
+from pos_core.backup import BackupRepository, backup_store
+from pos_core.endofday import END_OF_DAY_DIR, end_of_day
+from pos_core.locations import DataLocations, location_arguments
+from pos_core.performance import CashierStats
+from pos_core.saleindex import SaleIndex
+from pos_core.shifts import ShiftBook
+from pos_core.store import DataStore
+
+CSV_FIELDS = ("barcode", "name", "price", "stock", "type", "reorder_point")
+IMPORT_BATCH = 1000
+
+
+def load_settings(locations):
+    if os.path.exists(locations.settings_file):
+        with open(locations.settings_file, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def open_store(locations, settings, till_id=None):
+    locations.use_shared(settings.get("shared_data_dir"))
+    till_id = till_id or os.environ.get("POS_TILL_ID") or settings.get("till_id") or socket.gethostname()
+    return DataStore(locations.data_dir, till_id=till_id,
+                     catalogue_snapshot=bool(settings.get("catalogue_snapshot", False)))
+
+
+# ----- catalogue -----
+
+def export_catalogue(store, path):
+    """Write every product to path (.json as {barcode: product}, else CSV); returns the count"""
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump({barcode: product.to_dict() for barcode, product in store.products.items()}, f)
+        return len(store.products)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for barcode, product in store.products.items():
+            writer.writerow([barcode] + [product.get(field, "") for field in CSV_FIELDS[1:]])
+    return len(store.products)
+
+
+def read_catalogue(path):
+    """{barcode: product dict} from a .json or CSV file"""
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            return json.load(f)
+    products = {}
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            barcode = row.get("barcode", "").strip()
+            if not barcode:
+                continue
+            product = {"name": row.get("name", ""), "price": float(row.get("price") or 0)}
+            if row.get("type"):
+                product["type"] = row["type"]
+            if row.get("stock", "") != "":
+                product["stock"] = int(float(row["stock"]))
+            if row.get("reorder_point", "") != "":
+                product["reorder_point"] = int(float(row["reorder_point"]))
+            products[barcode] = product
+    return products
+
+
+def import_catalogue(store, products, replace=False):
+    """Add or update products; stock given for a product is journaled as a movement
+
+    Fields a row leaves out (an empty reorder_point or type cell) keep their
+    current values.
+    """
+    if replace:
+        store.replace_all(products=products)
+        return len(products)
+    changes = []
+    for barcode, imported in products.items():
+        existing = store.products.get(barcode)
+        product = existing.to_dict() if existing else {}
+        product.pop("stock", None)
+        product.update(imported)
+        stock = product.pop("stock", None)
+        on_hand = existing.get("stock", 0) if existing else 0
+        moves = [[barcode, stock - on_hand]] if stock is not None and stock != on_hand else []
+        changes.append({"op": "product", "barcode": barcode, "product": product, "moves": moves,
+                        "reason": "adjustment" if existing else "receipt"})
+        if len(changes) >= IMPORT_BATCH:
+            store.commit_batch(changes)
+            changes = []
+    store.commit_batch(changes)
+    return len(products)
+
+
+# ----- reports -----
+
+def sales_report(store, archive, start=None, end=None):
+    """One row per day: sales, returns, items, discounts, net"""
+    days = {}
+    for sale in SaleIndex(store, archive).between(start, end):
+        row = days.setdefault(sale["date"][:10], {
+            "date": sale["date"][:10], "sales": 0, "returns": 0, "items": 0, "discounts": 0, "net": 0})
+        if sale.get("type") == "return":
+            row["returns"] += 1
+        else:
+            row["sales"] += 1
+            row["items"] += sum(item["quantity"] for item in sale["items"])
+            row["discounts"] += sale.get("discount") or 0
+        row["net"] += sale["total"]
+    return [days[day] for day in sorted(days)]
+
+
+def shifts_report(store):
+    fields = ("z_number", "id", "till", "opened", "closed", "float", "sales", "returns",
+              "net", "expected_cash", "counted", "over_short")
+    return [{field: report.get(field) for field in fields} for report in ShiftBook(store).z_reports()]
+
+
+def write_rows(rows, out=None):
+    handle = open(out, "w", newline="", encoding="utf-8") if out else sys.stdout
+    try:
+        if rows:
+            writer = csv.DictWriter(handle, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if out:
+            handle.close()
+
+
+# ----- benchmark -----
+
+def bench(directory, products=10000, sales=5000):
+    """Time catalogue import, sale commits, index queries, checkpoint and reopen; returns {step: result}"""
+    results = {}
+    store = DataStore(directory, till_id="bench", checkpoint_every=10 ** 9)
+    catalogue = {f"{800000000000 + i}": {"name": f"Product {i}", "price": 500 + i % 50 * 100, "stock": 1000}
+                 for i in range(products)}
+    started = time.perf_counter()
+    import_catalogue(store, catalogue)
+    results["import_products_s"] = round(time.perf_counter() - started, 3)
+
+    index = SaleIndex(store)
+    barcodes = list(catalogue)
+    day = datetime.now().replace(hour=8, minute=0, second=0)
+    timings = []
+    for i in range(sales):
+        lines = [{"barcode": barcodes[(i * 7 + n) % products], "name": "x", "price": 1000, "quantity": 1}
+                 for n in range(3)]
+        sale = {"date": (day + timedelta(seconds=i * 5)).strftime("%Y-%m-%d %H:%M:%S"), "till": "bench",
+                "cashier": f"cashier{i % 4}", "items": lines, "subtotal": 3000, "discount": 0,
+                "total": 3000, "payment": 3000, "change": 0}
+        started = time.perf_counter()
+        store.commit_sale(sale, [(line["barcode"], -1) for line in lines])
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    results["sale_commit_p50_ms"] = round(statistics.median(timings) * 1000, 3)
+    results["sale_commit_p99_ms"] = round(timings[int(len(timings) * 0.99)] * 1000, 3)
+
+    today = day.strftime("%Y-%m-%d")
+    started = time.perf_counter()
+    page, total = index.query(today, today, descending=True, limit=100)
+    results["day_page_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    started = time.perf_counter()
+    index.query(today, today, cashier="cashier1", limit=100)
+    results["cashier_filter_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    started = time.perf_counter()
+    store.checkpoint()
+    results["checkpoint_s"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    DataStore(directory, till_id="bench")
+    results["reopen_s"] = round(time.perf_counter() - started, 3)
+    return results
+
+
+# ----- entry point -----
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="POS bulk and nightly jobs")
+    location_arguments(parser)
+    parser.add_argument("--till-id", help="till to act as (default: as configured)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export-catalogue", help="write the products to .csv or .json")
+    export.add_argument("file")
+    load = commands.add_parser("import-catalogue", help="add/update products from .csv or .json")
+    load.add_argument("file")
+    load.add_argument("--replace", action="store_true", help="replace the whole catalogue")
+    commands.add_parser("rebuild-indexes", help="rewrite the sales archive's index tables")
+    compact = commands.add_parser("compact", help="fold the journal into the checkpoint files")
+    compact.add_argument("--retention-days", type=int, help="archive sales older than this first")
+    backup = commands.add_parser("backup", help="snapshot the data into the backup repository")
+    backup.add_argument("--label", default="cli")
+    backup.add_argument("--verify", action="store_true", help="check the backup afterwards")
+    report = commands.add_parser("report", help="CSV report")
+    report.add_argument("kind", choices=("sales", "cashiers", "shifts"))
+    report.add_argument("--start", help="first day, YYYY-MM-DD (default: 30 days ago)")
+    report.add_argument("--end", help="last day, YYYY-MM-DD (default: today)")
+    report.add_argument("--out", help="file to write instead of stdout")
+    closing = commands.add_parser("end-of-day", help="the day's CSV summaries and PDF")
+    closing.add_argument("--day", help="YYYY-MM-DD (default: today)")
+    closing.add_argument("--out", help="folder to write to (default: End_of_Day/<day> in the receipts folder)")
+    timing = commands.add_parser("bench", help="time the engines on a throwaway data folder")
+    timing.add_argument("--products", type=int, default=10000)
+    timing.add_argument("--sales", type=int, default=5000)
+    timing.add_argument("--dir", help="where to create it (default: /dev/shm when present, else the temp folder)")
+    timing.add_argument("--keep", action="store_true", help="leave the data folder in place")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "bench":
+        parent = args.dir or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+        directory = tempfile.mkdtemp(prefix="pos_bench_", dir=parent)
+        try:
+            for step, result in bench(directory, args.products, args.sales).items():
+                print(f"{step}: {result}")
+        finally:
+            if args.keep:
+                print(f"Data left in {directory}")
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+        return 0
+
+    locations = DataLocations(args.data_dir, args.shared_dir)
+    settings = load_settings(locations)
+    store = open_store(locations, settings, args.till_id)
+
+    if args.command == "export-catalogue":
+        print(f"{export_catalogue(store, args.file)} products written to {args.file}")
+    elif args.command == "import-catalogue":
+        count = import_catalogue(store, read_catalogue(args.file), replace=args.replace)
+        print(f"{count} products imported")
+    elif args.command == "rebuild-indexes":
+        archive = SalesArchive(store.path(ARCHIVE_DIR))
+        archive.rebuild_indexes()
+        print(f"Indexes rebuilt for {len(archive.index['segments'])} segments")
+    elif args.command == "compact":
+        days = args.retention_days if args.retention_days is not None else settings.get("sales_retention_days", 0)
+        if days:
+            _, archived = archive_store(store, days)
+            print(f"{archived} sales archived")
+        store.checkpoint()
+        print(f"Journal folded into checkpoint generation {store.generation}")
+    elif args.command == "backup":
+        repository = BackupRepository(locations.backups_dir(settings))
+        extra = {name: path for name, path in (("settings.json", locations.settings_file),
+                                               ("users.json", locations.users_file))
+                 if os.path.exists(path)}
+        manifest = backup_store(repository, store, extra, label=args.label)
+        print(f"Backup {manifest['id']} created in {repository.directory}")
+        if args.verify:
+            problems = repository.verify(manifest["id"])
+            for problem in problems:
+                print(problem)
+            if problems:
+                return 1
+    elif args.command == "report":
+        end = args.end or date.today().isoformat()
+        start = args.start or (date.today() - timedelta(days=30)).isoformat()
+        archive = SalesArchive(store.path(ARCHIVE_DIR))
+        if args.kind == "sales":
+            rows = sales_report(store, archive, start, end)
+        elif args.kind == "cashiers":
+            rows = CashierStats(store, archive).report(start, end)
+        else:
+            rows = shifts_report(store)
+        write_rows(rows, args.out)
+    elif args.command == "end-of-day":
+        day = args.day or date.today().isoformat()
+        out_dir = args.out or os.path.join(locations.receipts_dir(settings), END_OF_DAY_DIR, day)
+        summary = end_of_day(store.data_dir, day, out_dir)
+        print(f"{summary['sales']} sales, {summary['returns']} returns, net {summary['net']:,.0f} "
+              f"written to {out_dir} in {summary['seconds']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
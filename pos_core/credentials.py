@@ -0,0 +1,118 @@
+"""Salted PBKDF2 password hashing, checking and login back-off."""
+
+import hashlib
+import hmac
+import os
+import time
+
+SCHEME = "pbkdf2_sha256"
+SALT_BYTES = 16
+TARGET_SECONDS = 0.25
+MIN_ITERATIONS = 100_000
+FREE_ATTEMPTS = 3
+MAX_DELAY = 300
+
+DEFAULT_USERNAME = "Givenwholesalers"
+DEFAULT_PASSWORD = "Blueband"
+MIN_PASSWORD_LENGTH = 8
+
+
+class LoginError(Exception):
+    """Raised when a login is refused; the message can be shown to the user"""
+
+
+def tune_iterations(target_seconds=TARGET_SECONDS):
+    """Iterations for one PBKDF2 hash to take about target_seconds here"""
+    probe = 20_000
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac("sha256", b"probe", b"saltsaltsaltsalt", probe)
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    return max(MIN_ITERATIONS, int(probe * target_seconds / elapsed) // 1000 * 1000)
+
+
+def stored_iterations(users):
+    """The highest PBKDF2 iteration count among users' hashes, or None if none use PBKDF2"""
+    counts = [int(user["password"].split("$")[1]) for user in users.values()
+              if user.get("password", "").startswith(SCHEME + "$")]
+    return max(counts) if counts else None
+
+
+def hash_password(password, iterations):
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """(matches, iterations) for a stored hash; iterations is 0 for a legacy SHA-256 hash"""
+    if stored.startswith(SCHEME + "$"):
+        _, iterations, salt, digest = stored.split("$")
+        iterations = int(iterations)
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), iterations)
+        return hmac.compare_digest(candidate.hex(), digest), iterations
+    candidate = hashlib.sha256(password.encode("utf-8")).hexdigest()
+    return hmac.compare_digest(candidate, stored), 0
+
+
+class Credentials:
+    """Logins against a users dict, changed in place; the caller saves it, after failed logins too"""
+
+    def __init__(self, iterations=None, users=None):
+        self.iterations = iterations or stored_iterations(users or {}) or tune_iterations()
+        # Failed attempts for usernames with no account to keep them on
+        self._unknown = {}
+        # Checked against when the username does not exist, so that costs the same
+        self._dummy = None
+
+    def hash_password(self, password):
+        return hash_password(password, self.iterations)
+
+    def authenticate(self, users, username, password):
+        """The user's record if the password is right; raises LoginError otherwise"""
+        user = users.get(username)
+        attempts = user if user is not None else self._unknown.setdefault(username, {})
+        # Capped, in case the clock was set back since retry_after was saved
+        wait = min(attempts.get("retry_after", 0) - time.time(), MAX_DELAY)
+        if wait > 0:
+            raise LoginError(f"Too many failed attempts. Try again in {int(wait) + 1} seconds.")
+        if user is None and self._dummy is None:
+            self._dummy = self.hash_password(DEFAULT_PASSWORD)
+        matches, iterations = verify_password(password, user["password"] if user else self._dummy)
+        if not (user and matches):
+            failures = attempts.get("failed_logins", 0) + 1
+            attempts["failed_logins"] = failures
+            if failures > FREE_ATTEMPTS:
+                attempts["retry_after"] = time.time() + min(2 ** (failures - FREE_ATTEMPTS), MAX_DELAY)
+            raise LoginError("Invalid credentials!")
+        user.pop("failed_logins", None)
+        user.pop("retry_after", None)
+        if iterations < self.iterations:
+            user["password"] = self.hash_password(password)
+        if username == DEFAULT_USERNAME and password == DEFAULT_PASSWORD:
+            user["must_change_password"] = True
+        return user
+
+    def set_password(self, users, username, password):
+        """Give username a new password; raises LoginError if it is too weak"""
+        if len(password) < MIN_PASSWORD_LENGTH:
+            raise LoginError(f"Password must be at least {MIN_PASSWORD_LENGTH} characters.")
+        if password == DEFAULT_PASSWORD:
+            raise LoginError("Choose a password other than the default one.")
+        user = users[username]
+        user["password"] = self.hash_password(password)
+        user.pop("must_change_password", None)
+        user.pop("failed_logins", None)
+        user.pop("retry_after", None)
+
+    def seed_default(self, users):
+        """Add the default admin account to an empty users dict; True if it was added"""
+        if users:
+            return False
+        users[DEFAULT_USERNAME] = {
+            "password": self.hash_password(DEFAULT_PASSWORD),
+            "role": "admin",
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "last_login": None,
+            "must_change_password": True,
+        }
+        return True
@@ -0,0 +1,377 @@
+"""End-of-day CSVs and PDFs for one day, read straight from a till's data folder."""
+
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from pos_core.archive import ARCHIVE_DIR, SalesArchive
+from pos_core.inventory import SNAPSHOT_DIR, load_snapshot_index, snapshot_baseline
+from pos_core.store import PRODUCTS_FILE, iter_journal
+
+logger = logging.getLogger(__name__)
+
+END_OF_DAY_DIR = "End_of_Day"
+BATCH = 500
+QUEUE_DEPTH = 8
+MOVEMENT_COLUMNS = ("sale", "return", "receipt", "adjustment")
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _produce_archived(archive, day, put):
+    batch = []
+    for sale in archive.between(day, day):
+        batch.append(sale)
+        if len(batch) >= BATCH:
+            put(("sales", batch))
+            batch = []
+    if batch:
+        put(("sales", batch))
+
+
+def _catalogue_names(data_dir):
+    try:
+        with open(os.path.join(data_dir, PRODUCTS_FILE), "r", encoding="utf-8") as f:
+            return {barcode: product.get("name", "") for barcode, product in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def _produce_journal(data_dir, archive, day, put):
+    start, end = f"{day} 00:00:00", f"{day} 23:59:59"
+    snapshot_dir = os.path.join(data_dir, SNAPSHOT_DIR)
+    counts, since_seq = snapshot_baseline(snapshot_dir, load_snapshot_index(snapshot_dir), start)
+    archived = bool(archive.cutoff and day < archive.cutoff)
+    names = _catalogue_names(data_dir)
+    moved = set()
+    moves, sales = [], []
+    # Read to the end: a sale synced in from another till after its day still counts
+    for record in iter_journal(data_dir, since_seq):
+        if record["op"] == "product":
+            names[record["barcode"]] = record["product"].get("name", "")
+            if "moves" not in record:
+                # Older records carried stock in the product itself; only an
+                # opening count can be taken from them
+                if record["ts"] < start:
+                    counts[record["barcode"]] = record["product"].get("stock", 0)
+                continue
+        if record["ts"] < start:
+            for barcode, delta in record.get("moves", ()):
+                counts[barcode] = counts.get(barcode, 0) + delta
+            continue
+        if record["ts"] <= end:
+            reason = record.get("reason") or "adjustment"
+            for barcode, delta in record.get("moves", ()):
+                moved.add(barcode)
+                moves.append((barcode, reason, delta))
+        if record["op"] == "sale" and record["sale"]["date"][:10] == day:
+            # An archived day's sales come from the archive, bar any that synced in late
+            if not (archived and archive.holds(record["sale"])):
+                sales.append(record["sale"])
+        if len(moves) >= BATCH:
+            put(("moves", moves))
+            moves = []
+        if len(sales) >= BATCH:
+            put(("sales", sales))
+            sales = []
+    if moves:
+        put(("moves", moves))
+    if sales:
+        put(("sales", sales))
+    put(("opening", {barcode: counts.get(barcode, 0) for barcode in moved}))
+    put(("names", names))
+
+
+def _run_producer(target, args, out, stop):
+    def put(item):
+        if stop.is_set():
+            raise _Cancelled()
+        out.put(item)
+
+    try:
+        target(*args, put)
+    except _Cancelled:
+        pass
+    except Exception as e:
+        out.put(("error", e))
+    finally:
+        out.put(("done", None))
+
+
+class _Summaries:
+    """The day's running totals"""
+
+    def __init__(self, lines_writer):
+        self.lines_writer = lines_writer
+        self.products = {}
+        self.hours = {}
+        self.tenders = {}
+        self.discounts = {"sales": 0, "discounted": 0, "gross": 0, "discount": 0, "largest": 0}
+        self.cashier_discounts = {}
+        self.stock = {}
+        self.opening = {}
+        self.names = {}
+        self.sale_count = 0
+        self.return_count = 0
+        self.net = 0
+
+    def add_sales(self, sales):
+        for sale in sales:
+            total = sale.get("total") or 0
+            is_return = sale.get("type") == "return"
+            self.net += total
+            if is_return:
+                self.return_count += 1
+            else:
+                self.sale_count += 1
+            for item in sale["items"]:
+                amount = item["price"] * item["quantity"]
+                entry = self.products.setdefault(item["barcode"], {
+                    "barcode": item["barcode"], "name": item.get("name", ""),
+                    "units": 0, "returned": 0, "takings": 0})
+                if is_return:
+                    entry["returned"] -= item["quantity"]
+                else:
+                    entry["units"] += item["quantity"]
+                entry["takings"] += amount
+                self.lines_writer.writerow([sale.get("id", ""), sale["date"], sale.get("cashier", ""),
+                                            item["barcode"], item.get("name", ""), item["quantity"],
+                                            item["price"], amount])
+            hour = self.hours.setdefault(sale["date"][11:13], {
+                "hour": f"{sale['date'][11:13]}:00", "sales": 0, "items": 0, "takings": 0})
+            if not is_return:
+                hour["sales"] += 1
+                hour["items"] += sum(item["quantity"] for item in sale["items"])
+            hour["takings"] += total
+
+            tender = self.tenders.setdefault(sale.get("tender") or "cash", {
+                "tender": sale.get("tender") or "cash", "sales": 0, "tendered": 0,
+                "change": 0, "refunded": 0, "net": 0})
+            if is_return:
+                tender["refunded"] -= total
+            else:
+                tender["sales"] += 1
+                tender["tendered"] += sale.get("payment") or 0
+                tender["change"] += sale.get("change") or 0
+            tender["net"] += total
+
+            if not is_return:
+                discount = sale.get("discount") or 0
+                self.discounts["sales"] += 1
+                self.discounts["gross"] += sale.get("subtotal") or 0
+                cashier = self.cashier_discounts.setdefault(sale.get("cashier") or "", {
+                    "cashier": sale.get("cashier") or "", "sales": 0, "discounted": 0, "discount": 0})
+                cashier["sales"] += 1
+                if discount:
+                    self.discounts["discounted"] += 1
+                    self.discounts["discount"] += discount
+                    self.discounts["largest"] = max(self.discounts["largest"], discount)
+                    cashier["discounted"] += 1
+                    cashier["discount"] += discount
+
+    def add_moves(self, moves):
+        for barcode, reason, delta in moves:
+            entry = self.stock.setdefault(barcode, dict.fromkeys(MOVEMENT_COLUMNS, 0))
+            entry[reason if reason in entry else "adjustment"] += delta
+
+    def stock_rows(self):
+        rows = []
+        for barcode in sorted(self.stock):
+            entry = self.stock[barcode]
+            opening = self.opening.get(barcode, 0)
+            product = self.products.get(barcode)
+            rows.append({
+                "barcode": barcode,
+                "name": self.names.get(barcode) or (product["name"] if product else ""),
+                "opening": opening,
+                "sold": -entry["sale"],
+                "returned": entry["return"],
+                "received": entry["receipt"],
+                "adjusted": entry["adjustment"],
+                "closing": opening + sum(entry.values()),
+            })
+        return rows
+
+
+class _Pages:
+    """Lines of text on letter pages, a new page whenever one fills up"""
+
+    def __init__(self, path, title):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfgen import canvas
+
+        self.path = path
+        self.canvas = canvas.Canvas(path, pagesize=letter)
+        self.canvas.setFont("Helvetica-Bold", 16)
+        self.canvas.drawString(50, 750, title)
+        self.y = 726
+
+    def line(self, text, bold=False, indent=0):
+        if self.y < 50:
+            self.canvas.showPage()
+            self.y = 750
+        self.canvas.setFont("Helvetica-Bold" if bold else "Helvetica", 12 if bold else 10)
+        self.canvas.drawString(50 + indent, self.y, text)
+        self.y -= 18 if bold else 14
+
+    def gap(self):
+        self.y -= 8
+
+    def add_sales(self, sales):
+        for sale in sales:
+            kind = "RETURN " if sale.get("type") == "return" else ""
+            self.line(f"{sale['date'][11:]}  {sale.get('id', '')}  {sale.get('cashier', '')}  "
+                      f"{kind}{len(sale['items'])} lines  UGX {sale.get('total') or 0:,.0f}")
+
+    def save(self):
+        self.canvas.save()
+        return self.path
+
+
+def _open_pages(path, title):
+    try:
+        return _Pages(path, title)
+    except ImportError:
+        logger.warning("ReportLab is not installed; end-of-day PDFs skipped")
+        return None
+
+
+def _write_csv(path, rows, fields):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def end_of_day(data_dir, day, out_dir, title="END OF DAY REPORT"):
+    """Write the day's ("YYYY-MM-DD") CSVs and PDFs into out_dir; returns a summary dict"""
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    archive = SalesArchive(os.path.join(data_dir, ARCHIVE_DIR))
+    batches = queue.Queue(maxsize=QUEUE_DEPTH)
+    stop = threading.Event()
+    producers = [threading.Thread(target=_run_producer, args=(_produce_journal, (data_dir, archive, day),
+                                                              batches, stop), daemon=True)]
+    if archive.cutoff and day < archive.cutoff:
+        # A second archive reader: the journal producer's holds() checks use the first
+        producers.append(threading.Thread(target=_run_producer, args=(
+            _produce_archived, (SalesArchive(archive.directory), day), batches, stop), daemon=True))
+    for producer in producers:
+        producer.start()
+
+    journal = _open_pages(os.path.join(out_dir, "sale_journal.pdf"), f"SALE JOURNAL {day}")
+    error = None
+    try:
+        with open(os.path.join(out_dir, "sale_lines.csv"), "w", newline="", encoding="utf-8") as lines:
+            lines_writer = csv.writer(lines)
+            lines_writer.writerow(["sale", "date", "cashier", "barcode", "name", "quantity", "price", "amount"])
+            summaries = _Summaries(lines_writer)
+            running = len(producers)
+            while running:
+                kind, payload = batches.get()
+                if kind == "sales":
+                    summaries.add_sales(payload)
+                    if journal is not None:
+                        # Rendered while the producers read on
+                        journal.add_sales(payload)
+                elif kind == "moves":
+                    summaries.add_moves(payload)
+                elif kind == "opening":
+                    summaries.opening = payload
+                elif kind == "names":
+                    summaries.names = payload
+                elif kind == "error":
+                    error = error or payload
+                elif kind == "done":
+                    running -= 1
+    finally:
+        # If the consumer failed, producers may be blocked on a full queue
+        stop.set()
+        while any(producer.is_alive() for producer in producers):
+            try:
+                batches.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        archive.close()
+    if error is not None:
+        raise error
+
+    products = sorted(summaries.products.values(), key=lambda row: row["takings"], reverse=True)
+    hours = [summaries.hours[hour] for hour in sorted(summaries.hours)]
+    tenders = sorted(summaries.tenders.values(), key=lambda row: row["tender"])
+    discounts = dict(summaries.discounts)
+    discounts["average"] = discounts["discount"] / discounts["discounted"] if discounts["discounted"] else 0
+    discounts["share_of_gross"] = discounts["discount"] / discounts["gross"] if discounts["gross"] else 0
+    cashier_discounts = sorted(summaries.cashier_discounts.values(), key=lambda row: row["cashier"])
+    stock = summaries.stock_rows()
+
+    _write_csv(os.path.join(out_dir, "by_product.csv"), products,
+               ["barcode", "name", "units", "returned", "takings"])
+    _write_csv(os.path.join(out_dir, "by_hour.csv"), hours, ["hour", "sales", "items", "takings"])
+    _write_csv(os.path.join(out_dir, "tenders.csv"), tenders,
+               ["tender", "sales", "tendered", "change", "refunded", "net"])
+    _write_csv(os.path.join(out_dir, "discounts.csv"),
+               [dict(cashier="(all)", sales=discounts["sales"], discounted=discounts["discounted"],
+                     discount=discounts["discount"])] + cashier_discounts,
+               ["cashier", "sales", "discounted", "discount"])
+    _write_csv(os.path.join(out_dir, "stock_movement.csv"), stock,
+               ["barcode", "name", "opening", "sold", "returned", "received", "adjusted", "closing"])
+
+    summary = {
+        "day": day,
+        "sales": summaries.sale_count,
+        "returns": summaries.return_count,
+        "net": summaries.net,
+        "products": len(products),
+        "directory": out_dir,
+        "pdf": None,
+    }
+    if journal is not None:
+        journal.save()
+        pages = _Pages(os.path.join(out_dir, "end_of_day.pdf"), title)
+        _summary_pages(pages, summary, products, hours, tenders, discounts, cashier_discounts, stock)
+        summary["pdf"] = pages.save()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"End of day {day}: {summary['sales']} sales written to {out_dir} in {summary['seconds']}s")
+    return summary
+
+
+def _summary_pages(pages, summary, products, hours, tenders, discounts, cashier_discounts, stock):
+    line = pages.line
+    line(f"Day: {summary['day']}")
+    line(f"Sales: {summary['sales']}   Returns: {summary['returns']}   Net: UGX {summary['net']:,.0f}")
+    pages.gap()
+
+    line("Tenders", bold=True)
+    for row in tenders:
+        line(f"{row['tender']}: {row['sales']} sales, tendered UGX {row['tendered']:,.0f}, "
+             f"change UGX {row['change']:,.0f}, refunded UGX {row['refunded']:,.0f}, "
+             f"net UGX {row['net']:,.0f}", indent=10)
+    pages.gap()
+    line("Discounts", bold=True)
+    line(f"{discounts['discounted']} of {discounts['sales']} sales discounted, UGX {discounts['discount']:,.0f} "
+         f"({discounts['share_of_gross']:.1%} of gross), largest UGX {discounts['largest']:,.0f}", indent=10)
+    for row in cashier_discounts:
+        if row["discounted"]:
+            line(f"{row['cashier'] or '-'}: {row['discounted']} sales, UGX {row['discount']:,.0f}", indent=20)
+    pages.gap()
+    line("Sales by Hour", bold=True)
+    for row in hours:
+        line(f"{row['hour']}  {row['sales']} sales, {row['items']} items, UGX {row['takings']:,.0f}", indent=10)
+    pages.gap()
+    line("Top Products", bold=True)
+    for row in products[:25]:
+        line(f"{row['name'][:40]}  {row['units']} sold, {row['returned']} returned, UGX {row['takings']:,.0f}",
+             indent=10)
+    pages.gap()
+    line("Stock Movement", bold=True)
+    for row in sorted(stock, key=lambda row: row["sold"], reverse=True)[:40]:
+        line(f"{(row['name'] or row['barcode'])[:34]}  open {row['opening']}, sold {row['sold']}, "
+             f"returned {row['returned']}, received {row['received']}, adjusted {row['adjusted']}, "
+             f"close {row['closing']}", indent=10)
@@ -0,0 +1,157 @@
+"""Per-product sales-velocity forecasts (EWMA per weekday) for reorder quantities."""
+
+import json
+import logging
+import math
+import os
+from datetime import date, datetime, timedelta
+
+from pos_core.store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+FORECAST_FILE = "forecast_stats.json"
+
+
+def _to_date(text):
+    return datetime.strptime(text[:10], "%Y-%m-%d").date()
+
+
+def _weekday_counts(start, end):
+    """How many of each weekday fall in the days start..end-1"""
+    days = (end - start).days
+    counts = [days // 7] * 7
+    for offset in range(days % 7):
+        counts[(start + timedelta(days=offset)).weekday()] += 1
+    return counts
+
+
+class SalesForecaster:
+    """Per-product, per-weekday EWMA of daily units sold"""
+
+    def __init__(self, store, alpha=0.3, lead_time_days=7, safety_days=3):
+        self.store = store
+        self.alpha = alpha
+        self.lead_time_days = lead_time_days
+        self.safety_days = safety_days
+        # barcode -> {"ewma": [7 floats], "day": "YYYY-MM-DD", "units": units that day}
+        self.stats = {}
+        self.seq = 0
+        self._load()
+        store.subscribe(self._on_change)
+
+    # ----- persistence -----
+
+    def _load(self):
+        path = self.store.path(FORECAST_FILE)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                saved = json.load(f)
+            self.stats = saved["stats"]
+            self.seq = saved["seq"]
+            for record in self.store.iter_records(self.seq):
+                self._apply_record(record)
+        else:
+            self.rebuild()
+
+    def save(self):
+        with self.store.lock:
+            path = self.store.path(FORECAST_FILE)
+            # Tills sharing a folder all derive the same figures; keep the newest
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    if json.load(f)["seq"] >= self.seq:
+                        return
+            write_json_atomic(path, {"seq": self.seq, "stats": self.stats})
+
+    def rebuild(self):
+        """Recompute everything from the sales history (first run only)"""
+        self.stats = {}
+        for sale in sorted(self.store.sales, key=lambda s: s["date"]):
+            self.add_sale(sale)
+        self.seq = self.store.seq
+
+    # ----- updates -----
+
+    def _on_change(self, records):
+        for record in records:
+            if record["op"] == "reload" or (record["op"] == "rotate" and record.get("reload")):
+                self.rebuild()
+            elif record["op"] == "checkpoint":
+                self.save()
+            else:
+                self._apply_record(record)
+
+    def _apply_record(self, record):
+        if record["op"] == "sale":
+            self.add_sale(record["sale"])
+        if "seq" in record:
+            self.seq = max(self.seq, record["seq"])
+
+    def add_sale(self, sale):
+        day = sale["date"][:10]
+        for item in sale.get("items", ()):
+            self._add_units(item["barcode"], day, item["quantity"])
+
+    def _add_units(self, barcode, day, units):
+        stat = self.stats.get(barcode)
+        if stat is None:
+            self.stats[barcode] = {"ewma": [0.0] * 7, "day": day, "units": units}
+            return
+        if day > stat["day"]:
+            self._fold(stat, _to_date(day))
+        # Same day, or a late sale from a till with a slow clock
+        stat["units"] += units
+
+    def _fold(self, stat, new_day):
+        """Close the accumulating day and decay the empty days up to new_day"""
+        ewma = stat["ewma"]
+        last = _to_date(stat["day"])
+        weekday = last.weekday()
+        ewma[weekday] = self.alpha * stat["units"] + (1 - self.alpha) * ewma[weekday]
+        for weekday, count in enumerate(_weekday_counts(last + timedelta(days=1), new_day)):
+            if count:
+                ewma[weekday] *= (1 - self.alpha) ** count
+        stat["day"] = new_day.isoformat()
+        stat["units"] = 0
+
+    # ----- queries -----
+
+    def velocity(self, barcode, today=None):
+        """Expected units per day for each weekday, as of today"""
+        stat = self.stats.get(barcode)
+        if stat is None:
+            return [0.0] * 7
+        today = today or date.today()
+        if today.isoformat() <= stat["day"]:
+            return list(stat["ewma"])
+        # Fold a copy so queries never change the stored figures
+        copy = {"ewma": list(stat["ewma"]), "day": stat["day"], "units": stat["units"]}
+        self._fold(copy, today)
+        return copy["ewma"]
+
+    def daily_average(self, barcode, today=None):
+        return sum(self.velocity(barcode, today)) / 7
+
+    def suggest(self, barcode, on_hand, today=None):
+        """Units to order now so stock lasts the lead time plus the safety margin"""
+        today = today or date.today()
+        return self._suggest(self.velocity(barcode, today), on_hand, today)
+
+    def _suggest(self, ewma, on_hand, today):
+        demand = sum(ewma[(today + timedelta(days=offset)).weekday()]
+                     for offset in range(self.lead_time_days))
+        safety = self.safety_days * sum(ewma) / 7
+        return max(0, math.ceil(demand + safety - on_hand))
+
+    def suggestions(self, today=None):
+        """{barcode: (daily average, suggested quantity)} for every product that sells"""
+        today = today or date.today()
+        result = {}
+        for barcode in self.stats:
+            product = self.store.products.get(barcode)
+            if product is None:
+                continue
+            ewma = self.velocity(barcode, today)
+            result[barcode] = (sum(ewma) / 7, self._suggest(ewma, product.get("stock", 0), today))
+        return result
@@ -0,0 +1,266 @@
+"""Inventory engine: reasoned stock movements, cart reservations and on-hand snapshots."""
+
+import bisect
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from pos_core.store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = "stock_snapshots"
+SNAPSHOT_INDEX = "index.jsonl"
+
+
+def load_snapshot_index(snapshot_dir):
+    """The stock snapshots taken so far, oldest first: dicts with seq, ts and file"""
+    index = []
+    path = os.path.join(snapshot_dir, SNAPSHOT_INDEX)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    index.append(json.loads(line))
+    return index
+
+
+def snapshot_baseline(snapshot_dir, index, when):
+    """({barcode: on hand}, seq) from the last snapshot taken at or before "YYYY-mm-dd HH:MM:SS" when
+
+    Replaying the journal after seq brings the counts forward; with no
+    snapshot that early, it is ({}, 0) and the replay starts at the beginning.
+    """
+    position = bisect.bisect_right([entry["ts"] for entry in index], when)
+    if not position:
+        return {}, 0
+    entry = index[position - 1]
+    with open(os.path.join(snapshot_dir, entry["file"]), "r") as f:
+        return json.load(f)["on_hand"], entry["seq"]
+
+
+class InventoryError(Exception):
+    """Raised when a stock operation cannot be carried out"""
+
+
+class InventoryEngine:
+    """Reservations, stock movements and point-in-time stock queries"""
+
+    def __init__(self, store):
+        self.store = store
+        self.reserved = defaultdict(int)
+        self.snapshot_dir = store.path(SNAPSHOT_DIR)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        self._snapshot_index = load_snapshot_index(self.snapshot_dir)
+        store.subscribe(self._on_change)
+
+    # ----- counts -----
+
+    def on_hand(self, barcode):
+        product = self.store.products.get(barcode)
+        return product.get("stock", 0) if product else 0
+
+    def available(self, barcode):
+        """On hand minus what open carts on this till are holding"""
+        return self.on_hand(barcode) - self.reserved.get(barcode, 0)
+
+    # ----- reservations (local to this till, never journaled) -----
+
+    def reserve(self, barcode, quantity=1):
+        """Hold stock for the cart; False if there is not enough available"""
+        if barcode not in self.store.products or self.available(barcode) < quantity:
+            return False
+        self.reserved[barcode] += quantity
+        return True
+
+    def release(self, barcode, quantity=None):
+        """Give back reserved stock (all of it when quantity is None)"""
+        held = self.reserved.get(barcode, 0)
+        quantity = held if quantity is None else min(quantity, held)
+        if held - quantity > 0:
+            self.reserved[barcode] = held - quantity
+        else:
+            self.reserved.pop(barcode, None)
+
+    def release_all(self):
+        self.reserved.clear()
+
+    # ----- movements -----
+
+    def commit_sale(self, sale, lines):
+        """Journal the sale with one "sale" movement per line, then drop the holds
+
+        Raises InventoryError, writing nothing, if a till sharing the data
+        folder has sold the stock since it was reserved here.
+        """
+        wanted = defaultdict(int)
+        for line in lines:
+            if line["barcode"] in self.store.products:
+                wanted[line["barcode"]] += line["quantity"]
+        with self.store.lock:
+            # Other tills' sales, read under the lock so none can slip in before ours
+            self.store.poll()
+            short = [barcode for barcode, quantity in wanted.items() if self.on_hand(barcode) < quantity]
+            if short:
+                names = ", ".join(self.store.products[barcode].get("name", barcode) for barcode in short)
+                raise InventoryError(f"Not enough stock left for: {names}")
+            record = self.store.commit_sale(sale, [(barcode, -quantity) for barcode, quantity in wanted.items()])
+        for line in lines:
+            self.release(line["barcode"], line["quantity"])
+        return record
+
+    def save_product(self, barcode, product, stock=None):
+        """Add or update a product; a stock change becomes a receipt/adjustment movement"""
+        product = dict(product)
+        product.pop("stock", None)
+        existing = barcode in self.store.products
+        moves = []
+        if stock is not None and stock != self.on_hand(barcode):
+            moves = [(barcode, stock - self.on_hand(barcode))]
+        return self.store.upsert_product(
+            barcode, product, moves=moves,
+            reason="adjustment" if existing else "receipt"
+        )
+
+    # ----- history -----
+
+    def stock_as_of(self, when, barcodes=None):
+        """On-hand counts at datetime/"YYYY-mm-dd HH:MM:SS" when"""
+        if isinstance(when, datetime):
+            when = when.strftime("%Y-%m-%d %H:%M:%S")
+        wanted = set(barcodes) if barcodes is not None else None
+
+        counts, since_seq = self.baseline(when)
+        if wanted is not None:
+            counts = {b: c for b, c in counts.items() if b in wanted}
+
+        for record in self.store.iter_records(since_seq):
+            if record["ts"] > when:
+                break
+            if record["op"] == "product" and "moves" not in record:
+                # Older records carried stock in the product itself
+                barcode = record["barcode"]
+                if wanted is None or barcode in wanted:
+                    counts[barcode] = record["product"].get("stock", 0)
+            for barcode, delta in record.get("moves", ()):
+                if wanted is None or barcode in wanted:
+                    counts[barcode] = counts.get(barcode, 0) + delta
+        return counts
+
+    def baseline(self, when):
+        """({barcode: on hand}, seq) from the last snapshot taken at or before when; see snapshot_baseline()"""
+        return snapshot_baseline(self.snapshot_dir, self._snapshot_index, when)
+
+    # ----- snapshots -----
+
+    def _on_change(self, records):
+        for record in records:
+            if record["op"] == "checkpoint":
+                self.snapshot(record["seq"], record["ts"])
+
+    def snapshot(self, seq=None, ts=None):
+        """Save on-hand counts at the store's current seq"""
+        with self.store.lock:
+            seq = self.store.seq if seq is None else seq
+            ts = ts or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Another till sharing the folder may have written one already
+            self._snapshot_index = load_snapshot_index(self.snapshot_dir)
+            if self._snapshot_index and self._snapshot_index[-1]["seq"] >= seq:
+                return
+            name = f"stock_{seq:012d}.json"
+            write_json_atomic(os.path.join(self.snapshot_dir, name), {
+                "seq": seq,
+                "ts": ts,
+                "on_hand": {b: p.get("stock", 0) for b, p in self.store.products.items()},
+            })
+            entry = {"seq": seq, "ts": ts, "file": name}
+            with open(os.path.join(self.snapshot_dir, SNAPSHOT_INDEX), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._snapshot_index.append(entry)
+
+
+class StockEdits:
+    """Inventory cells edited since the last save, saved as adjustments against the count first shown"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.shown = {}           # barcode -> count on screen before editing
+        self.counts = {}          # barcode -> counted stock
+        self.reorder_points = {}  # barcode -> new reorder point (None for the default)
+
+    def __len__(self):
+        return len(set(self.counts) | set(self.reorder_points))
+
+    def set_count(self, barcode, text, shown):
+        """Record an edited count; raises InventoryError if text is not a valid count"""
+        if barcode not in self.engine.store.products:
+            raise InventoryError(f"Product {barcode} no longer exists")
+        try:
+            counted = int(str(text).strip())
+        except ValueError:
+            raise InventoryError(f"Invalid stock value: {text}")
+        if counted < 0:
+            raise InventoryError("Stock cannot be negative")
+        shown = self.shown.setdefault(barcode, int(shown))
+        if counted == shown:
+            self.counts.pop(barcode, None)
+        else:
+            self.counts[barcode] = counted
+        return counted
+
+    def set_reorder_point(self, barcode, text):
+        """Record an edited reorder point; blank means use the default"""
+        product = self.engine.store.products.get(barcode)
+        if product is None:
+            raise InventoryError(f"Product {barcode} no longer exists")
+        text = str(text).strip()
+        try:
+            point = int(text) if text else None
+        except ValueError:
+            raise InventoryError(f"Invalid reorder point: {text}")
+        if point is not None and point < 0:
+            raise InventoryError("Reorder point cannot be negative")
+        if point == product.get("reorder_point"):
+            self.reorder_points.pop(barcode, None)
+        else:
+            self.reorder_points[barcode] = point
+        return point
+
+    def is_dirty(self, barcode):
+        return barcode in self.counts or barcode in self.reorder_points
+
+    def save(self):
+        """Write every pending edit as one batch
+
+        Returns ({barcode: [shown, counted]}, {barcode: [old, new] reorder
+        point}) for the edits committed; products deleted meanwhile are left
+        out. If the commit fails the edits stay pending.
+        """
+        products = self.engine.store.products
+        changes = []
+        counts = {barcode: [self.shown[barcode], counted]
+                  for barcode, counted in self.counts.items() if barcode in products}
+        if counts:
+            changes.append({"op": "stock", "reason": "adjustment",
+                            "moves": [[barcode, counted - shown] for barcode, (shown, counted) in counts.items()]})
+        points = {}
+        for barcode, point in self.reorder_points.items():
+            if barcode not in products:
+                continue
+            product = dict(products[barcode])
+            points[barcode] = [product.get("reorder_point"), point]
+            product.pop("stock", None)
+            if point is None:
+                product.pop("reorder_point", None)
+            else:
+                product["reorder_point"] = point
+            # No moves: the upsert leaves the product's stock alone
+            changes.append({"op": "product", "barcode": barcode, "product": product, "moves": []})
+        self.engine.store.commit_batch(changes)
+
+        self.shown.update(self.counts)
+        self.counts.clear()
+        self.reorder_points.clear()
+        return counts, points
@@ -0,0 +1,92 @@
+"""Where the POS keeps its files: home, shared data folder, backups and receipts."""
+
+import argparse
+import os
+import shutil
+
+SETTINGS_FILE = "settings.json"
+USERS_FILE = "users.json"
+
+
+def default_home():
+    if os.environ.get("POS_DATA_DIR"):
+        return os.environ["POS_DATA_DIR"]
+    if os.environ.get("APPDATA"):
+        return os.path.join(os.environ["APPDATA"], "POS_System")
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "pos_system")
+
+
+class DataLocations:
+    """Resolved folders and files for one till"""
+
+    def __init__(self, home=None, shared=None):
+        self.home = os.path.abspath(home or default_home())
+        shared = shared or os.environ.get("POS_SHARED_DIR")
+        self.shared = os.path.abspath(shared) if shared else None
+        os.makedirs(self.home, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, argv=None):
+        """Locations from --data-dir/--shared-dir in argv, ignoring any other arguments"""
+        args, _ = location_arguments().parse_known_args(argv)
+        return cls(args.data_dir, args.shared_dir)
+
+    def use_shared(self, shared):
+        """Share the data store from this folder, unless a flag or $POS_SHARED_DIR already chose one"""
+        if shared and not self.shared:
+            self.shared = os.path.abspath(shared)
+
+    @property
+    def data_dir(self):
+        return self.shared or self.home
+
+    @property
+    def settings_file(self):
+        return os.path.join(self.home, SETTINGS_FILE)
+
+    @property
+    def users_file(self):
+        return os.path.join(self.home, USERS_FILE)
+
+    @property
+    def log_dir(self):
+        return self.home
+
+    @property
+    def outbox_dir(self):
+        # Kept on this machine even when the data folder is shared
+        return self.home
+
+    def backups_dir(self, settings=None):
+        return (settings or {}).get("backup_dir") or os.path.join(
+            os.path.expanduser("~"), "Desktop", "POS_System_Backups")
+
+    def receipts_dir(self, settings=None):
+        path = (settings or {}).get("receipts_dir") or os.path.join(
+            os.path.expanduser("~"), "Desktop", "POS_Receipts")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def legacy_file(self, name):
+        """name in the working directory, if an older version left it there (and it is not ours)"""
+        path = os.path.abspath(name)
+        if os.path.exists(path) and path not in (os.path.join(self.home, name), os.path.join(self.data_dir, name)):
+            return path
+        return None
+
+    def adopt_legacy_settings(self):
+        """Copy settings.json across from the working directory the first time"""
+        legacy = self.legacy_file(SETTINGS_FILE)
+        if legacy and not os.path.exists(self.settings_file):
+            shutil.copy2(legacy, self.settings_file)
+            return True
+        return False
+
+
+def location_arguments(parser=None):
+    """Add --data-dir/--shared-dir to parser (or a new one)"""
+    parser = parser or argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--data-dir", help="this till's data folder (or set POS_DATA_DIR)")
+    parser.add_argument("--shared-dir", help="data folder shared by several tills (or set POS_SHARED_DIR)")
+    return parser
@@ -0,0 +1,83 @@
+"""Logging through a queue to rotating JSON-lines files, so callers never wait on the disk."""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FILE = "pos_system.log"
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# Attributes every LogRecord has; anything else came in through extra=
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Resolves the message and traceback on the caller's thread, keeping them separate"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def set_levels(level=None, levels=None):
+    """Set the root level (default $POS_LOG_LEVEL or INFO) and any per-logger levels"""
+    level = level or os.environ.get("POS_LOG_LEVEL") or "INFO"
+    logging.getLogger().setLevel(level.upper())
+    for name, name_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(name_level.upper())
+
+
+def setup_logging(log_dir, level=None, levels=None, max_bytes=MAX_BYTES,
+                  backup_count=BACKUP_COUNT, console=False):
+    """Route all logging through a queue to a rotating JSON log file; returns the started listener
+
+    Call listener.stop() at exit to write out what is still queued.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    handlers = [logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, LOG_FILE), maxBytes=max_bytes,
+        backupCount=backup_count, encoding="utf-8")]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    set_levels(level, levels)
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,270 @@
+"""Durable outbox forwarding committed sales to head office, with idempotency keys and backoff."""
+
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pos_core.store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_FILE = "sales_outbox.jsonl"
+OUTBOX_STATE_FILE = "sales_outbox_state.json"
+
+
+class SalesOutbox:
+    """Append-only queue of this till's sales with a background flusher"""
+
+    def __init__(self, store, url, directory=None, batch_size=200,
+                 max_backoff=300, timeout=10):
+        self.store = store
+        self.url = url
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        directory = directory or store.data_dir
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, OUTBOX_FILE)
+        self.state_path = os.path.join(directory, OUTBOX_STATE_FILE)
+
+        self.sent_offset = 0
+        self.enqueued_seq = store.seq
+        self.last_error = None
+        self.online = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._load_state()
+        self._catch_up()
+        store.subscribe(self._on_change)
+
+    # ----- state -----
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            self.sent_offset = state["sent_offset"]
+            self.enqueued_seq = state["enqueued_seq"]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self.sent_offset > size:
+            # Crashed between compacting the file and saving the state
+            self.sent_offset = 0
+        last = self._last_entry()
+        if last is not None:
+            self.enqueued_seq = max(self.enqueued_seq, last["seq"])
+
+    def _save_state(self):
+        write_json_atomic(self.state_path, {
+            "sent_offset": self.sent_offset,
+            "enqueued_seq": self.enqueued_seq,
+        })
+
+    def _last_entry(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            lines = f.read().split(b"\n")
+        for line in reversed(lines):
+            if line.strip():
+                try:
+                    return json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash, the sale is re-enqueued below
+                    continue
+        return None
+
+    def _catch_up(self):
+        """Enqueue own sales that reached the journal but not the outbox"""
+        for record in self.store.iter_records(self.enqueued_seq):
+            self._enqueue_record(record)
+
+    # ----- enqueue (till thread) -----
+
+    def _on_change(self, records):
+        for record in records:
+            self._enqueue_record(record)
+
+    def _enqueue_record(self, record):
+        if (record["op"] != "sale" or record["till"] != self.store.till_id
+                or "origin" in record or record["seq"] <= self.enqueued_seq):
+            return
+        entry = {
+            "key": f"{record['till']}-{record['seq']}",
+            "seq": record["seq"],
+            "sale": record["sale"],
+        }
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.enqueued_seq = record["seq"]
+        self._wake.set()
+
+    def pending_bytes(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return size - self.sent_offset
+
+    # ----- flushing (background thread) -----
+
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.store.unsubscribe(self._on_change)
+
+    def _read_batch(self):
+        entries = []
+        end_offset = self.sent_offset
+        if not os.path.exists(self.path):
+            return entries, end_offset
+        with open(self.path, "rb") as f:
+            f.seek(self.sent_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                end_offset += len(line)
+                if line.strip():
+                    entries.append(json.loads(line))
+                if len(entries) >= self.batch_size:
+                    break
+        return entries, end_offset
+
+    def _send(self, entries):
+        payload = {
+            "till": self.store.till_id,
+            "sales": [{"key": e["key"], "sale": e["sale"]} for e in entries],
+        }
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode("utf-8"),
+            method="POST",
+            headers={
+                "Content-Type": "application/json",
+                "Idempotency-Key": f"{entries[0]['key']}..{entries[-1]['key']}",
+            }
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _ack(self, end_offset):
+        with self._lock:
+            self.sent_offset = end_offset
+            if self.sent_offset == os.path.getsize(self.path):
+                # Everything is delivered, start the file over
+                with open(self.path, "wb"):
+                    pass
+                self.sent_offset = 0
+            self._save_state()
+
+    def flush_once(self):
+        """Send one batch; returns how many sales went out"""
+        entries, end_offset = self._read_batch()
+        if not entries:
+            if end_offset != self.sent_offset:
+                self._ack(end_offset)
+            return 0
+        self._send(entries)
+        self._ack(end_offset)
+        return len(entries)
+
+    def _flush_loop(self):
+        backoff = 1
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                if self.flush_once():
+                    self.online = True
+                    self.last_error = None
+                    backoff = 1
+                    continue
+                self._wake.wait(30)
+            except Exception as e:
+                self.online = False
+                self.last_error = str(e)
+                # Jittered so tills coming back after an outage don't stampede
+                delay = backoff * random.uniform(0.5, 1.0)
+                logger.warning(f"Head office upload failed, retrying in {delay:.1f}s: {e}")
+                self._stop.wait(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+class MockHeadOffice:
+    """Local stand-in for the head-office endpoint, for testing the outbox"""
+
+    def __init__(self, host="127.0.0.1", port=0, fail=False):
+        self.fail = fail
+        self.received = {}
+        self.requests = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with mock._lock:
+                    mock.requests += 1
+                    if mock.fail:
+                        self.send_response(503)
+                        self.end_headers()
+                        return
+                    for item in json.loads(body)["sales"]:
+                        if item["key"] in mock.received:
+                            mock.duplicates += 1
+                        mock.received[item["key"]] = item["sale"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"ok": true}')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}/sales"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Head-office outbox tools")
+    parser.add_argument("--mock", action="store_true", help="run a mock head-office endpoint")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args(argv)
+    if not args.mock:
+        parser.error("nothing to do (use --mock)")
+    mock = MockHeadOffice(host="0.0.0.0", port=args.port).start()
+    print(f"Mock head office listening on {mock.url}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{len(mock.received)} sales received, {mock.duplicates} duplicates")
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Per-cashier, per-day performance rollups."""
+
+import json
+import logging
+import os
+
+from pos_core.store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE = "cashier_stats.json"
+
+
+def _bucket():
+    return {
+        "sales": 0, "items": 0, "total": 0,
+        "timed": 0, "timed_items": 0, "scan_seconds": 0,
+        "hours": 0, "returns": 0, "refunded": 0,
+    }
+
+
+def add_sale(buckets, sale):
+    """Fold one sale into {cashier: {day: bucket}}"""
+    cashier = sale.get("cashier")
+    if not cashier:
+        return
+    bucket = buckets.setdefault(cashier, {}).setdefault(sale["date"][:10], _bucket())
+    if sale.get("type") == "return":
+        bucket["returns"] += 1
+        bucket["refunded"] -= sale["total"]
+        return
+    items = sum(item["quantity"] for item in sale["items"])
+    bucket["sales"] += 1
+    bucket["items"] += items
+    bucket["total"] += sale["total"]
+    bucket["hours"] |= 1 << int(sale["date"][11:13] or 0)
+    if sale.get("scan_seconds") is not None:
+        bucket["timed"] += 1
+        bucket["timed_items"] += items
+        bucket["scan_seconds"] += sale["scan_seconds"]
+
+
+class CashierStats:
+    """Per-cashier, per-day rollups over the store's sales and its archive"""
+
+    def __init__(self, store, archive=None):
+        self.store = store
+        self.archive = archive
+        self.recent = {}
+        self._indexed = 0
+        self.rebuild()
+        store.subscribe(self._on_change)
+
+    def rebuild(self):
+        """Recount the store's own sales; only needed at startup and after a reload"""
+        self.recent = {}
+        self._indexed = 0
+        self._catch_up()
+
+    def _catch_up(self):
+        sales = self.store.sales
+        for position in range(self._indexed, len(sales)):
+            sale = sales[position]
+            # Left in the store by a crash mid-archive
+            if not (self.archive is not None and self.archive.holds(sale)):
+                add_sale(self.recent, sale)
+        self._indexed = len(sales)
+
+    def _on_change(self, records):
+        if any(r["op"] == "reload" or (r["op"] == "rotate" and r.get("reload")) for r in records):
+            self.rebuild()
+        elif any(r["op"] == "sale" for r in records):
+            self._catch_up()
+
+    def _archived(self):
+        """{segment: buckets}, working out (and saving) any segment not seen yet"""
+        if self.archive is None:
+            return {}
+        path = os.path.join(self.archive.directory, STATS_FILE)
+        saved = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                saved = json.load(f)
+        # Keyed by name and size, in case a restore brings back a different file by that name
+        segments = {f"{entry['file']}:{entry['bytes']}": entry["file"]
+                    for entry in self.archive.index["segments"] if entry["count"]}
+        missing = [key for key in segments if key not in saved]
+        for key in missing:
+            buckets = {}
+            for sale in self.archive.read_segment(segments[key]):
+                add_sale(buckets, sale)
+            saved[key] = buckets
+        if missing:
+            write_json_atomic(path, saved)
+            logger.info("Cashier stats worked out for %s archived segments", len(missing))
+        return {key: saved[key] for key in segments}
+
+    # ----- reports -----
+
+    def report(self, start=None, end=None):
+        """One row per cashier for the days start..end ("YYYY-MM-DD", inclusive), busiest first"""
+        totals = {}
+        for buckets in list(self._archived().values()) + [self.recent]:
+            for cashier, days in buckets.items():
+                for day, bucket in days.items():
+                    if (start and day < start) or (end and day > end):
+                        continue
+                    total = totals.setdefault(cashier, _bucket())
+                    for key, value in bucket.items():
+                        # Hours are per day: count the bits, not OR them across days
+                        total[key] += bin(value).count("1") if key == "hours" else value
+        rows = []
+        for cashier, total in totals.items():
+            minutes = total["scan_seconds"] / 60
+            rows.append({
+                "cashier": cashier,
+                "sales": total["sales"],
+                "items": total["items"],
+                "total": total["total"],
+                "active_hours": total["hours"],
+                "sales_per_hour": total["sales"] / total["hours"] if total["hours"] else 0,
+                "items_per_minute": total["timed_items"] / minutes if minutes else 0,
+                "avg_scan_seconds": total["scan_seconds"] / total["timed"] if total["timed"] else 0,
+                "returns": total["returns"],
+                "refunded": total["refunded"],
+            })
+        rows.sort(key=lambda row: row["total"], reverse=True)
+        return rows
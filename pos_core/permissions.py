@@ -0,0 +1,97 @@
+"""What each role may do, as capability bitsets."""
+
+from enum import IntFlag
+
+
+class Capability(IntFlag):
+    SELL = 1 << 0
+    RETURNS = 1 << 1
+    SHIFT = 1 << 2
+    TODAYS_SALES = 1 << 3
+    INVENTORY = 1 << 4
+    ADD_PRODUCT = 1 << 5
+    SALES_HISTORY = 1 << 6
+    DASHBOARD = 1 << 7
+    REPORTS = 1 << 8
+    REORDER = 1 << 9
+    SETTINGS = 1 << 10
+    BACKUP = 1 << 11
+    RESTORE = 1 << 12
+    MANAGE_USERS = 1 << 13
+    AUDIT = 1 << 14
+
+
+_CASHIER = Capability.SELL | Capability.RETURNS | Capability.SHIFT | Capability.TODAYS_SALES
+_MANAGER = (_CASHIER | Capability.INVENTORY | Capability.ADD_PRODUCT | Capability.SALES_HISTORY
+            | Capability.DASHBOARD | Capability.REPORTS | Capability.REORDER | Capability.BACKUP)
+
+ROLE_CAPABILITIES = {
+    "cashier": int(_CASHIER),
+    "manager": int(_MANAGER),
+    "admin": int(~Capability(0)),
+}
+
+# (action, nav button label or None, capability), in nav order.
+# The action is the name of the POS method that carries it out.
+ACTIONS = [
+    ("show_inventory", "Inventory", Capability.INVENTORY),
+    ("show_sales_history", "Sales History", Capability.SALES_HISTORY),
+    ("show_returns", "Returns", Capability.RETURNS),
+    ("show_dashboard", "Dashboard", Capability.DASHBOARD),
+    ("show_cashier_report", "Cashier Report", Capability.REPORTS),
+    ("show_shift", "Shift", Capability.SHIFT),
+    ("show_todays_sales", "Today's Sales", Capability.TODAYS_SALES),
+    ("show_settings", "Settings", Capability.SETTINGS),
+    ("backup_data", "Backup Data", Capability.BACKUP),
+    ("restore_data", "Restore Data", Capability.RESTORE),
+    ("show_user_management", "Manage Users", Capability.MANAGE_USERS),
+    ("show_audit_log", "Audit Log", Capability.AUDIT),
+    ("add_product_dialog", "Add Product", Capability.ADD_PRODUCT),
+    ("scan_barcode", "Scan Barcode", Capability.SELL),
+    ("show_reorder_report", "Reorder Alerts", Capability.REORDER),
+    ("print_receipt", None, Capability.SELL),
+    ("clear_cart", None, Capability.SELL),
+]
+
+# Key -> actions it tries in turn; the first the role may do runs
+HOTKEYS = {
+    "<F2>": ("add_product_dialog",),
+    "<F3>": ("scan_barcode",),
+    "<F4>": ("print_receipt",),
+    "<F5>": ("clear_cart",),
+    "<F6>": ("show_inventory", "show_todays_sales"),
+    "<F7>": ("show_sales_history",),
+    "<F8>": ("show_dashboard",),
+    "<F9>": ("show_settings",),
+    "<F10>": ("backup_data",),
+    "<F11>": ("restore_data",),
+    "<F12>": ("show_user_management",),
+    "<Control-r>": ("show_returns",),
+}
+
+ACTION_CAPABILITIES = {action: int(capability) for action, _, capability in ACTIONS}
+
+
+def capabilities(role):
+    """The role's capability bitset"""
+    return ROLE_CAPABILITIES.get(role, int(Capability.SELL))
+
+
+def allowed(mask, action):
+    """Whether a capability bitset covers an action; unknown actions are never allowed"""
+    needed = ACTION_CAPABILITIES.get(action)
+    return needed is not None and mask & needed == needed
+
+
+def nav_actions(mask):
+    """(action, label) for the nav buttons the bitset allows, in order"""
+    return [(action, label) for action, label, capability in ACTIONS
+            if label and mask & capability == capability]
+
+
+def hotkey_action(mask, key):
+    """The action a key runs for the bitset, or None"""
+    for action in HOTKEYS.get(key, ()):
+        if allowed(mask, action):
+            return action
+    return None
@@ -0,0 +1,189 @@
+"""Compact slot-backed records for products, sales and sale lines that behave like dicts."""
+
+import sys
+from collections.abc import Mapping, MutableMapping
+
+_MISSING = object()
+
+
+def to_json(value):
+    """json.dumps default= hook for records"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, Mapping):
+        # e.g. a catalogue view standing in for the products dict
+        return dict(value.items())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Record(MutableMapping):
+    """Dict-like record: the keys in FIELDS live in "_<key>" slots, any others in an overflow dict"""
+
+    __slots__ = ("_extra",)
+    FIELDS = ()
+    INTERNED = ()
+    _ATTRS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._ATTRS = {field: "_" + field for field in cls.FIELDS}
+
+    def __init__(self, data=(), **fields):
+        for attr in self._ATTRS.values():
+            setattr(self, attr, _MISSING)
+        self._extra = None
+        items = data.items() if hasattr(data, "items") else data
+        for key, value in items:
+            self[key] = value
+        for key, value in fields.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build from a plain dict; the fast path used when loading files"""
+        self = cls.__new__(cls)
+        present = 0
+        for field, attr in cls._ATTRS.items():
+            value = data.get(field, _MISSING)
+            if value is not _MISSING:
+                present += 1
+                if type(value) is str and field in cls.INTERNED:
+                    value = sys.intern(value)
+            setattr(self, attr, value)
+        self._extra = None
+        if present < len(data):
+            self._extra = {k: v for k, v in data.items() if k not in cls._ATTRS}
+        return self
+
+    def __getitem__(self, key):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            if type(value) is str and key in self.INTERNED:
+                value = sys.intern(value)
+            setattr(self, attr, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            if getattr(self, attr) is _MISSING:
+                raise KeyError(key)
+            setattr(self, attr, _MISSING)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+            if not self._extra:
+                self._extra = None
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for field, attr in self._ATTRS.items():
+            if getattr(self, attr) is not _MISSING:
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        count = sum(1 for attr in self._ATTRS.values() if getattr(self, attr) is not _MISSING)
+        return count + (len(self._extra) if self._extra is not None else 0)
+
+    # Faster than the generic Mapping versions, these are on the hot paths
+    def get(self, key, default=None):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            return default if value is _MISSING else value
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            return getattr(self, attr) is not _MISSING
+        return self._extra is not None and key in self._extra
+
+    def to_dict(self):
+        result = {}
+        for field, attr in self._ATTRS.items():
+            value = getattr(self, attr)
+            if value is not _MISSING:
+                result[field] = value
+        if self._extra is not None:
+            result.update(self._extra)
+        return result
+
+    def copy(self):
+        """A plain dict, like dict.copy() gave before"""
+        return self.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class Product(Record):
+    """A catalogue entry"""
+
+    FIELDS = ("barcode", "name", "price", "stock", "type")
+    __slots__ = tuple("_" + field for field in FIELDS)
+    INTERNED = ("barcode", "name", "type")
+
+    @classmethod
+    def from_json(cls, barcode, data):
+        """Product for the catalogue key barcode; the key string is shared, not copied"""
+        product = cls.from_dict(data)
+        product._barcode = barcode
+        return product
+
+
+class SaleLine(Record):
+    """One line of a committed sale"""
+
+    FIELDS = ("barcode", "name", "price", "quantity")
+    __slots__ = tuple("_" + field for field in FIELDS)
+    INTERNED = ("barcode", "name")
+
+
+class Sale(Record):
+    """A committed sale; its items are SaleLines"""
+
+    FIELDS = ("id", "date", "till", "cashier", "items", "subtotal", "discount", "total", "payment",
+              "change", "scan_seconds")
+    __slots__ = tuple("_" + field for field in FIELDS)
+    INTERNED = ("till", "cashier")
+
+    def __setitem__(self, key, value):
+        if key == "items" and isinstance(value, list):
+            value = [item if isinstance(item, SaleLine) else SaleLine.from_dict(item) for item in value]
+        super().__setitem__(key, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        self = super().from_dict(data)
+        items = self._items
+        if isinstance(items, list):
+            self._items = [item if isinstance(item, SaleLine) else SaleLine.from_dict(item) for item in items]
+        return self
+
+
+def products_from_json(products):
+    """{barcode: Product} from a {barcode: dict} catalogue"""
+    return {sys.intern(barcode): Product.from_json(sys.intern(barcode), product)
+            for barcode, product in products.items()}
+
+
+def sales_from_json(sales):
+    return [sale if isinstance(sale, Sale) else Sale.from_dict(sale) for sale in sales]
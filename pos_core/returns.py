@@ -0,0 +1,103 @@
+"""Refunds and returns against past sales, committed as negative sales."""
+
+import re
+from datetime import datetime
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class ReturnError(Exception):
+    """Raised when a return cannot be carried out"""
+
+
+class Returns:
+    """Look up past sales and refund items from them"""
+
+    def __init__(self, store, sale_index):
+        self.store = store
+        self.sale_index = sale_index
+
+    def find(self, text, limit=50):
+        """Sales matching a sale ID, a day (YYYY-MM-DD) or a barcode, newest first"""
+        text = text.strip()
+        if not text:
+            return []
+        sale = self.sale_index.get(text)
+        if sale is not None:
+            return [sale]
+        if DATE_PATTERN.match(text):
+            sales = list(self.sale_index.between(text, text))
+            return sales[::-1][:limit]
+        return self.sale_index.with_barcode(text, limit)
+
+    def returnable(self, sale):
+        """{barcode: quantity} of sale's lines not yet returned"""
+        if sale.get("type") == "return":
+            return {}
+        remaining = {}
+        for item in sale["items"]:
+            remaining[item["barcode"]] = remaining.get(item["barcode"], 0) + item["quantity"]
+        for refund in self.sale_index.returns_of(sale.get("id")) if sale.get("id") else ():
+            for item in refund["items"]:
+                if item["barcode"] in remaining:
+                    # Return lines carry negative quantities
+                    remaining[item["barcode"]] += item["quantity"]
+        return {barcode: quantity for barcode, quantity in remaining.items() if quantity > 0}
+
+    def refund(self, sale, quantities, restock=True, cashier=None):
+        """Return quantities ({barcode: units}) of sale; commits and returns the refund sale
+
+        The refund for each line is its price less the line's share of the
+        original discount. With restock=False (damaged goods) nothing goes
+        back on the shelf.
+        """
+        if not sale.get("id"):
+            raise ReturnError("Only sales with a sale ID can be returned")
+        with self.store.lock:
+            # Another till may have refunded the same sale a moment ago
+            self.store.poll()
+            remaining = self.returnable(sale)
+            quantities = {barcode: units for barcode, units in quantities.items() if units}
+            if not quantities:
+                raise ReturnError("Nothing selected to return")
+            for barcode, units in quantities.items():
+                if units < 0:
+                    raise ReturnError("Return quantities cannot be negative")
+                if units > remaining.get(barcode, 0):
+                    raise ReturnError(
+                        f"Only {remaining.get(barcode, 0)} of {barcode} can still be returned")
+
+            subtotal = sale.get("subtotal") or 0
+            share = (sale.get("discount") or 0) / subtotal if subtotal else 0
+            items = []
+            left = dict(quantities)
+            for item in sale["items"]:
+                units = min(left.get(item["barcode"], 0), item["quantity"])
+                if units:
+                    left[item["barcode"]] -= units
+                    line = dict(item)
+                    line["quantity"] = -units
+                    items.append(line)
+            refund_subtotal = sum(item["price"] * item["quantity"] for item in items)
+            discount = round(refund_subtotal * share, 2)
+            total = refund_subtotal - discount
+            refund = {
+                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "till": self.store.till_id,
+                "type": "return",
+                "return_of": sale["id"],
+                "items": items,
+                "subtotal": refund_subtotal,
+                "discount": discount,
+                "total": total,
+                "payment": total,
+                "change": 0,
+            }
+            if cashier:
+                refund["cashier"] = cashier
+            moves = []
+            if restock:
+                moves = [(barcode, units) for barcode, units in quantities.items()
+                         if barcode in self.store.products]
+            self.store.commit_sale(refund, moves, reason="return")
+        return refund
@@ -0,0 +1,274 @@
+"""Sale IDs and the indexes that find a sale by ID, date, barcode or cashier."""
+
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+from datetime import datetime
+
+TABLE_MAGIC = b"POSIDX1\n"
+SORT_KEYS = {
+    "date": lambda sale: sale["date"],
+    "id": lambda sale: sale.get("id") or "",
+    "cashier": lambda sale: sale.get("cashier") or "",
+    "items": lambda sale: len(sale.get("items", ())),
+    "total": lambda sale: sale.get("total") or 0,
+}
+ENTRY = struct.Struct("<qII")
+EPOCH = datetime(1970, 1, 1)
+
+
+def make_sale_id(till_id, seq):
+    return f"{till_id}-{seq:08d}"
+
+
+def hash_key(text):
+    """Table key for a sale id or barcode; a hash, so text of any length fits one entry"""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def date_key(text, end=False):
+    """Epoch second for "YYYY-MM-DD[ HH:MM:SS]"; with end, the last second it covers"""
+    if len(text) <= 10:
+        moment = datetime.strptime(text[:10], "%Y-%m-%d")
+        seconds = int((moment - EPOCH).total_seconds())
+        return seconds + 86399 if end else seconds
+    moment = datetime.strptime(text[:19], "%Y-%m-%d %H:%M:%S")
+    return int((moment - EPOCH).total_seconds())
+
+
+class SortedTable:
+    """Fixed-width (key, segment, row) entries sorted by key, searched in place with bisect"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._mm = None
+        self.count = 0
+        if path and os.path.getsize(path) > len(TABLE_MAGIC):
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mm[:len(TABLE_MAGIC)] != TABLE_MAGIC:
+                self._mm.close()
+                raise ValueError(f"{path} is not an index table")
+            self.count = (len(self._mm) - len(TABLE_MAGIC)) // ENTRY.size
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        return ENTRY.unpack_from(self._mm, len(TABLE_MAGIC) + position * ENTRY.size)[0]
+
+    def range(self, low, high):
+        """(start, end) positions of the entries with low <= key <= high"""
+        return bisect.bisect_left(self, low), bisect.bisect_right(self, high)
+
+    def entries(self, start, end):
+        for position in range(start, end):
+            yield ENTRY.unpack_from(self._mm, len(TABLE_MAGIC) + position * ENTRY.size)
+
+    def raw(self, start, end):
+        return self._mm[len(TABLE_MAGIC) + start * ENTRY.size:len(TABLE_MAGIC) + end * ENTRY.size] \
+            if self._mm is not None else b""
+
+    @staticmethod
+    def write(path, base, entries):
+        """Write base's entries merged with new (key, segment, row) entries
+
+        The new entries are slotted in with a binary search each and the old
+        ones are copied across in blocks, so adding a day's sales to a
+        table of millions does not re-sort it.
+        """
+        base = base or SortedTable()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(TABLE_MAGIC)
+            done = 0
+            for entry in sorted(entries):
+                position = bisect.bisect_right(base, entry[0], done)
+                f.write(base.raw(done, position))
+                f.write(ENTRY.pack(*entry))
+                done = position
+            f.write(base.raw(done, len(base)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+class SaleIndex:
+    """Sales by ID and by date, across the store and (optionally) its archive"""
+
+    def __init__(self, store, archive=None):
+        self.store = store
+        self.archive = archive
+        self.positions = {}
+        self.dates = []
+        self.returns = {}
+        self.barcodes = {}
+        self.cashiers = {}
+        self._indexed = 0
+        self.rebuild()
+        store.subscribe(self._on_change)
+
+    def rebuild(self):
+        """Full pass over the store's sales; only needed at startup and after a reload"""
+        self.positions.clear()
+        self.dates.clear()
+        self.returns.clear()
+        self.barcodes.clear()
+        self.cashiers.clear()
+        self._indexed = 0
+        self._catch_up()
+
+    def _catch_up(self):
+        sales = self.store.sales
+        for position in range(self._indexed, len(sales)):
+            sale = sales[position]
+            if self.archive is not None and self.archive.holds(sale):
+                # Left in the store by a crash mid-archive
+                continue
+            sale_id = sale.get("id")
+            if sale_id:
+                self.positions[sale_id] = position
+            if sale.get("return_of"):
+                self.returns.setdefault(sale["return_of"], []).append(position)
+            for barcode in {item["barcode"] for item in sale.get("items", ())}:
+                self.barcodes.setdefault(barcode, []).append(position)
+            if sale.get("cashier"):
+                self.cashiers.setdefault(sale["cashier"], []).append(position)
+            bisect.insort(self.dates, (sale["date"], position))
+        self._indexed = len(sales)
+
+    def _on_change(self, records):
+        if any(r["op"] == "reload" or (r["op"] == "rotate" and r.get("reload")) for r in records):
+            self.rebuild()
+        elif any(r["op"] == "sale" for r in records):
+            self._catch_up()
+
+    # ----- queries -----
+
+    def get(self, sale_id):
+        """The sale with this id, or None"""
+        position = self.positions.get(sale_id)
+        if position is not None:
+            return self.store.sales[position]
+        if self.archive is not None:
+            return self.archive.find(sale_id)
+        return None
+
+    def returns_of(self, sale_id):
+        """Returns made against the sale with this id, oldest first"""
+        returns = self.archive.returns_of(sale_id) if self.archive is not None else []
+        seen = {sale.get("id") for sale in returns}
+        for position in self.returns.get(sale_id, ()):
+            sale = self.store.sales[position]
+            if sale.get("id") not in seen:
+                returns.append(sale)
+        return returns
+
+    def with_barcode(self, barcode, limit=None):
+        """Sales with a line for barcode, newest first"""
+        found = []
+        for position in reversed(self.barcodes.get(barcode, ())):
+            if limit is not None and len(found) >= limit:
+                return found
+            found.append(self.store.sales[position])
+        if self.archive is not None:
+            seen = {sale.get("id") for sale in found if sale.get("id")}
+            for sale in self.archive.with_barcode(barcode):
+                if limit is not None and len(found) >= limit:
+                    break
+                if not sale.get("id") or sale["id"] not in seen:
+                    found.append(sale)
+        return found
+
+    def _recent_range(self, start, end):
+        low = bisect.bisect_left(self.dates, (start,)) if start else 0
+        high = bisect.bisect_right(self.dates, (end + "\uffff",)) if end else len(self.dates)
+        return low, max(low, high)
+
+    def between(self, start=None, end=None):
+        """Sales dated start..end ("YYYY-MM-DD[ HH:MM:SS]", inclusive), oldest first"""
+        if self.archive is not None:
+            yield from self.archive.between(start, end)
+        low, high = self._recent_range(start, end)
+        for _, position in self.dates[low:high]:
+            yield self.store.sales[position]
+
+    def count(self, start=None, end=None):
+        """Number of sales dated start..end, from the indexes alone"""
+        low, high = self._recent_range(start, end)
+        archived = self.archive.count(start, end) if self.archive is not None else 0
+        return archived + high - low
+
+    # ----- filtered, paged queries -----
+
+    def query(self, start=None, end=None, cashier=None, barcode=None, min_total=None,
+              max_total=None, sort="date", descending=False, offset=0, limit=100):
+        """One page of the sales matching the filters: (sales, number matching)
+
+        start/end are as for between(). A date range is served from the date
+        indexes, a cashier or product filter from its own index when that
+        picks out fewer sales, so no sale outside the range is read. Sorted
+        by date with nothing but a date range, a page reads only its own
+        sales.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Cannot sort sales by {sort}")
+        if cashier is None and barcode is None and min_total is None and max_total is None and sort == "date":
+            return self._date_page(start, end, descending, offset, limit)
+        matches = [sale for sale in self._candidates(start, end, cashier, barcode)
+                   if (cashier is None or sale.get("cashier") == cashier)
+                   and (barcode is None or any(item["barcode"] == barcode for item in sale["items"]))
+                   and (min_total is None or sale["total"] >= min_total)
+                   and (max_total is None or sale["total"] <= max_total)]
+        matches.sort(key=SORT_KEYS[sort], reverse=descending)
+        return matches[offset:None if limit is None else offset + limit], len(matches)
+
+    def _date_page(self, start, end, descending, offset, limit):
+        total = self.count(start, end)
+        if descending:
+            last = max(0, total - offset)
+            first = 0 if limit is None else max(0, last - limit)
+        else:
+            first = min(offset, total)
+            last = total if limit is None else min(total, offset + limit)
+        page = []
+        archived = self.archive.count(start, end) if self.archive is not None else 0
+        if first < archived:
+            page.extend(self.archive.between(start, end, first, min(last, archived) - first))
+        low, _ = self._recent_range(start, end)
+        for _, position in self.dates[low + max(first - archived, 0):low + max(last - archived, 0)]:
+            page.append(self.store.sales[position])
+        if descending:
+            page.reverse()
+        return page, total
+
+    def _candidates(self, start, end, cashier, barcode):
+        """Sales that may match, from whichever index narrows them down most"""
+        options = [(self.count(start, end), None, None)]
+        for kind, positions, text in (("barcodes", self.barcodes, barcode), ("cashiers", self.cashiers, cashier)):
+            if text is not None:
+                size = len(positions.get(text, ()))
+                if self.archive is not None:
+                    size += self.archive.keyed_count(kind, text)
+                options.append((size, kind, text))
+        _, kind, text = min(options, key=lambda option: option[0])
+        if kind is None:
+            yield from self.between(start, end)
+            return
+        if self.archive is not None:
+            yield from self.archive.keyed(kind, text, start, end)
+        index = self.barcodes if kind == "barcodes" else self.cashiers
+        for position in index.get(text, ()):
+            sale = self.store.sales[position]
+            date = sale["date"]
+            if (start and date < start) or (end and date[:len(end)] > end):
+                continue
+            yield sale
@@ -0,0 +1,190 @@
+"""Cash drawer shifts with running X/Z report counters."""
+
+import json
+import logging
+import os
+from datetime import datetime
+
+from pos_core.store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+SHIFTS_DIR = "shifts"
+STATE_FILE = "shift_state.json"
+Z_REPORTS_FILE = "z_reports.jsonl"
+
+
+class ShiftError(Exception):
+    """Raised when a shift cannot be opened or closed"""
+
+
+def _counters():
+    return {
+        "sales": 0, "items": 0, "gross": 0, "discounts": 0,
+        "returns": 0, "refunded": 0, "net": 0,
+        "by_cashier": {}, "by_hour": {},
+    }
+
+
+class ShiftBook:
+    """Open shifts per till and their running counters"""
+
+    def __init__(self, store):
+        self.store = store
+        self.directory = store.path(SHIFTS_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self.state_path = os.path.join(self.directory, STATE_FILE)
+        # till -> open shift
+        self.open = {}
+        # till -> number of the last Z report
+        self.z_numbers = {}
+        self.seq = 0
+        self._load()
+        store.subscribe(self._on_change)
+
+    # ----- persistence -----
+
+    def _load(self):
+        with self.store.lock:
+            if not os.path.exists(self.state_path):
+                # Nothing before now can belong to a shift
+                self.seq = self.store.seq
+                self.save()
+                return
+            with open(self.state_path, "r") as f:
+                saved = json.load(f)
+            self.open = saved["open"]
+            self.z_numbers = saved["z_numbers"]
+            self.seq = saved["seq"]
+            for record in self.store.iter_records(self.seq):
+                self._apply_record(record)
+
+    def save(self):
+        with self.store.lock:
+            # Tills sharing a folder all follow the same records; keep the newest
+            if os.path.exists(self.state_path):
+                with open(self.state_path, "r") as f:
+                    if json.load(f)["seq"] > self.seq:
+                        return
+            write_json_atomic(self.state_path, {
+                "seq": self.seq, "open": self.open, "z_numbers": self.z_numbers,
+            })
+
+    # ----- updates -----
+
+    def _on_change(self, records):
+        for record in records:
+            if record["op"] == "checkpoint":
+                self.save()
+            elif record["op"] == "reload":
+                # A restore can take the journal back to before records we have seen
+                self.seq = min(self.seq, self.store.seq)
+            else:
+                self._apply_record(record)
+
+    def _apply_record(self, record):
+        if "seq" not in record or record["seq"] <= self.seq:
+            return
+        op = record["op"]
+        till = record.get("till")
+        if op == "shift_open":
+            self.open[till] = dict(record["shift"], counters=_counters())
+        elif op == "shift_close":
+            self.open.pop(till, None)
+            self.z_numbers[till] = record["report"]["z_number"]
+        elif op == "sale" and till in self.open:
+            self._count(self.open[till]["counters"], record["sale"])
+        self.seq = record["seq"]
+
+    @staticmethod
+    def _count(counters, sale):
+        total = sale.get("total") or 0
+        if sale.get("type") == "return":
+            counters["returns"] += 1
+            counters["refunded"] -= total
+        else:
+            counters["sales"] += 1
+            counters["items"] += sum(item["quantity"] for item in sale.get("items", ()))
+            counters["gross"] += sale.get("subtotal") or 0
+            counters["discounts"] += sale.get("discount") or 0
+        counters["net"] += total
+        for group, key in (("by_cashier", sale.get("cashier") or ""), ("by_hour", sale["date"][11:13])):
+            entry = counters[group].setdefault(key, {"sales": 0, "net": 0})
+            entry["sales"] += 1
+            entry["net"] += total
+
+    # ----- shifts -----
+
+    def current(self, till=None):
+        """The open shift on till (this till by default), or None"""
+        return self.open.get(till or self.store.till_id)
+
+    def open_shift(self, cashier, opening_float):
+        """Open a shift on this till with opening_float in the drawer"""
+        if opening_float < 0:
+            raise ShiftError("Opening float cannot be negative")
+        with self.store.lock:
+            self.store.poll()
+            if self.current():
+                raise ShiftError("A shift is already open on this till")
+            now = datetime.now()
+            shift = {
+                "id": f"{self.store.till_id}-{now:%Y%m%d-%H%M%S}",
+                "till": self.store.till_id,
+                "opened_by": cashier,
+                "opened": now.strftime("%Y-%m-%d %H:%M:%S"),
+                "float": opening_float,
+            }
+            self.store.record_event("shift_open", shift=shift)
+            self.save()
+        return self.current()
+
+    def x_report(self, till=None):
+        """The open shift's figures so far; nothing is reset"""
+        shift = self.current(till)
+        if shift is None:
+            raise ShiftError("No shift is open on this till")
+        return self._report(shift, "X")
+
+    def close_shift(self, cashier, counted_cash):
+        """Close this till's shift against the counted cash; returns its Z report"""
+        with self.store.lock:
+            self.store.poll()
+            shift = self.current()
+            if shift is None:
+                raise ShiftError("No shift is open on this till")
+            report = self._report(shift, "Z")
+            report.update({
+                "z_number": self.z_numbers.get(self.store.till_id, 0) + 1,
+                "closed_by": cashier,
+                "closed": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "counted": counted_cash,
+                "over_short": counted_cash - report["expected_cash"],
+            })
+            self.store.record_event("shift_close", shift_id=shift["id"], report=report)
+            with open(os.path.join(self.directory, Z_REPORTS_FILE), "a") as f:
+                f.write(json.dumps(report) + "\n")
+            self.save()
+        logger.info("Shift %s closed, Z%s", shift["id"], report["z_number"])
+        return report
+
+    def _report(self, shift, kind):
+        counters = shift["counters"]
+        report = {key: value for key, value in shift.items() if key != "counters"}
+        report.update(json.loads(json.dumps(counters)))
+        report["kind"] = kind
+        report["expected_cash"] = shift["float"] + counters["net"]
+        return report
+
+    def z_reports(self, till=None):
+        """Closed shifts' Z reports, oldest first"""
+        path = os.path.join(self.directory, Z_REPORTS_FILE)
+        reports = []
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        report = json.loads(line)
+                        if till is None or report["till"] == till:
+                            reports.append(report)
+        return reports
@@ -0,0 +1,195 @@
+"""Point-in-time snapshots of a live store, hard-linked under a brief store lock.
+
+A snapshot's files are the live files until the store swaps in new ones: never write to them in place.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime
+
+from pos_core.archive import ARCHIVE_DIR
+from pos_core.store import DataStore, write_json_atomic, PRODUCTS_FILE, SALES_FILE, CHECKPOINT_FILE
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_DIR = "snapshots"
+MANIFEST_FILE = "SNAPSHOT.json"
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _copy_prefix(source, target, length):
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        remaining = length
+        while remaining:
+            block = src.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            dst.write(block)
+            remaining -= len(block)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def take_snapshot(store, directory=None, extra_files=None, label=""):
+    """Snapshot the store's files (plus extra_files {name: path}) into a new folder
+
+    Returns the snapshot folder. Only the linking happens under the store
+    lock; copying and checksumming run after it is released.
+    """
+    root = directory or store.path(SNAPSHOTS_DIR)
+    snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    target = os.path.join(root, snapshot_id)
+    os.makedirs(target)
+
+    with store.lock:
+        # Files only, never the in-memory state, so any thread may call this
+        checkpoint = {"generation": 0, "seq": 0}
+        if os.path.exists(store.path(CHECKPOINT_FILE)):
+            with open(store.path(CHECKPOINT_FILE), "r") as f:
+                checkpoint = json.load(f)
+        if checkpoint.get("staged"):
+            raise RuntimeError("Store checkpoint is incomplete; open the store to finish it first")
+        generation = checkpoint["generation"]
+        current_journal = os.path.basename(store.journal_path(generation))
+        for name in (PRODUCTS_FILE, SALES_FILE, CHECKPOINT_FILE):
+            if os.path.exists(store.path(name)):
+                _link_or_copy(store.path(name), os.path.join(target, name))
+        for name in os.listdir(store.data_dir):
+            if name.startswith("journal_") and name.endswith(".jsonl") and name < current_journal:
+                _link_or_copy(store.path(name), os.path.join(target, name))
+        journal_length = (os.path.getsize(store.path(current_journal))
+                          if os.path.exists(store.path(current_journal)) else 0)
+        # Archive segments are never rewritten and its index is swapped in whole
+        archive_dir = store.path(ARCHIVE_DIR)
+        if os.path.isdir(archive_dir):
+            os.makedirs(os.path.join(target, ARCHIVE_DIR))
+            for name in os.listdir(archive_dir):
+                if not name.endswith(".tmp"):
+                    _link_or_copy(os.path.join(archive_dir, name), os.path.join(target, ARCHIVE_DIR, name))
+        for name, path in (extra_files or {}).items():
+            if os.path.exists(path):
+                _link_or_copy(path, os.path.join(target, name))
+
+    if journal_length:
+        _copy_prefix(store.path(current_journal), os.path.join(target, current_journal), journal_length)
+    else:
+        open(os.path.join(target, current_journal), "wb").close()
+
+    files = {}
+    for folder, _, names in os.walk(target):
+        for name in names:
+            path = os.path.join(folder, name)
+            relative = os.path.relpath(path, target).replace(os.sep, "/")
+            files[relative] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+    write_json_atomic(os.path.join(target, MANIFEST_FILE), {
+        "id": snapshot_id,
+        "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "label": label,
+        "till": store.till_id,
+        "generation": generation,
+        "seq": _last_seq(os.path.join(target, current_journal), checkpoint["seq"]),
+        "files": files,
+    })
+    logger.info("Snapshot %s taken (%s files)", snapshot_id, len(files))
+    return target
+
+
+def _last_seq(journal, default):
+    seq = default
+    with open(journal, "rb") as f:
+        for line in f:
+            if line.endswith(b"\n"):
+                seq = json.loads(line)["seq"]
+    return seq
+
+
+def verify_snapshot(directory):
+    """List the problems found in a snapshot folder (empty when it is intact)"""
+    path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        return [f"{MANIFEST_FILE} unreadable: {e}"]
+
+    problems = []
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(directory, name)
+        if not os.path.exists(file_path):
+            problems.append(f"{name}: missing")
+            continue
+        if os.path.getsize(file_path) != expected["size"]:
+            problems.append(f"{name}: size {os.path.getsize(file_path)}, expected {expected['size']}")
+        elif _sha256(file_path) != expected["sha256"]:
+            problems.append(f"{name}: checksum mismatch")
+    if problems:
+        return problems
+
+    # The checksums match what was taken; make sure it also loads
+    for name in manifest["files"]:
+        file_path = os.path.join(directory, name)
+        try:
+            if name.endswith(".json"):
+                with open(file_path, "r") as f:
+                    json.load(f)
+            elif name.endswith(".jsonl"):
+                with open(file_path, "rb") as f:
+                    for number, line in enumerate(f, 1):
+                        if not line.endswith(b"\n"):
+                            problems.append(f"{name}: line {number} is incomplete")
+                        else:
+                            json.loads(line)
+        except ValueError as e:
+            problems.append(f"{name}: not valid JSON ({e})")
+    return problems
+
+
+def open_snapshot(directory):
+    """A read-only view of the store as of the snapshot"""
+    return DataStore(directory, durable=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consistent snapshots of a POS data folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    take = commands.add_parser("take", help="snapshot a data folder")
+    take.add_argument("data_dir")
+    take.add_argument("--into", help="folder to create the snapshot in")
+    take.add_argument("--extra", nargs="*", default=[], help="other files to include")
+    verify = commands.add_parser("verify", help="check a snapshot's checksums")
+    verify.add_argument("snapshot_dir")
+    args = parser.parse_args(argv)
+
+    if args.command == "take":
+        store = DataStore(args.data_dir)
+        extra = {os.path.basename(path): path for path in args.extra}
+        print(take_snapshot(store, args.into, extra))
+        return 0
+    problems = verify_snapshot(args.snapshot_dir)
+    for problem in problems:
+        print(problem)
+    print("OK" if not problems else f"{len(problems)} problem(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
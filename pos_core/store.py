@@ -0,0 +1,536 @@
+"""Journaled products/sales store that several tills can share through one data folder."""
+
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+
+from pos_core.catalogue import CatalogueView, catalogue_name, write_catalogue
+from pos_core.records import Product, Sale, products_from_json, sales_from_json, to_json
+from pos_core.saleindex import make_sale_id
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_FILE = "products.json"
+SALES_FILE = "sales_history.json"
+CHECKPOINT_FILE = "store_checkpoint.json"
+LOCK_FILE = "store.lock"
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and swap it in, so readers never see half a file"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        # dumps() runs the C encoder; dump() streams through the pure-Python one
+        f.write(json.dumps(data, default=to_json))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def journal_file(data_dir, generation):
+    return os.path.join(data_dir, f"journal_{generation:06d}.jsonl")
+
+
+def iter_journal(data_dir, since_seq=0, generation=None):
+    """Yield the journal records in data_dir after since_seq, without loading the store"""
+    if generation is None:
+        generation = 0
+        if os.path.exists(os.path.join(data_dir, CHECKPOINT_FILE)):
+            with open(os.path.join(data_dir, CHECKPOINT_FILE), "r") as f:
+                generation = json.load(f)["generation"]
+    generation = _generation_for(data_dir, generation, since_seq)
+    while True:
+        path = journal_file(data_dir, generation)
+        if not os.path.exists(path):
+            return
+        next_generation = None
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Another till is still writing this one
+                    return
+                record = json.loads(line)
+                if record["op"] == "rotate":
+                    next_generation = record["generation"]
+                if record["seq"] > since_seq:
+                    yield record
+        if next_generation is None:
+            return
+        generation = next_generation
+
+
+def _generation_for(data_dir, generation, seq):
+    """Oldest journal generation, counting back from generation, that can hold records after seq"""
+    while generation > 0:
+        path = journal_file(data_dir, generation)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                first = f.readline()
+            if first.endswith(b"\n") and json.loads(first)["seq"] <= seq + 1:
+                return generation
+        generation -= 1
+    return generation
+
+
+class FileLock:
+    """Exclusive inter-process lock, re-entrant within one process"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._depth = 0
+        self._thread_lock = threading.RLock()
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            fh = open(self.path, "a+b")
+            try:
+                if fcntl:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                else:
+                    fh.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            # LK_LOCK gives up after ~10s, keep waiting
+                            continue
+            except BaseException:
+                fh.close()
+                self._thread_lock.release()
+                raise
+            self._fh = fh
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fh, self._fh = self._fh, None
+            try:
+                if fcntl:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                else:
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                fh.close()
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class DataStore:
+    """Products and sales backed by checkpoint files plus a shared journal"""
+
+    def __init__(self, data_dir, till_id="till-1", checkpoint_every=1000,
+                 default_products=None, durable=True, catalogue_snapshot=False):
+        self.data_dir = data_dir
+        self.till_id = till_id
+        self.checkpoint_every = checkpoint_every
+        self.default_products = default_products or {}
+        self.durable = durable
+        os.makedirs(data_dir, exist_ok=True)
+        self.lock = FileLock(os.path.join(data_dir, LOCK_FILE))
+
+        # These objects are handed out to callers and only ever mutated in place
+        self.catalogue_snapshot = catalogue_snapshot
+        self.products = CatalogueView() if catalogue_snapshot else {}
+        self.sales = []
+
+        self.seq = 0
+        self.generation = 0
+        self.checkpoint_seq = 0
+        self._offset = 0
+        self._listeners = []
+        self.reload()
+        with self.lock:
+            if self.default_products and not os.path.exists(self.path(CHECKPOINT_FILE)):
+                # First run: write the default catalogue out so every reader sees it
+                self.checkpoint()
+
+    # ----- paths -----
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def journal_path(self, generation=None):
+        if generation is None:
+            generation = self.generation
+        return journal_file(self.data_dir, generation)
+
+    # ----- loading -----
+
+    def reload(self):
+        """Load the last checkpoint and replay the journal after it"""
+        with self.lock:
+            self._load_checkpoint()
+            self._read_journal()
+
+    def _load_checkpoint(self):
+        info = {"generation": 0, "seq": 0}
+        checkpoint_path = self.path(CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as f:
+                info = json.load(f)
+            if info.get("staged"):
+                self._finish_checkpoint(info)
+
+        # A half-written checkpoint that never got staged is just garbage
+        for name in (PRODUCTS_FILE, SALES_FILE):
+            if os.path.exists(self.path(name) + ".tmp"):
+                os.remove(self.path(name) + ".tmp")
+
+        sales = []
+        if os.path.exists(self.path(SALES_FILE)):
+            with open(self.path(SALES_FILE), "r") as f:
+                sales = json.load(f)
+        self.sales[:] = sales_from_json(sales)
+
+        if not (self.catalogue_snapshot and self._load_catalogue(info["generation"])):
+            products = self.default_products
+            if os.path.exists(self.path(PRODUCTS_FILE)):
+                with open(self.path(PRODUCTS_FILE), "r") as f:
+                    products = json.load(f)
+            self.products.clear()
+            self.products.update(products_from_json(products))
+        self.generation = info["generation"]
+        self.seq = self.checkpoint_seq = info["seq"]
+        self._offset = 0
+
+    def _load_catalogue(self, generation):
+        """Map the catalogue snapshot for generation; False if there is none"""
+        path = self.path(catalogue_name(generation))
+        if not os.path.exists(path):
+            return False
+        try:
+            self.products.load_base(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring catalogue snapshot {path}: {e}")
+            return False
+        return True
+
+    def _finish_checkpoint(self, info):
+        """Complete a checkpoint that was interrupted after staging"""
+        for name in (PRODUCTS_FILE, SALES_FILE):
+            if os.path.exists(self.path(name) + ".tmp"):
+                os.replace(self.path(name) + ".tmp", self.path(name))
+        info["staged"] = False
+        write_json_atomic(self.path(CHECKPOINT_FILE), info)
+
+    def _read_journal(self):
+        """Apply journal records written since our offset, following rotations"""
+        applied = []
+        while True:
+            path = self.journal_path()
+            if not os.path.exists(path):
+                break
+            with open(path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            end = data.rfind(b"\n")
+            if end < 0:
+                break
+            self._offset += end + 1
+            rotated = False
+            for line in data[:end].split(b"\n"):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["seq"] <= self.seq:
+                    continue
+                self._apply(record)
+                applied.append(record)
+                if record["op"] == "rotate":
+                    rotated = True
+                    break
+            if not rotated:
+                break
+        if self._missed_rotation():
+            self._load_checkpoint()
+            applied = [{"op": "reload", "seq": self.seq}]
+            self._notify(applied)
+            return applied + self._read_journal()
+        if applied:
+            self._notify(applied)
+        return applied
+
+    def _missed_rotation(self):
+        """True if a checkpoint moved on without leaving a rotate record behind"""
+        if not os.path.exists(self.journal_path(self.generation + 1)):
+            return False
+        checkpoint_path = self.path(CHECKPOINT_FILE)
+        if not os.path.exists(checkpoint_path):
+            return False
+        with open(checkpoint_path, "r") as f:
+            return json.load(f)["generation"] > self.generation
+
+    # ----- applying records -----
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "product":
+            barcode = sys.intern(record["barcode"])
+            product = Product.from_json(barcode, record["product"])
+            if "moves" in record:
+                # Stock is owned by moves; the upsert only carries the other fields
+                existing = self.products.get(barcode)
+                product["stock"] = existing.get("stock", 0) if existing else 0
+            self.products[barcode] = product
+        elif op == "delete_product":
+            self.products.pop(record["barcode"], None)
+        elif op == "sale":
+            self.sales.append(Sale.from_dict(record["sale"]))
+        elif op == "rotate":
+            if record.get("reload"):
+                # Whole dataset was replaced; the checkpoint is already staged
+                self._load_checkpoint()
+                return
+            self.checkpoint_seq = record["seq"]
+            self.generation = record["generation"]
+            self._offset = 0
+            if self.catalogue_snapshot:
+                # We hold exactly the state the checkpoint wrote; drop our overlay
+                self._load_catalogue(self.generation)
+        for barcode, delta in record.get("moves", ()):
+            product = self.products.get(barcode)
+            if product is not None:
+                product["stock"] = product.get("stock", 0) + delta
+                # Keeps the change when products is a catalogue view
+                self.products[barcode] = product
+        self.seq = record["seq"]
+
+    def _append(self, op, catch_up=True, **fields):
+        """Write one record to the journal and apply it locally; caller holds the lock"""
+        if catch_up:
+            self._read_journal()
+        record = {
+            "seq": self.seq + 1,
+            "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "till": self.till_id,
+            "op": op,
+        }
+        record.update(fields)
+        line = (json.dumps(record, default=to_json) + "\n").encode("utf-8")
+        fd = os.open(self.journal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        try:
+            os.write(fd, line)
+            if self.durable:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        if op != "rotate":
+            self._offset += len(line)
+            self._apply(record)
+        return record
+
+    def _commit(self, op, **fields):
+        with self.lock:
+            record = self._append(op, **fields)
+            self._notify([record])
+            if self.seq - self.checkpoint_seq >= self.checkpoint_every:
+                self.checkpoint()
+        return record
+
+    # ----- public write API -----
+
+    def adjust_stock(self, barcode, delta, reason="adjustment"):
+        """Apply a stock delta; concurrent deltas from other tills all add up"""
+        return self._commit("stock", moves=[[barcode, delta]], reason=reason)
+
+    def adjust_stock_many(self, moves, reason="adjustment"):
+        """Apply several (barcode, delta) moves as one all-or-nothing record"""
+        return self._commit("stock", moves=[[b, d] for b, d in moves], reason=reason)
+
+    def upsert_product(self, barcode, product, moves=None, reason="adjustment"):
+        """Add/replace a product; with moves, its stock only changes through them"""
+        if moves is None:
+            return self._commit("product", barcode=barcode, product=product)
+        return self._commit("product", barcode=barcode, product=product,
+                            moves=[[b, d] for b, d in moves], reason=reason)
+
+    def delete_product(self, barcode):
+        return self._commit("delete_product", barcode=barcode)
+
+    def commit_sale(self, sale, moves=(), reason="sale"):
+        """Record a sale and its stock moves in a single journal record
+
+        A sale without an "id" is given one (till id plus the record's seq);
+        it is set on the sale passed in, so the caller can print it. A refund
+        is committed the same way with reason="return".
+        """
+        with self.lock:
+            self._read_journal()
+            if not sale.get("id"):
+                sale["id"] = make_sale_id(self.till_id, self.seq + 1)
+            return self._commit("sale", sale=sale, moves=[[b, d] for b, d in moves], reason=reason)
+
+    def record_event(self, op, **fields):
+        """Journal a till event that changes no products or sales (a shift opening, say)
+
+        Listeners see it in order with the sales around it; it is not synced.
+        """
+        return self._commit(op, **fields)
+
+    def commit_batch(self, changes):
+        """Journal several changes ({"op": ..., fields}) with one write and one notification"""
+        changes = list(changes)
+        if not changes:
+            return []
+        with self.lock:
+            self._read_journal()
+            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            records = []
+            for offset, change in enumerate(changes, 1):
+                record = {"seq": self.seq + offset, "ts": ts, "till": self.till_id}
+                record.update(change)
+                records.append(record)
+            lines = [(json.dumps(record, default=to_json) + "\n").encode("utf-8") for record in records]
+            fd = os.open(self.journal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0))
+            try:
+                os.write(fd, b"".join(lines))
+                if self.durable:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            for record, line in zip(records, lines):
+                self._offset += len(line)
+                self._apply(record)
+            self._notify(records)
+            if self.seq - self.checkpoint_seq >= self.checkpoint_every:
+                self.checkpoint()
+            return records
+
+    def apply_remote(self, records):
+        """Journal changes that originated elsewhere (records hold "op" plus fields)"""
+        with self.lock:
+            applied = []
+            for record in records:
+                fields = dict(record)
+                applied.append(self._append(fields.pop("op"), **fields))
+            if applied:
+                self._notify(applied)
+                if self.seq - self.checkpoint_seq >= self.checkpoint_every:
+                    self.checkpoint()
+            return applied
+
+    def replace_all(self, products=None, sales=None):
+        """Overwrite the whole dataset (restore/import) and make every till reload"""
+        with self.lock:
+            self._read_journal()
+            if products is not None:
+                products = products_from_json(products)
+                self.products.clear()
+                self.products.update(products)
+            if sales is not None:
+                self.sales[:] = sales_from_json(sales)
+            self.checkpoint(reload=True)
+            self._notify([{"op": "reload", "seq": self.seq}])
+
+    def checkpoint(self, reload=False):
+        """Rewrite products/sales files and start a new journal generation"""
+        with self.lock:
+            if not reload:
+                self._read_journal()
+            new_generation = self.generation + 1
+            write_json_atomic(self.path(PRODUCTS_FILE) + ".tmp", self.products)
+            write_json_atomic(self.path(SALES_FILE) + ".tmp", self.sales)
+            if self.catalogue_snapshot:
+                write_catalogue(self.path(catalogue_name(new_generation)), self.products,
+                                new_generation, self.seq + 1)
+            open(self.journal_path(new_generation), "ab").close()
+            info = {"generation": new_generation, "seq": self.seq + 1, "staged": True}
+            write_json_atomic(self.path(CHECKPOINT_FILE), info)
+            # Followers switch to the new generation as soon as they read this
+            self._append("rotate", catch_up=False, generation=new_generation, reload=reload)
+            self._finish_checkpoint(info)
+            self.generation = new_generation
+            self.seq = self.checkpoint_seq = info["seq"]
+            self._offset = 0
+            if self.catalogue_snapshot:
+                self._load_catalogue(new_generation)
+                self._remove_old_catalogues(new_generation)
+            logger.info("Checkpoint %s at seq %s", new_generation, self.seq)
+            self._notify([{
+                "op": "checkpoint",
+                "seq": self.seq,
+                "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generation": new_generation,
+            }])
+
+    def _remove_old_catalogues(self, generation):
+        for name in os.listdir(self.data_dir):
+            if name.startswith("catalogue_") and name.endswith(".bin") and name < catalogue_name(generation - 1):
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    # Still mapped by a till (Windows); removed at a later checkpoint
+                    pass
+
+    # ----- history -----
+
+    def iter_records(self, since_seq=0):
+        """Yield journal records after since_seq, across retained generations"""
+        return iter_journal(self.data_dir, since_seq, self.generation)
+
+    @staticmethod
+    def origin(record):
+        """Till a change was first made on"""
+        return record.get("origin", record["till"])
+
+    # ----- change notifications -----
+
+    def subscribe(self, callback):
+        """Call callback(records) whenever changes are applied, local or remote"""
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, records):
+        for callback in list(self._listeners):
+            try:
+                callback(records)
+            except Exception as e:
+                logger.error(f"Store listener failed: {e}")
+
+    def poll(self):
+        """Pick up changes other tills have made; cheap when nothing changed"""
+        try:
+            size = os.path.getsize(self.journal_path())
+        except OSError:
+            size = None
+        if (size is not None and size <= self._offset
+                and not os.path.exists(self.journal_path(self.generation + 1))):
+            return []
+        with self.lock:
+            return self._read_journal()
+
+    @staticmethod
+    def changed_barcodes(records):
+        """Barcodes touched by records, or None when everything must be refreshed"""
+        changed = set()
+        for record in records:
+            op = record["op"]
+            if op == "reload" or (op == "rotate" and record.get("reload")):
+                return None
+            changed.update(barcode for barcode, _ in record.get("moves", []))
+            if op in ("product", "delete_product"):
+                changed.add(record["barcode"])
+        return changed
@@ -0,0 +1,459 @@
+"""LAN sync between tills and a back-office sync server over a small JSON-over-HTTP protocol."""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import urllib.request
+from collections import deque
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from pos_core.records import to_json
+from pos_core.store import DataStore, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+SERVER_STATE_FILE = "sync_server_state.json"
+CLIENT_STATE_FILE = "sync_state.json"
+
+# Journal ops that carry data between tills (rotate is local bookkeeping)
+SYNCED_OPS = ("stock", "sale", "product", "delete_product")
+# Fields a receiving store assigns itself
+LOCAL_FIELDS = ("seq", "ts", "till", "origin", "origin_seq", "sync_seq")
+
+
+class SyncServer:
+    """Asyncio HTTP server fanning journal records out between tills"""
+
+    def __init__(self, store, host="0.0.0.0", port=DEFAULT_PORT,
+                 batch_size=500, poll_interval=0.1, recent_size=5000):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.versions = {}
+        self._recent = deque(maxlen=recent_size)
+        self._changed = None
+        self._push_lock = None
+        self._loop = None
+        self._server = None
+        if store.seq == 0:
+            # Give tills a server seq to track even before the first change
+            store.checkpoint()
+        self._load_versions()
+        self.store.subscribe(self._on_change)
+
+    # ----- version vector -----
+
+    def _load_versions(self):
+        state_path = self.store.path(SERVER_STATE_FILE)
+        seen_seq = 0
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            self.versions = state["versions"]
+            seen_seq = state["seq"]
+        # Pushes applied after the state was last written still count
+        for record in self.store.iter_records(seen_seq):
+            if "origin_seq" in record:
+                origin = record["origin"]
+                self.versions[origin] = max(self.versions.get(origin, 0), record["origin_seq"])
+
+    def _save_versions(self):
+        write_json_atomic(self.store.path(SERVER_STATE_FILE),
+                          {"versions": self.versions, "seq": self.store.seq})
+
+    # ----- request handlers -----
+
+    async def handle_push(self, body):
+        # Journal writes and fsyncs happen on a worker thread, one push at a time
+        async with self._push_lock:
+            return await self._loop.run_in_executor(None, self._apply_push, body)
+
+    def _apply_push(self, body):
+        till = body["till"]
+        acked = self.versions.get(till, 0)
+        changes = []
+        for record in body.get("records", []):
+            if record["seq"] <= acked or record["op"] not in SYNCED_OPS:
+                continue
+            change = {k: v for k, v in record.items() if k not in LOCAL_FIELDS}
+            change["origin"] = till
+            change["origin_seq"] = record["seq"]
+            changes.append(change)
+            acked = record["seq"]
+        if changes:
+            self.store.apply_remote(changes)
+        self.versions[till] = acked
+        self._save_versions()
+        return {"acked": acked, "seq": self.store.seq}
+
+    async def handle_pull(self, since, till, wait):
+        changed = self._changed
+        response = self.collect(since, till)
+        if not response["records"] and "snapshot" not in response and wait > 0:
+            try:
+                await asyncio.wait_for(changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            response = self.collect(since, till)
+        return response
+
+    def collect(self, since, till):
+        """Records after since that till has not got yet, in server order"""
+        if since == 0 or since > self.store.seq:
+            return self._snapshot(till)
+
+        if self._recent and self._recent[0]["seq"] <= since + 1:
+            source = (r for r in self._recent if r["seq"] > since)
+        else:
+            source = self.store.iter_records(since)
+
+        records = []
+        last_seq = since
+        for record in source:
+            if record["op"] == "rotate" and record.get("reload"):
+                return self._snapshot(till)
+            last_seq = record["seq"]
+            outgoing = self._outgoing(record, till)
+            if outgoing is not None:
+                records.append(outgoing)
+                if len(records) >= self.batch_size:
+                    break
+        return {"seq": last_seq, "records": records}
+
+    def _snapshot(self, till):
+        # acked tells the till which of its own moves the snapshot already holds
+        # Copied under the lock: a push may be applying on a worker thread
+        with self.store.lock:
+            products = {barcode: dict(product) for barcode, product in self.store.products.items()}
+            return {"seq": self.store.seq, "records": [], "snapshot": products,
+                    "acked": self.versions.get(till, 0)}
+
+    @staticmethod
+    def _outgoing(record, till):
+        op = record["op"]
+        if op in ("product", "delete_product"):
+            # Sent back to the originating till too, so every till ends up
+            # applying catalogue edits in the same (server) order
+            if DataStore.origin(record) == till and record.get("moves"):
+                # ...but the originating till already has the stock effect
+                return dict(record, moves=[])
+            return record
+        if op not in SYNCED_OPS or DataStore.origin(record) == till:
+            return None
+        if op == "sale":
+            # Other tills only need the stock effect, not the receipt
+            if not record.get("moves"):
+                return None
+            return {
+                "seq": record["seq"],
+                "ts": record["ts"],
+                "till": record["till"],
+                "origin": DataStore.origin(record),
+                "op": "stock",
+                "moves": record["moves"],
+                "reason": record.get("reason", "sale"),
+            }
+        return record
+
+    def status(self):
+        return {"seq": self.store.seq, "versions": self.versions}
+
+    # ----- plumbing -----
+
+    def _on_change(self, records):
+        if self._loop is not None and not self._loop.is_closed():
+            # Pushes and polls are applied on worker threads
+            self._loop.call_soon_threadsafe(self._changed_in_loop, records)
+        else:
+            self._changed_in_loop(records)
+
+    def _changed_in_loop(self, records):
+        if any(r["op"] == "reload" for r in records):
+            # Restored data; let collect() find the reload in the journal
+            self._recent.clear()
+        else:
+            self._recent.extend(r for r in records if r["op"] in SYNCED_OPS)
+        if self._changed is not None:
+            # Wake every long-poll waiting on the current event
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def _handle(self, reader, writer):
+        status, payload = 200, None
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            url = urlsplit(target)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if method == "POST" and url.path == "/push":
+                payload = await self.handle_push(json.loads(body))
+            elif method == "GET" and url.path == "/pull":
+                payload = await self.handle_pull(
+                    int(params.get("since", 0)),
+                    params.get("till", ""),
+                    min(float(params.get("wait", 0)), 60)
+                )
+            elif method == "GET" and url.path == "/status":
+                payload = self.status()
+            else:
+                status, payload = 404, {"error": "not found"}
+        except Exception as e:
+            logger.error(f"Sync request failed: {e}")
+            status, payload = 400, {"error": str(e)}
+
+        data = json.dumps(payload, default=to_json).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _poll_store(self):
+        """Pick up edits made directly in the server's data folder"""
+        while True:
+            await self._loop.run_in_executor(None, self.store.poll)
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self):
+        self._changed = asyncio.Event()
+        self._push_lock = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._poller = asyncio.ensure_future(self._poll_store())
+        logger.info("Sync server listening on %s:%s", self.host, self.port)
+
+    async def stop(self):
+        self._poller.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+
+class SyncClient:
+    """Background push/pull of a till's store; call apply_pending() on the store's thread unless auto_apply"""
+
+    def __init__(self, store, url, auto_apply=False, batch_size=200, wait=20):
+        self.store = store
+        self.url = url.rstrip("/")
+        self.auto_apply = auto_apply
+        self.batch_size = batch_size
+        self.wait = wait
+        self.online = False
+        # Everything in the local journal still has to reach the server
+        self.pushed_seq = 0
+        self.server_seq = 0
+        self._fetched_seq = 0
+        self._pending = deque()
+        self._state_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._load_state()
+        store.subscribe(self._on_local_change)
+
+    # ----- state -----
+
+    def _load_state(self):
+        state_path = self.store.path(CLIENT_STATE_FILE)
+        local_seq = None
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            self.pushed_seq = state["pushed_seq"]
+            self.server_seq = state["server_seq"]
+            local_seq = state["local_seq"]
+        if local_seq is not None:
+            # Pulled batches applied after the state was last written
+            for record in self.store.iter_records(local_seq):
+                if "sync_seq" in record:
+                    self.server_seq = max(self.server_seq, record["sync_seq"])
+        self._fetched_seq = self.server_seq
+        self._save_state()
+
+    def _save_state(self):
+        with self._state_lock:
+            write_json_atomic(self.store.path(CLIENT_STATE_FILE), {
+                "pushed_seq": self.pushed_seq,
+                "server_seq": self.server_seq,
+                "local_seq": self.store.seq,
+            })
+
+    # ----- threads -----
+
+    def start(self):
+        for target in (self._push_loop, self._pull_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.store.unsubscribe(self._on_local_change)
+
+    def join(self, timeout=None):
+        """Wait for the threads after stop(); a pull can take up to its long-poll wait to return"""
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _on_local_change(self, records):
+        if any(r.get("till") == self.store.till_id and "origin" not in r for r in records):
+            self._wake.set()
+
+    def _request(self, method, path, payload=None, timeout=10):
+        data = None if payload is None else json.dumps(payload, default=to_json).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def _unpushed(self):
+        """Own records not acked yet, plus the last seq looked at"""
+        batch = []
+        scanned_seq = self.pushed_seq
+        for record in self.store.iter_records(self.pushed_seq):
+            scanned_seq = record["seq"]
+            if (record["till"] == self.store.till_id and "origin" not in record
+                    and record["op"] in SYNCED_OPS):
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+        return batch, scanned_seq
+
+    def _push_loop(self):
+        backoff = 1
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                batch, scanned_seq = self._unpushed()
+                if batch:
+                    response = self._request("POST", "/push", {"till": self.store.till_id, "records": batch})
+                    self.pushed_seq = max(self.pushed_seq, response["acked"])
+                    self._save_state()
+                    self.online = True
+                    if len(batch) >= self.batch_size:
+                        continue
+                elif scanned_seq > self.pushed_seq:
+                    # Nothing of ours in there, don't rescan it next time
+                    self.pushed_seq = scanned_seq
+                backoff = 1
+                self._wake.wait(5)
+            except (OSError, ValueError, KeyError) as e:
+                self.online = False
+                logger.warning(f"Sync push failed, retrying in {backoff}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _pull_loop(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                query = urlencode({"since": self._fetched_seq, "till": self.store.till_id, "wait": self.wait})
+                response = self._request("GET", "/pull?" + query, timeout=self.wait + 10)
+                self.online = True
+                backoff = 1
+                if response["seq"] == self._fetched_seq and "snapshot" not in response:
+                    continue
+                self._fetched_seq = response["seq"]
+                if self.auto_apply:
+                    self._apply(response)
+                else:
+                    self._pending.append(response)
+            except (OSError, ValueError, KeyError) as e:
+                self.online = False
+                logger.warning(f"Sync pull failed, retrying in {backoff}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    # ----- applying pulled changes -----
+
+    def apply_pending(self):
+        """Apply queued server changes; returns how many batches were applied"""
+        applied = 0
+        while self._pending:
+            self._apply(self._pending.popleft())
+            applied += 1
+        return applied
+
+    def _apply(self, response):
+        if "snapshot" in response:
+            with self.store.lock:
+                self.store.replace_all(products=self._with_unacked_moves(
+                    response["snapshot"], response.get("acked", 0)))
+            self.pushed_seq = max(self.pushed_seq, response.get("acked", 0))
+        else:
+            changes = []
+            for record in response["records"]:
+                change = {k: v for k, v in record.items() if k not in LOCAL_FIELDS}
+                change["origin"] = DataStore.origin(record)
+                change["sync_seq"] = record["seq"]
+                changes.append(change)
+            self.store.apply_remote(changes)
+        self.server_seq = response["seq"]
+        self._save_state()
+
+    def _with_unacked_moves(self, snapshot, acked):
+        """The server's products plus the stock moves of our own records it has not acked
+
+        The server never sends a till's own moves back, so without this a
+        sale rung up just before a snapshot would be lost on this till.
+        The caller holds the store lock, so no sale slips in between.
+        """
+        products = dict(snapshot)
+        for record in self.store.iter_records(acked):
+            if (record["till"] != self.store.till_id or "origin" in record
+                    or record["op"] not in SYNCED_OPS or record["seq"] <= acked):
+                continue
+            for barcode, delta in record.get("moves", ()):
+                if barcode in products:
+                    product = dict(products[barcode])
+                    product["stock"] = product.get("stock", 0) + delta
+                    products[barcode] = product
+        return products
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POS back-office sync server")
+    parser.add_argument("--data-dir", required=True, help="folder holding the master data")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--till-id", default="server")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    store = DataStore(args.data_dir, till_id=args.till_id)
+    server = SyncServer(store, host=args.host, port=args.port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
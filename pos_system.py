@@ -8,33 +8,34 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from PIL import Image, ImageTk
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from collections import defaultdict
-import shutil
 import math
-import hashlib
 import sys
 import logging
 import traceback
 import random
-
-# Set up logging
-logging.basicConfig(
-    filename=os.path.join(os.environ['APPDATA'], 'POS_System', 'pos_system.log'),
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-# Get the application data directory
-APP_DATA_DIR = os.path.join(os.environ['APPDATA'], 'POS_System')
-os.makedirs(APP_DATA_DIR, exist_ok=True)
-
-# Update file paths to use APP_DATA_DIR
-USERS_FILE = os.path.join(APP_DATA_DIR, 'users.json')
-INVENTORY_FILE = os.path.join(APP_DATA_DIR, 'inventory.json')
-SALES_FILE = os.path.join(APP_DATA_DIR, 'sales.json')
-DB_FILE = os.path.join(APP_DATA_DIR, 'pos_database.db')
+import socket
+import threading
+from pos_core.store import DataStore, write_json_atomic
+from pos_core.sync import SyncClient
+from pos_core.outbox import SalesOutbox
+from pos_core.inventory import InventoryEngine, InventoryError, StockEdits
+from pos_core.alerts import LowStockIndex, DEFAULT_REORDER_POINT
+from pos_core.forecast import SalesForecaster
+from pos_core.archive import SalesArchive, ARCHIVE_DIR, archive_store
+from pos_core.saleindex import SaleIndex
+from pos_core.returns import Returns, ReturnError
+from pos_core.performance import CashierStats
+from pos_core.shifts import ShiftBook, ShiftError
+from pos_core.credentials import Credentials, LoginError
+from pos_core.audit import AUDIT_DIR, AuditLog
+from pos_core.endofday import END_OF_DAY_DIR, end_of_day
+from pos_core.locations import DataLocations
+from pos_core.logs import set_levels, setup_logging
+from pos_core.permissions import HOTKEYS, allowed, capabilities, hotkey_action, nav_actions
+from pos_core.backup import BackupRepository, BackupScheduler, BackupError, backup_store, load_store_state
 
 def show_error_and_exit(error_msg):
     """Show error message and wait before exiting"""
@@ -48,7 +49,7 @@ def show_error_and_exit(error_msg):
     sys.exit(1)
 
 class POSSystem:
-    def __init__(self):
+    def __init__(self, locations=None):
         # Set up DPI awareness
         try:
             from ctypes import windll
@@ -68,13 +69,45 @@ class POSSystem:
         ctk.set_default_color_theme("blue")
         
         # Initialize data
+        self.locations = locations or DataLocations()
+        self.locations.adopt_legacy_settings()
         self.cart = []
+        self.cart_started = None
+        self.settings = self.load_settings()
+        set_levels(self.settings.get("log_level"), self.settings.get("log_levels"))
+        self.store = self.open_store()
+        self.sales_archive = self.open_sales_archive()
+        self.sale_index = SaleIndex(self.store, self.sales_archive)
+        self.returns = Returns(self.store, self.sale_index)
+        self.cashier_stats = CashierStats(self.store, self.sales_archive)
+        self.shifts = ShiftBook(self.store)
+        self.audit = AuditLog(self.store.path(AUDIT_DIR), self.store.till_id)
+        self.audit.start()
+        self.inventory = InventoryEngine(self.store)
+        self.low_stock = LowStockIndex(
+            self.store,
+            self.settings.get("default_reorder_point", DEFAULT_REORDER_POINT)
+        )
+        self.low_stock.subscribe(lambda index: self.update_alerts_badge())
+        self.forecaster = SalesForecaster(
+            self.store,
+            lead_time_days=self.settings.get("reorder_lead_days", 7),
+            safety_days=self.settings.get("reorder_safety_days", 3)
+        )
+        self.sync = self.start_sync()
+        self.outbox = self.start_outbox()
+        self.backup_scheduler = self.start_backup_scheduler()
         self.products = self.load_products()
         self.sales_history = self.load_sales_history()
-        self.settings = self.load_settings()
         self.current_user = None
         self.current_role = None
+        self.capabilities = 0
+        self.nav_frame = None
+        self.polling = False
         self.user_roles = self.load_user_roles()  # Load user roles after initializations
+        self.credentials = Credentials(self.settings.get("password_iterations"), self.user_roles)
+        if self.credentials.seed_default(self.user_roles):
+            self.save_user_roles()
         
         # Initialize logo-related variables
         self.original_logo = None
@@ -88,29 +121,25 @@ class POSSystem:
         # Show login dialog first
         self.show_login()
         
-    def hash_password(self, password):
-        """Hash password for security"""
-        return hashlib.sha256(password.encode()).hexdigest()
-        
     def load_user_roles(self):
         """Load user roles from JSON file"""
         self.user_roles = {}
         try:
-            if os.path.exists(USERS_FILE):
-                with open(USERS_FILE, 'r') as f:
+            if os.path.exists(self.locations.users_file):
+                with open(self.locations.users_file, 'r') as f:
                     self.user_roles = json.load(f)
         except Exception as e:
-            print(f"Error loading user roles: {e}")
+            logging.error(f"Error loading user roles: {e}")
             self.user_roles = {}
         return self.user_roles
         
     def save_user_roles(self):
         """Save user roles to JSON file"""
         try:
-            with open(USERS_FILE, 'w') as f:
-                json.dump(self.user_roles, f)
+            # Swapped in whole so snapshots and other readers never see half a file
+            write_json_atomic(self.locations.users_file, self.user_roles)
         except Exception as e:
-            print(f"Error saving user roles: {e}")
+            logging.error(f"Error saving user roles: {e}")
             
     def show_login(self):
         dialog = ctk.CTkToplevel(self.window)
@@ -150,7 +179,7 @@ class POSSystem:
         
         # Load logo with fallback handling
         if not self.load_logo(canvas_frame):
-            print("Failed to load logo, showing text fallback")
+            logging.warning("Failed to load logo, showing text fallback")
         
         # Create login form frame with responsive spacing
         form_frame = ctk.CTkFrame(login_frame)
@@ -184,17 +213,26 @@ class POSSystem:
             username = username_entry.get()
             password = password_entry.get()
             
-            if username in self.user_roles and self.user_roles[username]["password"] == self.hash_password(password):
-                self.current_user = username
-                self.current_role = self.user_roles[username]["role"]
-                # Update last login
-                self.user_roles[username]["last_login"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            try:
+                user = self.credentials.authenticate(self.user_roles, username, password)
+            except LoginError as e:
+                # Keeps the failed-login count across restarts
                 self.save_user_roles()
-                dialog.destroy()
-                self.setup_ui()
-                self.setup_keyboard_shortcuts()
+                self.audit.record(username, "login_failed", username, reason=str(e))
+                messagebox.showerror("Error", str(e))
+                return
+            self.audit.record(username, "login", username, role=user["role"])
+            self.current_user = username
+            self.current_role = user["role"]
+            self.capabilities = capabilities(self.current_role)
+            # Update last login (and any password hash upgraded on the way in)
+            user["last_login"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.save_user_roles()
+            dialog.destroy()
+            if user.get("must_change_password"):
+                self.show_change_password(username, self.start_session)
             else:
-                messagebox.showerror("Error", "Invalid credentials!")
+                self.start_session()
                 
         # Login button
         login_btn = ctk.CTkButton(
@@ -213,10 +251,88 @@ class POSSystem:
         password_entry.bind("<Return>", on_enter)
         username_entry.focus()
         
+    def start_session(self):
+        if self.nav_frame is None:
+            self.setup_ui()
+            self.setup_keyboard_shortcuts()
+        else:
+            # Handover: the window and data are already loaded
+            self.apply_role_ui()
+        if (self.multi_till or self.sync) and not self.polling:
+            self.polling = True
+            self.poll_store()
+
+    def end_session(self):
+        """Forget the logged-in user and their cart, leaving data and widgets in place"""
+        for widget in self.window.winfo_children():
+            # Dialogs the last user left open
+            if isinstance(widget, tk.Toplevel):
+                widget.destroy()
+        self.inventory.release_all()
+        self.cart = []
+        self.cart_started = None
+        self.discount_entry.delete(0, "end")
+        self.payment_entry.delete(0, "end")
+        self.clear_search()
+        for widget in self.nav_frame.winfo_children():
+            widget.destroy()
+        self.alerts_button = None
+        self.current_user = None
+        self.current_role = None
+        # Nothing is allowed until the next login
+        self.capabilities = 0
+
+    def show_change_password(self, username, on_changed):
+        """Make username choose a new password before going on; closing returns to login"""
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Change Password")
+        dialog.geometry("400x300")
+        dialog.transient(self.window)
+        dialog.grab_set()
+        
+        ctk.CTkLabel(
+            dialog,
+            text="Please choose a new password",
+            font=("Arial", 16, "bold")
+        ).pack(pady=10)
+        ctk.CTkLabel(dialog, text="New Password:").pack(pady=5)
+        password_entry = ctk.CTkEntry(dialog, show="•")
+        password_entry.pack(pady=5)
+        ctk.CTkLabel(dialog, text="Confirm Password:").pack(pady=5)
+        confirm_entry = ctk.CTkEntry(dialog, show="•")
+        confirm_entry.pack(pady=5)
+        password_entry.focus()
+        
+        def change_password(event=None):
+            password = password_entry.get()
+            if password != confirm_entry.get():
+                messagebox.showerror("Error", "Passwords do not match!")
+                return
+            try:
+                self.credentials.set_password(self.user_roles, username, password)
+            except LoginError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.save_user_roles()
+            self.audit.record(username, "password_change", username)
+            dialog.destroy()
+            on_changed()
+            
+        def cancel():
+            dialog.destroy()
+            self.current_user = None
+            self.current_role = None
+            self.capabilities = 0
+            self.show_login()
+            
+        confirm_entry.bind("<Return>", change_password)
+        dialog.protocol("WM_DELETE_WINDOW", cancel)
+        ctk.CTkButton(dialog, text="Change Password", command=change_password).pack(pady=15)
+        
     def animate_logo(self):
         try:
             if not hasattr(self, 'original_logo') or self.original_logo is None:
-                print("No logo to animate")
+                logging.debug("No logo to animate")
                 return
                 
             # Get canvas dimensions
@@ -252,9 +368,7 @@ class POSSystem:
                 self.canvas.after(30, self.animate_logo)  # ~33 FPS
             
         except Exception as e:
-            print(f"Animation error: {e}")
-            import traceback
-            traceback.print_exc()
+            logging.exception(f"Animation error: {e}")
 
     def load_logo(self, canvas_frame):
         """Load the logo image with fallback handling"""
@@ -264,12 +378,12 @@ class POSSystem:
             os.path.join(os.path.dirname(sys.executable), "mylogo.png"),  # In exe directory
         ]
         
-        print("Attempting to load logo...")
+        logging.debug("Attempting to load logo...")
         for path in logo_paths:
-            print(f"Trying path: {path}")
+            logging.debug(f"Trying path: {path}")
             try:
                 if os.path.exists(path):
-                    print(f"Found logo at: {path}")
+                    logging.debug(f"Found logo at: {path}")
                     self.original_logo = Image.open(path)
                     logo_size = 150  # Reduced size for better fit
                     self.original_logo = self.original_logo.resize(
@@ -277,16 +391,14 @@ class POSSystem:
                         Image.Resampling.LANCZOS
                     )
                     self.angle = 0
-                    print("Logo loaded successfully, starting animation")
+                    logging.debug("Logo loaded successfully, starting animation")
                     self.animate_logo()
                     return True
             except Exception as e:
-                print(f"Error loading logo from {path}: {e}")
-                import traceback
-                traceback.print_exc()
+                logging.exception(f"Error loading logo from {path}: {e}")
                 continue
         
-        print("No logo found, showing text fallback")
+        logging.info("No logo found, showing text fallback")
         # If no logo was loaded successfully, show text instead
         ctk.CTkLabel(
             canvas_frame,
@@ -300,11 +412,7 @@ class POSSystem:
         for widget in self.window.winfo_children():
             widget.destroy()
 
-        # Set window title and theme
-        if self.current_role == "admin":
-            self.window.title("Modern POS System - Admin")
-        else:
-            self.window.title("Modern POS System - Staff")
+        # Set window theme
         self.window.geometry("1920x1080")  # Full HD resolution
         self.window.state('zoomed')  # Start maximized
         ctk.set_appearance_mode(self.settings.get("theme", "dark"))
@@ -343,26 +451,10 @@ class POSSystem:
         button_width = 160
         button_height = 40
         button_font = ("Arial", 14, "bold")
-        nav_buttons = []
-        if self.current_role == "admin":
-            nav_buttons = [
-                ("Inventory", self.show_inventory),
-                ("Sales History", self.show_sales_history),
-                ("Dashboard", self.show_dashboard),
-                ("Settings", self.show_settings),
-                ("Backup Data", self.backup_data),
-                ("Restore Data", self.restore_data),
-                ("Manage Users", self.show_user_management),
-                ("Add Product", self.add_product_dialog),
-                ("Scan Barcode", self.scan_barcode),
-            ]
-        else:
-            nav_buttons = [
-                ("Scan Barcode", self.scan_barcode),
-                ("Print Receipt", self.print_receipt),
-            ]
-        for text, cmd in nav_buttons:
-            ctk.CTkButton(left_bar, text=text, command=cmd, width=button_width, height=button_height, font=button_font).pack(pady=6)
+        # Role-specific buttons live in their own frame, rebuilt at each login
+        self.nav_frame = ctk.CTkFrame(left_bar, fg_color="transparent")
+        self.nav_frame.pack(side="top", fill="x")
+        self.apply_role_ui()
         # Logout always at the bottom
         ctk.CTkButton(left_bar, text="Logout", command=self.logout, width=button_width, height=button_height, font=button_font, fg_color="red").pack(side="bottom", pady=12)
 
@@ -522,15 +614,8 @@ class POSSystem:
                     barcode = self.products_sheet.get_cell_data(row, 0)
                     if barcode in self.products:
                         product = self.products[barcode]
-                        # Check stock
-                        if product.get("stock", 0) > 0:
-                            self.add_to_cart(product)
-                            # Update stock
-                            product["stock"] -= 1
-                            self.save_products()
-                            self.update_spreadsheet()
-                        else:
-                            messagebox.showerror("Error", "Product out of stock!")
+                        # Reserves the stock, or reports that it has run out
+                        self.add_to_cart(product)
             except Exception as e:
                 logging.error(f"Error in click handler: {e}")
                 messagebox.showerror("Error", "Failed to process click")
@@ -558,15 +643,8 @@ class POSSystem:
                         logging.debug(f"on_selection_changed: barcode={barcode}")
                         if barcode in self.products:
                             product = self.products[barcode]
-                            # Check stock
-                            if product.get("stock", 0) > 0:
-                                self.add_to_cart(product)
-                                # Update stock
-                                product["stock"] -= 1
-                                self.save_products()
-                                self.update_spreadsheet()
-                            else:
-                                messagebox.showerror("Error", "Product out of stock!")
+                            # Reserves the stock, or reports that it has run out
+                            self.add_to_cart(product)
                         else:
                             logging.error(f"Barcode {barcode} not found in products!")
                 # No else needed; do nothing if no selection
@@ -591,15 +669,8 @@ class POSSystem:
                         barcode = self.products_sheet.get_cell_data(row, 0)
                         if barcode in self.products:
                             product = self.products[barcode]
-                            # Check stock
-                            if product.get("stock", 0) > 0:
-                                self.add_to_cart(product)
-                                # Update stock
-                                product["stock"] -= 1
-                                self.save_products()
-                                self.update_spreadsheet()
-                            else:
-                                messagebox.showerror("Error", "Product out of stock!")
+                            # Reserves the stock, or reports that it has run out
+                            self.add_to_cart(product)
             except Exception as e:
                 logging.error(f"Error in cell selected handler: {e}")
         
@@ -620,15 +691,8 @@ class POSSystem:
                     barcode = self.products_sheet.get_cell_data(row, 0)
                     if barcode in self.products:
                         product = self.products[barcode]
-                        # Check stock
-                        if product.get("stock", 0) > 0:
-                            self.add_to_cart(product)
-                            # Update stock
-                            product["stock"] -= 1
-                            self.save_products()
-                            self.update_spreadsheet()
-                        else:
-                            messagebox.showerror("Error", "Product out of stock!")
+                        # Reserves the stock, or reports that it has run out
+                        self.add_to_cart(product)
             except Exception as e:
                 logging.error(f"Error in cell clicked handler: {e}")
         
@@ -649,15 +713,8 @@ class POSSystem:
                     barcode = self.products_sheet.get_cell_data(row, 0)
                     if barcode in self.products:
                         product = self.products[barcode]
-                        # Check stock
-                        if product.get("stock", 0) > 0:
-                            self.add_to_cart(product)
-                            # Update stock
-                            product["stock"] -= 1
-                            self.save_products()
-                            self.update_spreadsheet()
-                        else:
-                            messagebox.showerror("Error", "Product out of stock!")
+                        # Reserves the stock, or reports that it has run out
+                        self.add_to_cart(product)
             except Exception as e:
                 logging.error(f"Error in cell double clicked handler: {e}")
         
@@ -674,7 +731,7 @@ class POSSystem:
         self.cart_sheet.set_column_widths([160, 320, 160, 120, 160])
 
         # --- Right Bar: Payment Controls (retail size) ---
-        print('Creating right bar widgets...')
+        logging.debug('Creating right bar widgets...')
         ctk.CTkLabel(right_bar, text="Discount:", font=("Arial", 0, "bold"))
         self.discount_entry = ctk.CTkEntry(right_bar, font=("Arial", 0))
         # Use place geometry manager for flexible sizing
@@ -709,7 +766,7 @@ class POSSystem:
         self.change_label = ctk.CTkLabel(right_bar, text="Change: UGX 0", font=("Arial", 36, "bold"))
         self.change_label.pack(pady=18)
 
-        print_btn = ctk.CTkButton(right_bar, text="Print Receipt", command=self.print_receipt, font=("Arial", 28, "bold"))
+        print_btn = ctk.CTkButton(right_bar, text="Print Receipt", command=lambda: self.dispatch("print_receipt"), font=("Arial", 28, "bold"))
         print_btn.pack(pady=(50, 20), fill="x", padx=20)
 
         # Responsive resizing for right bar widgets
@@ -722,18 +779,91 @@ class POSSystem:
         # Update spreadsheet/cart
         self.update_spreadsheet()
 
+    def update_alerts_badge(self):
+        """Show how many products are at or below their reorder point"""
+        if not getattr(self, "alerts_button", None) or not self.alerts_button.winfo_exists():
+            return
+        count = self.low_stock.count
+        self.alerts_button.configure(
+            text=f"Reorder Alerts ({count})" if count else "Reorder Alerts",
+            fg_color="darkorange" if count else self.alerts_button_color
+        )
+
+    def show_reorder_report(self):
+        """List products at or below their reorder point, emptiest first"""
+        report = self.low_stock.report()
+        
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Reorder Report")
+        dialog.geometry("800x600")
+        
+        ctk.CTkLabel(
+            dialog,
+            text=f"{len(report)} products to reorder, {self.low_stock.out_of_stock} out of stock",
+            font=("Arial", 16, "bold")
+        ).pack(pady=10)
+        
+        report_sheet = Sheet(dialog)
+        report_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        report_sheet.headers(["Barcode", "Product Name", "Stock", "Reorder Point", "Shortfall", "Suggested Order"])
+        for row in report:
+            row["suggested"] = self.forecaster.suggest(row["barcode"], row["stock"])
+        report_sheet.set_sheet_data([
+            [row["barcode"], row["name"], row["stock"], row["reorder_point"], row["shortfall"], row["suggested"]]
+            for row in report
+        ])
+        
+        def export_csv():
+            filename = filedialog.asksaveasfilename(
+                title="Export Reorder Report",
+                defaultextension=".csv",
+                initialfile=f"reorder_{datetime.now().strftime('%Y%m%d')}.csv",
+                filetypes=[("CSV files", "*.csv")]
+            )
+            if not filename:
+                return
+            import csv
+            with open(filename, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["Barcode", "Product Name", "Stock", "Reorder Point", "Shortfall", "Suggested Order"])
+                for row in report:
+                    writer.writerow([row["barcode"], row["name"], row["stock"], row["reorder_point"], row["shortfall"], row["suggested"]])
+            messagebox.showinfo("Success", f"Report saved as {filename}")
+        
+        ctk.CTkButton(dialog, text="Export CSV", command=export_csv).pack(pady=10)
+
+    def apply_role_ui(self):
+        """Title and nav buttons for the logged-in role; the rest of the UI is shared"""
+        self.window.title(f"Modern POS System - {self.current_role.title()}")
+        for widget in self.nav_frame.winfo_children():
+            widget.destroy()
+        self.alerts_button = None
+        for action, text in nav_actions(self.capabilities):
+            btn = ctk.CTkButton(self.nav_frame, text=text, command=lambda a=action: self.dispatch(a),
+                                width=160, height=40, font=("Arial", 14, "bold"))
+            btn.pack(pady=6)
+            if action == "show_reorder_report":
+                self.alerts_button = btn
+                self.alerts_button_color = btn.cget("fg_color")
+        self.update_alerts_badge()
+        
     def setup_keyboard_shortcuts(self):
-        self.window.bind("<F2>", lambda e: self.add_product_dialog())
-        self.window.bind("<F3>", lambda e: self.scan_barcode())
-        self.window.bind("<F4>", lambda e: self.print_receipt())
-        self.window.bind("<F5>", lambda e: self.clear_cart())
-        self.window.bind("<F6>", lambda e: self.show_inventory())
-        self.window.bind("<F7>", lambda e: self.show_sales_history())
-        self.window.bind("<F8>", lambda e: self.show_dashboard())
-        self.window.bind("<F9>", lambda e: self.show_settings())
-        self.window.bind("<F10>", lambda e: self.backup_data())
-        self.window.bind("<F11>", lambda e: self.restore_data())
-        self.window.bind("<F12>", lambda e: self.show_user_management())
+        for key in HOTKEYS:
+            self.window.bind(key, lambda e, k=key: self.dispatch_key(k))
+        
+    def dispatch(self, action):
+        """Run a nav or hotkey action if the logged-in role may; the one place roles are checked"""
+        if not allowed(self.capabilities, action):
+            messagebox.showerror("Error", "You do not have permission to do that!")
+            return
+        getattr(self, action)()
+        
+    def dispatch_key(self, key):
+        action = hotkey_action(self.capabilities, key)
+        if action is None:
+            messagebox.showerror("Error", "You do not have permission to do that!")
+            return
+        getattr(self, action)()
         
     def on_search_type_change(self, *args):
         """Handle search type change"""
@@ -841,7 +971,14 @@ class POSSystem:
                 try:
                     new_quantity = int(current_value)
                     if new_quantity > 0:
-                        self.cart[row]["quantity"] = new_quantity
+                        item = self.cart[row]
+                        extra = new_quantity - item["quantity"]
+                        if extra > 0 and not self.inventory.reserve(item["barcode"], extra):
+                            messagebox.showerror("Error", "Not enough stock!")
+                            return
+                        if extra < 0:
+                            self.inventory.release(item["barcode"], -extra)
+                        item["quantity"] = new_quantity
                         self.update_spreadsheet()
                 except ValueError:
                     messagebox.showerror("Error", "Please enter a valid quantity!")
@@ -849,6 +986,8 @@ class POSSystem:
     def clear_cart(self):
         if messagebox.askyesno("Confirm", "Are you sure you want to clear the cart?"):
             self.cart = []
+            self.cart_started = None
+            self.inventory.release_all()
             self.update_spreadsheet()
             
     def scan_barcode(self):
@@ -898,8 +1037,8 @@ class POSSystem:
                 
             if barcode in self.products:
                 product = self.products[barcode]
-                self.add_to_cart(product)
-                dialog.destroy()
+                if self.add_to_cart(product):
+                    dialog.destroy()
             else:
                 messagebox.showerror("Error", "Product not found!")
                 barcode_entry.delete(0, "end")
@@ -953,7 +1092,7 @@ class POSSystem:
                     product_list.insert_row([
                         product["name"],
                         f"UGX {product['price']:,.0f}",
-                        product.get("stock", 0)
+                        self.inventory.available(barcode)
                     ])
                     row_barcodes.append(barcode)
         
@@ -978,9 +1117,9 @@ class POSSystem:
                 if row is not None and isinstance(row, int) and 0 <= row < len(row_barcodes):
                     barcode = row_barcodes[row]
                     if barcode in self.products:
-                        self.add_to_cart(self.products[barcode])
-                        messagebox.showinfo("Added to Cart", f"{self.products[barcode]['name']} added to cart.")
-                        dialog.destroy()
+                        if self.add_to_cart(self.products[barcode]):
+                            messagebox.showinfo("Added to Cart", f"{self.products[barcode]['name']} added to cart.")
+                            dialog.destroy()
                     else:
                         messagebox.showerror("Error", "Barcode not found in products!")
             except Exception as e:
@@ -996,25 +1135,139 @@ class POSSystem:
         # Set initial tab
         tabview.set("Select Product")
         
+    def open_store(self):
+        """Open the journaled data store; a shared folder turns on multi-till mode"""
+        self.locations.use_shared(self.settings.get("shared_data_dir"))
+        self.multi_till = bool(self.locations.shared)
+        till_id = os.environ.get("POS_TILL_ID") or self.settings.get("till_id") or socket.gethostname()
+        store = DataStore(
+            self.locations.data_dir,
+            till_id=till_id,
+            default_products={
+                "123456789": {"name": "Sample Product", "price": 9.99}
+            },
+            catalogue_snapshot=bool(self.settings.get("catalogue_snapshot", False))
+        )
+        # Sales used to be kept in the working directory, bring them along once
+        legacy = self.locations.legacy_file("sales_history.json")
+        if not store.sales and not self.multi_till and legacy:
+            with open(legacy, "r") as f:
+                legacy_sales = json.load(f)
+            if legacy_sales:
+                store.replace_all(sales=legacy_sales)
+        store.subscribe(self.on_store_changed)
+        return store
+
     def load_products(self):
-        # Load products from JSON file or create default products
-        if os.path.exists(os.path.join(APP_DATA_DIR, "products.json")):
-            with open(os.path.join(APP_DATA_DIR, "products.json"), "r") as f:
-                return json.load(f)
-        return {
-            "123456789": {"name": "Sample Product", "price": 9.99}
-        }
+        # Products are owned by the data store, reload picks up external edits
+        self.store.reload()
+        return self.store.products
         
     def save_products(self):
-        with open(os.path.join(APP_DATA_DIR, "products.json"), "w") as f:
-            json.dump(self.products, f)
-            
-    def add_product_dialog(self):
-        # Check if user is admin
-        if self.current_role != "admin":
-            messagebox.showerror("Error", "Only administrators can add products!")
+        # Every change is journaled as it happens, this just folds them into products.json
+        self.store.checkpoint()
+
+    def on_store_changed(self, records):
+        """Refresh only the product rows that changed on this or another till"""
+        if not hasattr(self, "products_sheet"):
             return
+        changed = DataStore.changed_barcodes(records)
+        if changed is None:
+            self.update_spreadsheet()
+            return
+        try:
+            for barcode in changed:
+                product = self.products.get(barcode)
+                row = self.product_rows.get(barcode)
+                if product is None:
+                    if row is not None:
+                        # Deleted (here or on another till): drop the row and renumber those below it
+                        self.products_sheet.delete_row(row, redraw=False)
+                        del self.product_rows[barcode]
+                        for other, other_row in self.product_rows.items():
+                            if other_row > row:
+                                self.product_rows[other] = other_row - 1
+                    continue
+                values = [
+                    barcode,
+                    product["name"],
+                    f"UGX {product['price']:,.0f}",
+                    self.inventory.available(barcode)
+                ]
+                if row is None:
+                    self.products_sheet.insert_row(values, redraw=False)
+                    self.product_rows[barcode] = self.products_sheet.get_total_rows() - 1
+                else:
+                    for col, value in enumerate(values):
+                        self.products_sheet.set_cell_data(row, col, value)
+            self.products_sheet.refresh()
+        except Exception as e:
+            logging.error(f"Error refreshing changed products: {e}")
+
+    def open_sales_archive(self):
+        """Move sales past the retention window into the compressed archive"""
+        retention_days = self.settings.get("sales_retention_days", 0)
+        if not retention_days:
+            return SalesArchive(self.store.path(ARCHIVE_DIR))
+        try:
+            archive, archived = archive_store(self.store, retention_days)
+            if archived:
+                logging.info(f"Archived {archived} sales older than {retention_days} days")
+            return archive
+        except Exception as e:
+            logging.error(f"Error archiving old sales: {e}")
+            return SalesArchive(self.store.path(ARCHIVE_DIR))
             
+    def start_sync(self):
+        """Start pushing/pulling changes to the back-office sync server, if configured"""
+        sync_url = os.environ.get("POS_SYNC_URL") or self.settings.get("sync_server_url")
+        if not sync_url:
+            return None
+        sync = SyncClient(self.store, sync_url)
+        sync.start()
+        return sync
+
+    def start_outbox(self):
+        """Queue committed sales for upload to head office, if configured"""
+        head_office_url = os.environ.get("POS_HEAD_OFFICE_URL") or self.settings.get("head_office_url")
+        if not head_office_url:
+            return None
+        outbox = SalesOutbox(self.store, head_office_url, directory=self.locations.outbox_dir)
+        outbox.start()
+        return outbox
+
+    def backup_repository(self):
+        return BackupRepository(self.locations.backups_dir(self.settings))
+        
+    def backup_extra_files(self):
+        """Data files kept outside the store"""
+        return {"settings.json": self.locations.settings_file, "users.json": self.locations.users_file}
+        
+    def start_backup_scheduler(self):
+        """Take a snapshot in the background every few minutes, if configured"""
+        minutes = self.settings.get("backup_interval_minutes", 0)
+        if not minutes:
+            return None
+        repository = self.backup_repository()
+        extra_files = self.backup_extra_files()
+        return BackupScheduler(
+            lambda: backup_store(repository, self.store, extra_files,
+                                 label="scheduled", skip_unchanged=True),
+            minutes * 60
+        ).start()
+        
+    def poll_store(self):
+        """Pick up other tills' changes (shared folder or sync server)"""
+        try:
+            self.store.poll()
+            if self.sync:
+                self.sync.apply_pending()
+        except Exception as e:
+            logging.error(f"Error polling shared data: {e}")
+        if self.window.winfo_exists():
+            self.window.after(self.settings.get("sync_poll_ms", 250), self.poll_store)
+            
+    def add_product_dialog(self):
         dialog = ctk.CTkToplevel(self.window)
         dialog.title("Add Product")
         dialog.geometry("800x600")  # Larger dialog size
@@ -1128,6 +1381,20 @@ class POSSystem:
         )
         stock_entry.pack(pady=10)
         
+        # Reorder point
+        ctk.CTkLabel(
+            dialog,
+            text="Reorder Point (blank = default):",
+            font=label_font
+        ).pack(pady=10)
+        reorder_entry = ctk.CTkEntry(
+            dialog,
+            width=entry_width,
+            height=entry_height,
+            font=form_font
+        )
+        reorder_entry.pack(pady=10)
+        
         def add_product():
             try:
                 # Get values
@@ -1135,6 +1402,8 @@ class POSSystem:
                 name = name_entry.get().strip()
                 price = float(price_entry.get().strip())
                 stock = int(stock_entry.get().strip())
+                reorder_text = reorder_entry.get().strip()
+                reorder_point = int(reorder_text) if reorder_text else None
                 
                 # Validate inputs
                 if not name:
@@ -1162,18 +1431,31 @@ class POSSystem:
                 if barcode in self.products:
                     if not messagebox.askyesno("Warning", "Product with this barcode already exists. Update it?"):
                         return
+                    if reorder_point is None:
+                        reorder_point = self.products[barcode].get("reorder_point")
                 
-                # Add/update product with consistent structure
-                self.products[barcode] = {
+                # Add/update product with consistent structure; the stock
+                # difference is journaled as a receipt/adjustment movement
+                product = {
                     "barcode": barcode,  # Always include barcode
                     "name": name,
                     "price": price,
-                    "stock": stock,
                     "type": product_type
                 }
-                
-                # Save products
-                self.save_products()
+                if reorder_point is not None:
+                    product["reorder_point"] = reorder_point
+                existing = self.products.get(barcode)
+                self.inventory.save_product(barcode, product, stock=stock)
+                if existing is None:
+                    self.audit.record(self.current_user, "product_add", barcode,
+                                      name=name, price=price, stock=stock)
+                else:
+                    changes = {key: [existing.get(key), value] for key, value in product.items()
+                               if existing.get(key) != value}
+                    if stock is not None and existing.get("stock") != stock:
+                        changes["stock"] = [existing.get("stock"), stock]
+                    action = "price_change" if "price" in changes else "product_update"
+                    self.audit.record(self.current_user, action, barcode, **changes)
                 
                 # Show success message
                 messagebox.showinfo("Success", f"Product {name} added successfully!")
@@ -1208,6 +1490,7 @@ class POSSystem:
         name_entry.bind("<Return>", on_enter)
         price_entry.bind("<Return>", on_enter)
         stock_entry.bind("<Return>", on_enter)
+        reorder_entry.bind("<Return>", on_enter)
         
         # Focus first entry
         name_entry.focus()
@@ -1224,7 +1507,12 @@ class POSSystem:
                         break
                 if not barcode:
                     logging.error("Could not find barcode for product")
-                    return
+                    return False
+                    
+            # Hold one unit for this cart; stock is only taken when the sale commits
+            if not self.inventory.reserve(barcode):
+                messagebox.showerror("Error", "Product out of stock!")
+                return False
                     
             name = product["name"]
             price = product["price"]
@@ -1235,9 +1523,11 @@ class POSSystem:
                     item["quantity"] += 1
                     self.update_spreadsheet()
                     self.update_totals()
-                    return
+                    return True
             
             # If the product is not in the cart, add it
+            if not self.cart:
+                self.cart_started = datetime.now()
             self.cart.append({
                 "barcode": barcode,
                 "name": name,
@@ -1246,20 +1536,24 @@ class POSSystem:
             })
             self.update_spreadsheet()
             self.update_totals()
+            return True
             
         except Exception as e:
             logging.error(f"Error adding to cart: {e}")
             messagebox.showerror("Error", "Failed to add item to cart")
+            return False
 
     def update_spreadsheet(self):
         # Update products sheet
         self.products_sheet.set_sheet_data([])
+        self.product_rows = {}
         for barcode, product in self.products.items():
+            self.product_rows[barcode] = len(self.product_rows)
             self.products_sheet.insert_row([
                 barcode,
                 product["name"],
                 f"UGX {product['price']:,.0f}",
-                product.get("stock", 0)
+                self.inventory.available(barcode)
             ])
             
         # Update cart sheet
@@ -1335,17 +1629,36 @@ class POSSystem:
         inventory_sheet.pack(fill="both", expand=True, padx=5, pady=5)
         
         # Set up headers
-        headers = ["Barcode", "Product Name", "Price", "Stock"]
+        headers = ["Barcode", "Product Name", "Price", "Stock", "Reorder Point", "Sold/Day", "Suggested Order"]
         inventory_sheet.headers(headers)
         
-        # Add products to sheet
+        # Reorder suggestions come from the running per-product sales velocity
+        suggestions = self.forecaster.suggestions()
+        
+        # Load all rows in one go; inserting row by row redraws every time
+        rows = []
         for barcode, product in self.products.items():
-            inventory_sheet.insert_row([
+            velocity, suggested = suggestions.get(barcode, (0, 0))
+            rows.append([
                     barcode,
                     product["name"],
                     f"UGX {product['price']:,.0f}",
-                    product.get("stock", 0)
+                    product.get("stock", 0),
+                    product.get("reorder_point", ""),
+                    f"{velocity:.1f}",
+                    suggested
             ])
+        inventory_sheet.set_sheet_data(rows)
+        
+        # Only Stock and Reorder Point are editable; edits are checked cell by cell
+        # and only the edited cells are saved
+        edits = StockEdits(self.inventory)
+        inventory_sheet.enable_bindings("single_select", "arrowkeys", "edit_cell", "copy", "paste")
+        inventory_sheet.readonly_columns(columns=[0, 1, 2, 5, 6])
+        inventory_sheet.extra_bindings(
+            "end_edit_cell",
+            lambda event: self.validate_inventory_cell(inventory_sheet, edits, event)
+        )
             
         # Add control buttons
         control_frame = ctk.CTkFrame(dialog)
@@ -1354,39 +1667,322 @@ class POSSystem:
         ctk.CTkButton(
             control_frame,
             text="Update Stock",
-            command=lambda: self.update_stock(inventory_sheet)
+            command=lambda: self.update_stock(inventory_sheet, edits)
         ).pack(side="left", padx=5)
         
-    def show_sales_history(self):
+        ctk.CTkButton(
+            control_frame,
+            text="Stock As Of...",
+            command=self.show_stock_as_of
+        ).pack(side="left", padx=5)
+        
+    def show_stock_as_of(self):
+        """Show stock levels at a past date, rebuilt from the movement journal"""
+        when = ctk.CTkInputDialog(
+            text="Date and time (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS):",
+            title="Stock As Of"
+        ).get_input()
+        if not when:
+            return
+        when = when.strip()
+        try:
+            if len(when) == 10:
+                when = datetime.strptime(when, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
+            else:
+                datetime.strptime(when, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid date!")
+            return
+            
+        counts = self.inventory.stock_as_of(when)
+        
         dialog = ctk.CTkToplevel(self.window)
-        dialog.title("Sales History")
+        dialog.title(f"Stock as of {when}")
         dialog.geometry("800x600")
+        sheet = Sheet(dialog)
+        sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        sheet.headers(["Barcode", "Product Name", "Stock Then", "Stock Now"])
+        sheet.set_sheet_data([
+            [
+                barcode,
+                product["name"],
+                counts.get(barcode, 0),
+                product.get("stock", 0)
+            ]
+            for barcode, product in self.products.items()
+        ])
         
-        # Create sales history sheet
-        history_sheet = Sheet(dialog)
+    def show_sales_history(self):
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Sales History")
+        dialog.geometry("1000x700")
+        
+        # Filters; the last seven days to start with
+        filter_frame = ctk.CTkFrame(dialog)
+        filter_frame.pack(fill="x", padx=5, pady=5)
+        today = datetime.now().date()
+        filters = {}
+        for label, key, default, width in (
+            ("From", "start", (today - timedelta(days=6)).isoformat(), 100),
+            ("To", "end", today.isoformat(), 100),
+            ("Cashier", "cashier", "", 100),
+            ("Barcode", "barcode", "", 120),
+            ("Min Total", "min_total", "", 80),
+            ("Max Total", "max_total", "", 80),
+        ):
+            ctk.CTkLabel(filter_frame, text=f"{label}:").pack(side="left", padx=(5, 2))
+            entry = ctk.CTkEntry(filter_frame, width=width)
+            entry.insert(0, default)
+            entry.pack(side="left", padx=(0, 5))
+            filters[key] = entry
+        
+        # Page of sales; click a column header to sort by it
+        history_sheet = Sheet(dialog, height=330)
         history_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        columns = [("Sale ID", "id"), ("Date", "date"), ("Cashier", "cashier"), ("Items", "items"), ("Total", "total")]
+        history_sheet.headers([title for title, _ in columns])
+        history_sheet.enable_bindings("single_select", "row_select", "column_select", "arrowkeys")
+        
+        # Line items of the selected sale
+        lines_sheet = Sheet(dialog, height=180)
+        lines_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        lines_sheet.headers(["Barcode", "Product", "Price", "Quantity", "Line Total"])
+        
+        page_frame = ctk.CTkFrame(dialog)
+        page_frame.pack(fill="x", padx=5, pady=5)
+        page_label = ctk.CTkLabel(page_frame, text="")
+        page_size = 100
+        state = {"query": {}, "sort": "date", "descending": True, "page": 0, "total": 0, "sales": []}
+        
+        def read_filters():
+            query = {}
+            for key in ("start", "end"):
+                text = filters[key].get().strip()
+                if text:
+                    datetime.strptime(text, "%Y-%m-%d")
+                    query[key] = text
+            for key in ("cashier", "barcode"):
+                text = filters[key].get().strip()
+                if text:
+                    query[key] = text
+            for key in ("min_total", "max_total"):
+                text = filters[key].get().strip().replace(",", "")
+                if text:
+                    query[key] = float(text)
+            return query
+            
+        def load_page():
+            sales, total = self.sale_index.query(
+                **state["query"],
+                sort=state["sort"],
+                descending=state["descending"],
+                offset=state["page"] * page_size,
+                limit=page_size
+            )
+            state["sales"] = sales
+            state["total"] = total
+            history_sheet.set_sheet_data([
+                [
+                    sale.get("id", ""),
+                    sale["date"],
+                    sale.get("cashier", ""),
+                    len(sale["items"]),
+                    f"UGX {sale['total']:,.0f}"
+                ]
+                for sale in sales
+            ])
+            lines_sheet.set_sheet_data([])
+            pages = max(1, math.ceil(total / page_size))
+            page_label.configure(text=f"Page {state['page'] + 1} of {pages} ({total:,} sales)")
+            
+        def search(event=None):
+            try:
+                state["query"] = read_filters()
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be YYYY-MM-DD and totals numbers!")
+                return
+            state["page"] = 0
+            self.sales_archive.refresh()
+            load_page()
+            
+        def turn_page(step):
+            pages = max(1, math.ceil(state["total"] / page_size))
+            if 0 <= state["page"] + step < pages:
+                state["page"] += step
+                load_page()
+                
+        def on_select(event=None):
+            selected = history_sheet.get_currently_selected()
+            if not selected:
+                return
+            row, column = selected.row, selected.column
+            if selected.type_ == "columns":
+                # Header click: sort by that column, again to reverse
+                key = columns[column][1]
+                state["descending"] = not state["descending"] if state["sort"] == key else key != "cashier"
+                state["sort"] = key
+                state["page"] = 0
+                load_page()
+                return
+            if row < len(state["sales"]):
+                lines_sheet.set_sheet_data([
+                    [
+                        item["barcode"],
+                        item.get("name", ""),
+                        f"UGX {item['price']:,.0f}",
+                        item["quantity"],
+                        f"UGX {item['price'] * item['quantity']:,.0f}"
+                    ]
+                    for item in state["sales"][row]["items"]
+                ])
+                
+        history_sheet.extra_bindings("cell_select", on_select)
+        history_sheet.extra_bindings("row_select", on_select)
+        history_sheet.extra_bindings("column_select", on_select)
+        for entry in filters.values():
+            entry.bind("<Return>", search)
+        ctk.CTkButton(filter_frame, text="Search", command=search, width=80).pack(side="left", padx=5)
+        ctk.CTkButton(page_frame, text="< Previous", command=lambda: turn_page(-1)).pack(side="left", padx=5)
+        page_label.pack(side="left", padx=10)
+        ctk.CTkButton(page_frame, text="Next >", command=lambda: turn_page(1)).pack(side="left", padx=5)
+        search()
+        
+    def show_returns(self):
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Returns & Reprints")
+        dialog.geometry("900x650")
+        dialog.transient(self.window)
         
-        # Set up headers
-        headers = ["Date", "Items", "Total"]
-        history_sheet.headers(headers)
-        
-        # Add sales to sheet
-        for sale in self.sales_history:
-            history_sheet.insert_row([
+        # Search by sale ID, day or barcode
+        search_frame = ctk.CTkFrame(dialog)
+        search_frame.pack(fill="x", padx=5, pady=5)
+        ctk.CTkLabel(search_frame, text="Sale ID, Date (YYYY-MM-DD) or Barcode:").pack(side="left", padx=5)
+        search_entry = ctk.CTkEntry(search_frame, width=300)
+        search_entry.pack(side="left", padx=5)
+        search_entry.focus_set()
+        
+        sales_sheet = Sheet(dialog, height=220)
+        sales_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        sales_sheet.headers(["Sale ID", "Date", "Type", "Items", "Total"])
+        sales_sheet.enable_bindings("single_select", "row_select", "arrowkeys")
+        
+        lines_sheet = Sheet(dialog, height=220)
+        lines_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        lines_sheet.headers(["Barcode", "Product", "Price", "Sold", "Returnable", "Return Qty"])
+        lines_sheet.enable_bindings("single_select", "arrowkeys", "edit_cell")
+        lines_sheet.readonly_columns(columns=[0, 1, 2, 3, 4])
+        
+        found = []
+        current = {"sale": None, "returnable": {}}
+        
+        def find_sales(event=None):
+            found[:] = self.returns.find(search_entry.get())
+            sales_sheet.set_sheet_data([
+                [
+                    sale.get("id", ""),
                     sale["date"],
+                    "Return" if sale.get("type") == "return" else "Sale",
                     len(sale["items"]),
                     f"UGX {sale['total']:,.0f}"
+                ]
+                for sale in found
+            ])
+            lines_sheet.set_sheet_data([])
+            current["sale"] = None
+            if not found:
+                messagebox.showinfo("Returns", "No matching sales found.")
+            elif len(found) == 1:
+                show_lines(0)
+                
+        def show_lines(row):
+            sale = found[row]
+            current["sale"] = sale
+            current["returnable"] = self.returns.returnable(sale)
+            lines_sheet.set_sheet_data([
+                [
+                    item["barcode"],
+                    item.get("name", ""),
+                    f"UGX {item['price']:,.0f}",
+                    item["quantity"],
+                    current["returnable"].get(item["barcode"], 0),
+                    0
+                ]
+                for item in sale["items"]
             ])
             
+        def on_select(event=None):
+            selected = sales_sheet.get_currently_selected()
+            if selected and selected[0] is not None and selected[0] < len(found):
+                show_lines(selected[0])
+                
+        def validate_quantity(event):
+            barcode = lines_sheet.get_cell_data(event.row, 0)
+            try:
+                quantity = int(str(event.text).strip() or 0)
+            except ValueError:
+                messagebox.showerror("Error", f"Invalid quantity: {event.text}")
+                return None
+            if not 0 <= quantity <= current["returnable"].get(barcode, 0):
+                messagebox.showerror("Error", f"Between 0 and {current['returnable'].get(barcode, 0)} can be returned")
+                return None
+            return quantity
+            
+        sales_sheet.extra_bindings("cell_select", on_select)
+        sales_sheet.extra_bindings("row_select", on_select)
+        lines_sheet.extra_bindings("end_edit_cell", validate_quantity)
+        search_entry.bind("<Return>", find_sales)
+        ctk.CTkButton(search_frame, text="Find", command=find_sales).pack(side="left", padx=5)
+        
+        def reprint():
+            if current["sale"] is None:
+                messagebox.showerror("Error", "Please select a sale!")
+                return
+            title = "REFUND RECEIPT" if current["sale"].get("type") == "return" else "POS SYSTEM RECEIPT"
+            self.output_receipt(current["sale"], title=f"{title} (COPY)")
+            
+        def refund():
+            sale = current["sale"]
+            if sale is None:
+                messagebox.showerror("Error", "Please select a sale!")
+                return
+            quantities = {}
+            for row in lines_sheet.get_sheet_data():
+                quantities[row[0]] = quantities.get(row[0], 0) + int(row[5] or 0)
+            try:
+                if not any(quantities.values()):
+                    raise ReturnError("Enter a Return Qty for the items being returned")
+                refund_sale = self.returns.refund(sale, quantities, restock=restock_var.get(),
+                                                  cashier=self.current_user)
+            except ReturnError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            logging.info(f"Refund {refund_sale['id']} of sale {sale['id']}: UGX {-refund_sale['total']:,.0f}")
+            self.audit.record(self.current_user, "refund", sale["id"],
+                              refund=refund_sale["id"], total=refund_sale["total"])
+            self.output_receipt(refund_sale, title="REFUND RECEIPT")
+            messagebox.showinfo("Success", f"Refund UGX {-refund_sale['total']:,.0f} recorded as {refund_sale['id']}")
+            show_lines(found.index(sale))
+            
+        button_frame = ctk.CTkFrame(dialog)
+        button_frame.pack(fill="x", padx=5, pady=5)
+        restock_var = tk.BooleanVar(value=True)
+        ctk.CTkCheckBox(button_frame, text="Put returned items back in stock", variable=restock_var).pack(side="left", padx=5)
+        ctk.CTkButton(button_frame, text="Refund Selected Items", command=refund).pack(side="right", padx=5)
+        ctk.CTkButton(button_frame, text="Reprint Receipt", command=reprint).pack(side="right", padx=5)
+        
     def show_dashboard(self):
         dialog = ctk.CTkToplevel(self.window)
         dialog.title("Dashboard")
         dialog.geometry("600x400")
         
-        # Calculate statistics
-        total_sales = sum(sale["total"] for sale in self.sales_history)
-        total_items = sum(len(sale["items"]) for sale in self.sales_history)
-        avg_sale = total_sales / len(self.sales_history) if self.sales_history else 0
+        # Calculate statistics; archived sales count through the archive index
+        self.sales_archive.refresh()
+        archived = self.sales_archive.summary()
+        recent = [sale for sale in self.sales_history if not self.sales_archive.holds(sale)]
+        sale_count = archived["count"] + len(recent)
+        total_sales = archived["total"] + sum(sale["total"] for sale in recent)
+        total_items = archived["lines"] + sum(len(sale["items"]) for sale in recent)
+        avg_sale = total_sales / sale_count if sale_count else 0
         
         # Create statistics labels
         stats_frame = ctk.CTkFrame(dialog)
@@ -1410,10 +2006,283 @@ class POSSystem:
             font=("Arial", 16, "bold")
         ).pack(pady=10)
         
+    def show_cashier_report(self):
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Cashier Performance")
+        dialog.geometry("1000x500")
+        
+        range_frame = ctk.CTkFrame(dialog)
+        range_frame.pack(fill="x", padx=5, pady=5)
+        today = datetime.now().date()
+        ctk.CTkLabel(range_frame, text="From:").pack(side="left", padx=(5, 2))
+        start_entry = ctk.CTkEntry(range_frame, width=100)
+        start_entry.insert(0, (today - timedelta(days=6)).isoformat())
+        start_entry.pack(side="left", padx=(0, 5))
+        ctk.CTkLabel(range_frame, text="To:").pack(side="left", padx=(5, 2))
+        end_entry = ctk.CTkEntry(range_frame, width=100)
+        end_entry.insert(0, today.isoformat())
+        end_entry.pack(side="left", padx=(0, 5))
+        
+        report_sheet = Sheet(dialog)
+        report_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        report_sheet.headers([
+            "Cashier", "Sales", "Items", "Total", "Active Hours", "Sales/Hour",
+            "Items/Min", "Avg Scan-to-Tender (s)", "Returns", "Refunded"
+        ])
+        
+        def load_report(event=None):
+            start = start_entry.get().strip() or None
+            end = end_entry.get().strip() or None
+            try:
+                for text in (start, end):
+                    if text:
+                        datetime.strptime(text, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be YYYY-MM-DD!")
+                return
+            self.sales_archive.refresh()
+            report_sheet.set_sheet_data([
+                [
+                    row["cashier"],
+                    row["sales"],
+                    row["items"],
+                    f"UGX {row['total']:,.0f}",
+                    row["active_hours"],
+                    f"{row['sales_per_hour']:.1f}",
+                    f"{row['items_per_minute']:.1f}",
+                    f"{row['avg_scan_seconds']:.0f}",
+                    row["returns"],
+                    f"UGX {row['refunded']:,.0f}"
+                ]
+                for row in self.cashier_stats.report(start, end)
+            ])
+            
+        start_entry.bind("<Return>", load_report)
+        end_entry.bind("<Return>", load_report)
+        ctk.CTkButton(range_frame, text="Show", command=load_report, width=80).pack(side="left", padx=5)
+        load_report()
+
+    def show_audit_log(self):
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Audit Log")
+        dialog.geometry("1100x600")
+        
+        filter_frame = ctk.CTkFrame(dialog)
+        filter_frame.pack(fill="x", padx=5, pady=5)
+        ctk.CTkLabel(filter_frame, text="User:").pack(side="left", padx=(5, 2))
+        actor_var = ctk.StringVar(value="All")
+        ctk.CTkOptionMenu(filter_frame, values=["All"] + self.audit.actors(),
+                          variable=actor_var, width=140).pack(side="left", padx=(0, 5))
+        ctk.CTkLabel(filter_frame, text="Action:").pack(side="left", padx=(5, 2))
+        action_var = ctk.StringVar(value="All")
+        ctk.CTkOptionMenu(filter_frame, values=["All"] + self.audit.actions(),
+                          variable=action_var, width=160).pack(side="left", padx=(0, 5))
+        today = datetime.now().date()
+        ctk.CTkLabel(filter_frame, text="From:").pack(side="left", padx=(5, 2))
+        start_entry = ctk.CTkEntry(filter_frame, width=100)
+        start_entry.insert(0, (today - timedelta(days=30)).isoformat())
+        start_entry.pack(side="left", padx=(0, 5))
+        ctk.CTkLabel(filter_frame, text="To:").pack(side="left", padx=(5, 2))
+        end_entry = ctk.CTkEntry(filter_frame, width=100)
+        end_entry.insert(0, today.isoformat())
+        end_entry.pack(side="left", padx=(0, 5))
+        
+        entry_sheet = Sheet(dialog)
+        entry_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        entry_sheet.headers(["Time", "Till", "User", "Action", "Target", "Details"])
+        entry_sheet.enable_bindings("single_select", "row_select", "column_width_resize", "arrowkeys", "copy")
+        
+        def load_entries(event=None):
+            start = start_entry.get().strip() or None
+            end = end_entry.get().strip() or None
+            try:
+                for text in (start, end):
+                    if text:
+                        datetime.strptime(text, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be YYYY-MM-DD!")
+                return
+            entries = self.audit.query(
+                actor=None if actor_var.get() == "All" else actor_var.get(),
+                action=None if action_var.get() == "All" else action_var.get(),
+                start=start,
+                end=end,
+                limit=1000
+            )
+            entry_sheet.set_sheet_data([
+                [
+                    entry["ts"],
+                    entry["till"],
+                    entry["actor"],
+                    entry["action"],
+                    entry["target"] or "",
+                    ", ".join(f"{key}: {value}" for key, value in entry["details"].items())
+                ]
+                for entry in entries
+            ])
+            entry_sheet.set_column_widths([150, 80, 110, 130, 160, 420])
+            
+        start_entry.bind("<Return>", load_entries)
+        end_entry.bind("<Return>", load_entries)
+        ctk.CTkButton(filter_frame, text="Show", command=load_entries, width=80).pack(side="left", padx=5)
+        load_entries()
+
+    def show_shift(self):
+        """Open this till's shift, or show its X report and close it out"""
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Shift")
+        dialog.geometry("450x550")
+        dialog.transient(self.window)
+        dialog.grab_set()
+
+        shift = self.shifts.current()
+        if shift is None:
+            ctk.CTkLabel(dialog, text="No shift open on this till", font=("Arial", 16, "bold")).pack(pady=10)
+            ctk.CTkLabel(dialog, text="Opening Float (UGX):").pack(pady=5)
+            float_entry = ctk.CTkEntry(dialog)
+            float_entry.pack(pady=5)
+            float_entry.focus()
+
+            def open_shift(event=None):
+                try:
+                    opening_float = float(float_entry.get().strip() or 0)
+                    shift = self.shifts.open_shift(self.current_user, opening_float)
+                except ValueError:
+                    messagebox.showerror("Error", "Invalid float amount!")
+                    return
+                except ShiftError as e:
+                    messagebox.showerror("Error", str(e))
+                    return
+                self.audit.record(self.current_user, "shift_open", shift["id"], float=opening_float)
+                messagebox.showinfo("Success", f"Shift opened with a float of UGX {opening_float:,.0f}")
+                dialog.destroy()
+
+            float_entry.bind("<Return>", open_shift)
+            ctk.CTkButton(dialog, text="Open Shift", command=open_shift).pack(pady=10)
+            return
+
+        report = self.shifts.x_report()
+        lines = [
+            f"Shift: {report['id']}",
+            f"Opened: {report['opened']} by {report['opened_by']}",
+            f"Opening Float: UGX {report['float']:,.0f}",
+            f"Sales: {report['sales']} ({report['items']} items)",
+            f"Gross: UGX {report['gross']:,.0f}",
+            f"Discounts: UGX {report['discounts']:,.0f}",
+            f"Returns: {report['returns']} (UGX {report['refunded']:,.0f})",
+            f"Net Takings: UGX {report['net']:,.0f}",
+            f"Expected Cash: UGX {report['expected_cash']:,.0f}",
+        ]
+        ctk.CTkLabel(dialog, text="\n".join(lines), justify="left", font=("Arial", 14)).pack(pady=10, padx=10, anchor="w")
+        ctk.CTkButton(dialog, text="Print X Report",
+                      command=lambda: self.output_shift_report(self.shifts.x_report())).pack(pady=5)
+
+        ctk.CTkLabel(dialog, text="Counted Cash (UGX):").pack(pady=(15, 5))
+        counted_entry = ctk.CTkEntry(dialog)
+        counted_entry.pack(pady=5)
+
+        def close_shift():
+            try:
+                counted = float(counted_entry.get().strip())
+            except ValueError:
+                messagebox.showerror("Error", "Enter the cash counted in the drawer!")
+                return
+            if not messagebox.askyesno("Confirm", "Close this shift and print its Z report?"):
+                return
+            try:
+                report = self.shifts.close_shift(self.current_user, counted)
+            except ShiftError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.audit.record(self.current_user, "shift_close", report["id"],
+                              z_number=report["z_number"], over_short=report["over_short"])
+            dialog.destroy()
+            self.output_shift_report(report)
+            if self.settings.get("end_of_day_at_shift_close", True):
+                self.run_end_of_day()
+
+        ctk.CTkButton(dialog, text="Close Shift (Z Report)", command=close_shift).pack(pady=10)
+
+    def run_end_of_day(self, day=None):
+        """Write the day's end-of-day CSVs and PDF in the background; the till stays usable"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        out_dir = os.path.join(self.locations.receipts_dir(self.settings), END_OF_DAY_DIR, day)
+
+        data_dir = self.store.data_dir
+
+        def run():
+            try:
+                end_of_day(data_dir, day, out_dir)
+            except Exception:
+                logging.exception(f"End-of-day report for {day} failed")
+
+        threading.Thread(target=run, name="end-of-day", daemon=True).start()
+
+    def output_shift_report(self, report):
+        """Save an X or Z report as a PDF next to the receipts and send it to the printer"""
+        reports_dir = self.locations.receipts_dir(self.settings)
+        if report["kind"] == "Z":
+            title = f"Z REPORT #{report['z_number']}"
+        else:
+            title = "X REPORT"
+        filename = os.path.join(
+            reports_dir, f"{report['kind'].lower()}_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
+        c = canvas.Canvas(filename, pagesize=letter)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(50, 750, title)
+        c.setFont("Helvetica", 12)
+        lines = [
+            f"Shift: {report['id']}",
+            f"Till: {report['till']}",
+            f"Opened: {report['opened']} by {report['opened_by']}",
+        ]
+        if report["kind"] == "Z":
+            lines.append(f"Closed: {report['closed']} by {report['closed_by']}")
+        lines += [
+            "",
+            f"Sales: {report['sales']}",
+            f"Items: {report['items']}",
+            f"Gross: UGX {report['gross']:,.0f}",
+            f"Discounts: UGX {report['discounts']:,.0f}",
+            f"Returns: {report['returns']}",
+            f"Refunded: UGX {report['refunded']:,.0f}",
+            f"Net Takings: UGX {report['net']:,.0f}",
+            "",
+            f"Opening Float: UGX {report['float']:,.0f}",
+            f"Expected Cash: UGX {report['expected_cash']:,.0f}",
+        ]
+        if report["kind"] == "Z":
+            lines += [
+                f"Counted Cash: UGX {report['counted']:,.0f}",
+                f"Over/Short: UGX {report['over_short']:,.0f}",
+            ]
+        lines += ["", "By Cashier:"]
+        lines += [f"  {cashier or '-'}: {entry['sales']} sales, UGX {entry['net']:,.0f}"
+                  for cashier, entry in sorted(report["by_cashier"].items())]
+        lines += ["", "By Hour:"]
+        lines += [f"  {hour}:00  {entry['sales']} sales, UGX {entry['net']:,.0f}"
+                  for hour, entry in sorted(report["by_hour"].items())]
+        y = 725
+        for line in lines:
+            if y < 50:
+                c.showPage()
+                c.setFont("Helvetica", 12)
+                y = 750
+            c.drawString(50, y, line)
+            y -= 18
+        c.save()
+        try:
+            import platform
+            if platform.system() == "Windows":
+                os.startfile(filename, "print")
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not send report to printer: {e}")
+        messagebox.showinfo("Success", f"{title.title()} saved as {filename}")
+
     def show_settings(self):
         dialog = ctk.CTkToplevel(self.window)
         dialog.title("Settings")
-        dialog.geometry("400x500")
+        dialog.geometry("400x700")
         
         # Theme selection
         ctk.CTkLabel(dialog, text="Theme:").pack(pady=5)
@@ -1468,6 +2337,24 @@ class POSSystem:
         conn_details_entry.pack(fill="x", padx=5, pady=2)
         conn_details_entry.insert(0, self.settings.get("escpos_conn_details", ""))
         
+        # Low-stock alerts
+        ctk.CTkLabel(dialog, text="Default Reorder Point:").pack(pady=5)
+        reorder_point_entry = ctk.CTkEntry(dialog)
+        reorder_point_entry.pack(fill="x", padx=5, pady=2)
+        reorder_point_entry.insert(0, str(self.settings.get("default_reorder_point", DEFAULT_REORDER_POINT)))
+        
+        # Sales archiving
+        ctk.CTkLabel(dialog, text="Archive Sales Older Than (days, 0 = never):").pack(pady=5)
+        retention_entry = ctk.CTkEntry(dialog)
+        retention_entry.pack(fill="x", padx=5, pady=2)
+        retention_entry.insert(0, str(self.settings.get("sales_retention_days", 0)))
+        
+        # Scheduled backups
+        ctk.CTkLabel(dialog, text="Automatic Backup Every (minutes, 0 = off):").pack(pady=5)
+        backup_interval_entry = ctk.CTkEntry(dialog)
+        backup_interval_entry.pack(fill="x", padx=5, pady=2)
+        backup_interval_entry.insert(0, str(self.settings.get("backup_interval_minutes", 0)))
+        
         def save_settings():
             self.settings["theme"] = theme_var.get()
             ctk.set_appearance_mode(self.settings["theme"])
@@ -1475,6 +2362,27 @@ class POSSystem:
             self.settings["escpos_model"] = printer_model_entry.get().strip()
             self.settings["escpos_conn_type"] = conn_type_entry.get().strip()
             self.settings["escpos_conn_details"] = conn_details_entry.get().strip()
+            try:
+                self.settings["default_reorder_point"] = int(reorder_point_entry.get().strip())
+            except ValueError:
+                messagebox.showerror("Error", "Default reorder point must be a whole number!")
+                return
+            try:
+                self.settings["sales_retention_days"] = int(retention_entry.get().strip() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Archive age must be a whole number of days!")
+                return
+            try:
+                backup_interval = int(backup_interval_entry.get().strip() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Backup interval must be a whole number of minutes!")
+                return
+            self.low_stock.set_default_reorder_point(self.settings["default_reorder_point"])
+            if backup_interval != self.settings.get("backup_interval_minutes", 0):
+                self.settings["backup_interval_minutes"] = backup_interval
+                if self.backup_scheduler:
+                    self.backup_scheduler.stop()
+                self.backup_scheduler = self.start_backup_scheduler()
             self.save_settings()
             dialog.destroy()
             
@@ -1485,38 +2393,55 @@ class POSSystem:
         ).pack(pady=20)
         
     def load_settings(self):
-        if os.path.exists("settings.json"):
-            with open("settings.json", "r") as f:
+        if os.path.exists(self.locations.settings_file):
+            with open(self.locations.settings_file, "r") as f:
                 return json.load(f)
         return {"theme": "dark"}
         
     def save_settings(self):
-        with open("settings.json", "w") as f:
-            json.dump(self.settings, f)
+        write_json_atomic(self.locations.settings_file, self.settings)
             
-    def update_stock(self, sheet):
+    def validate_inventory_cell(self, sheet, edits, event):
+        """Check one edited inventory cell; returning None rejects the edit"""
+        barcode = sheet.get_cell_data(event.row, 0)
         try:
-            # Update product stock levels
-            for row in range(sheet.get_total_rows()):
-                barcode = sheet.get_cell_data(row, 0)
-                stock = int(sheet.get_cell_data(row, 3))
-                if barcode in self.products:
-                    self.products[barcode]["stock"] = stock
-                    
-            self.save_products()
-            messagebox.showinfo("Success", "Stock updated successfully!")
-        except ValueError:
-            messagebox.showerror("Error", "Invalid stock value!")
+            if event.column == 3:
+                value = edits.set_count(barcode, event.text, sheet.get_cell_data(event.row, 3))
+            else:
+                value = edits.set_reorder_point(barcode, event.text)
+        except InventoryError as e:
+            messagebox.showerror("Error", str(e))
+            return None
+        if edits.is_dirty(barcode):
+            sheet.highlight_cells(row=event.row, column=event.column, bg="#fff3b0", redraw=False)
+        else:
+            sheet.dehighlight_cells(row=event.row, column=event.column, redraw=False)
+        return "" if value is None else value
+        
+    def update_stock(self, sheet, edits):
+        if not len(edits):
+            messagebox.showinfo("Update Stock", "No changes to save.")
+            return
+        try:
+            counts, points = edits.save()
+        except Exception as e:
+            logging.error(f"Error saving stock edits: {e}")
+            messagebox.showerror("Error", f"Stock was not updated: {e}")
+            return
+        # Only what was committed; products deleted meanwhile were skipped
+        for barcode, stock in counts.items():
+            self.audit.record(self.current_user, "stock_set", barcode, stock=stock)
+        for barcode, reorder_point in points.items():
+            self.audit.record(self.current_user, "reorder_point_set", barcode, reorder_point=reorder_point)
+        sheet.dehighlight_cells(all_=True, redraw=True)
+        messagebox.showinfo("Success", f"Stock updated for {len(set(counts) | set(points))} product(s)!")
         
     def load_sales_history(self):
-        if os.path.exists("sales_history.json"):
-            with open("sales_history.json", "r") as f:
-                return json.load(f)
-        return []
+        return self.store.sales
         
     def save_sales_history(self):
-        with open("sales_history.json", "w") as f:
-            json.dump(self.sales_history, f)
+        # Sales are journaled when committed, this just folds them into sales_history.json
+        self.store.checkpoint()
             
     def print_receipt(self):
         if not self.cart:
@@ -1540,19 +2465,39 @@ class POSSystem:
             messagebox.showerror("Error", "Payment amount is less than total!")
             return
             
-        # Save to sales history
-        self.sales_history.append({
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        # Save to sales history and take the stock as one journal record (all or nothing)
+        now = datetime.now()
+        sale = {
+            "date": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "till": self.store.till_id,
+            "cashier": self.current_user,
             "items": self.cart.copy(),
             "subtotal": subtotal,
             "discount": discount,
             "total": total,
             "payment": payment,
             "change": change
-        })
-        self.save_sales_history()
+        }
+        if self.cart_started:
+            # Scan-to-tender time, for the cashier performance report
+            sale["scan_seconds"] = round((now - self.cart_started).total_seconds(), 1)
+        try:
+            self.inventory.commit_sale(sale, self.cart)
+        except InventoryError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
-        # Print using selected method
+        self.output_receipt(sale)
+        
+        # Clear cart and entries
+        self.cart = []
+        self.cart_started = None
+        self.discount_entry.delete(0, "end")
+        self.payment_entry.delete(0, "end")
+        self.update_spreadsheet()
+        
+    def output_receipt(self, sale, title="POS SYSTEM RECEIPT"):
+        """Print a committed sale (or refund) with the configured print method"""
         print_method = self.settings.get("print_method", "windows")
         if print_method == "escpos":
             # ESC/POS printing
@@ -1580,17 +2525,20 @@ class POSSystem:
                 else:
                     raise Exception("Unknown ESC/POS connection type")
                 # Print simple text receipt
-                p.text("POS SYSTEM RECEIPT\n")
-                p.text(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                p.text(f"{title}\n")
+                p.text(f"Sale: {sale['id']}\n")
+                if sale.get("return_of"):
+                    p.text(f"Refund of: {sale['return_of']}\n")
+                p.text(f"Date: {sale['date']}\n")
                 p.text("-----------------------------\n")
-                for item in self.cart:
+                for item in sale["items"]:
                     p.text(f"{item['name']} x{item['quantity']}\tUGX {item['price'] * item['quantity']:,}\n")
                 p.text("-----------------------------\n")
-                p.text(f"Subtotal: UGX {subtotal:,}\n")
-                p.text(f"Discount: UGX {discount:,}\n")
-                p.text(f"Total: UGX {total:,}\n")
-                p.text(f"Payment: UGX {payment:,}\n")
-                p.text(f"Change: UGX {change:,}\n")
+                p.text(f"Subtotal: UGX {sale['subtotal']:,}\n")
+                p.text(f"Discount: UGX {sale['discount']:,}\n")
+                p.text(f"Total: UGX {sale['total']:,}\n")
+                p.text(f"Payment: UGX {sale['payment']:,}\n")
+                p.text(f"Change: UGX {sale['change']:,}\n")
                 p.cut()
                 messagebox.showinfo("Success", "Receipt sent to ESC/POS printer!")
             except Exception as e:
@@ -1598,31 +2546,32 @@ class POSSystem:
         else:
             # Windows/USB printing (PDF)
             # Create PDF receipt
-            desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-            receipts_dir = os.path.join(desktop_path, "POS_Receipts")
-            if not os.path.exists(receipts_dir):
-                os.makedirs(receipts_dir)
+            receipts_dir = self.locations.receipts_dir(self.settings)
             filename = os.path.join(receipts_dir, f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
             c = canvas.Canvas(filename, pagesize=letter)
             c.setFont("Helvetica-Bold", 16)
-            c.drawString(50, 750, "POS SYSTEM RECEIPT")
-            c.drawString(50, 730, f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            c.drawString(50, 750, title)
+            c.drawString(50, 730, f"Date: {sale['date']}")
+            c.setFont("Helvetica", 12)
+            c.drawString(50, 712, f"Sale: {sale['id']}")
+            if sale.get("return_of"):
+                c.drawString(50, 696, f"Refund of: {sale['return_of']}")
             y = 680
             c.setFont("Helvetica", 12)
-            for item in self.cart:
+            for item in sale["items"]:
                 c.drawString(50, y, f"{item['name']} x{item['quantity']}")
                 c.drawString(400, y, f"UGX {item['price'] * item['quantity']:,}\n")
                 y -= 20
             y -= 20
-            c.drawString(50, y, f"Subtotal: UGX {subtotal:,.0f}")
+            c.drawString(50, y, f"Subtotal: UGX {sale['subtotal']:,.0f}")
             y -= 20
-            c.drawString(50, y, f"Discount: UGX {discount:,.0f}")
+            c.drawString(50, y, f"Discount: UGX {sale['discount']:,.0f}")
             y -= 20
-            c.drawString(50, y, f"Total: UGX {total:,.0f}")
+            c.drawString(50, y, f"Total: UGX {sale['total']:,.0f}")
             y -= 20
-            c.drawString(50, y, f"Payment: UGX {payment:,.0f}")
+            c.drawString(50, y, f"Payment: UGX {sale['payment']:,.0f}")
             y -= 20
-            c.drawString(50, y, f"Change: UGX {change:,.0f}")
+            c.drawString(50, y, f"Change: UGX {sale['change']:,.0f}")
             c.save()
             try:
                 import platform
@@ -1632,85 +2581,128 @@ class POSSystem:
                 messagebox.showerror("Error", f"Could not send receipt to printer: {e}")
             messagebox.showinfo("Success", f"Receipt saved as {filename}")
         
-        # Clear cart and entries
-        self.cart = []
-        self.discount_entry.delete(0, "end")
-        self.payment_entry.delete(0, "end")
-        self.update_spreadsheet()
-        
     def backup_data(self):
         try:
-            # Create backup directory on desktop
-            desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-            backup_dir = os.path.join(desktop_path, "POS_System_Backups")
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-                
-            # Create backup with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(backup_dir, f"backup_{timestamp}")
-            os.makedirs(backup_path)
-            
-            # Copy all data files
-            files_to_backup = ["products.json", "sales_history.json", "settings.json", "users.json"]
-            for file in files_to_backup:
-                if os.path.exists(file):
-                    shutil.copy2(file, backup_path)
-                    
-            messagebox.showinfo("Success", f"Backup created in {backup_path}")
+            repository = self.backup_repository()
+            manifest = backup_store(repository, self.store, self.backup_extra_files(), label="manual")
+            self.audit.record(self.current_user, "backup", manifest["id"])
+            messagebox.showinfo(
+                "Success",
+                f"Backup {manifest['id']} created in {repository.directory}\n"
+                f"{manifest['size'] / 1024:,.0f} KB of data, {manifest['stored_bytes'] / 1024:,.0f} KB new"
+            )
         except Exception as e:
             messagebox.showerror("Error", f"Backup failed: {str(e)}")
             
     def restore_data(self):
         try:
-            # Show backup selection dialog
-            desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-            backup_dir = os.path.join(desktop_path, "POS_System_Backups")
+            repository = self.backup_repository()
+            snapshots = repository.snapshots()
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not open backups: {str(e)}")
+            return
+        if not snapshots:
+            messagebox.showerror("Error", "No backups found!")
+            return
             
-            if not os.path.exists(backup_dir):
-                messagebox.showerror("Error", "No backup directory found on desktop!")
+        dialog = ctk.CTkToplevel(self.window)
+        dialog.title("Restore Backup")
+        dialog.geometry("700x500")
+        dialog.transient(self.window)
+        
+        snapshot_sheet = Sheet(dialog)
+        snapshot_sheet.pack(fill="both", expand=True, padx=5, pady=5)
+        snapshot_sheet.headers(["Backup", "Taken", "Type", "Size (KB)", "New (KB)"])
+        # Newest first
+        snapshots.reverse()
+        snapshot_sheet.set_sheet_data([
+            [m["id"], m["ts"], m["label"], f"{m['size'] / 1024:,.0f}", f"{m['stored_bytes'] / 1024:,.0f}"]
+            for m in snapshots
+        ])
+        snapshot_sheet.enable_bindings("single_select", "row_select", "arrowkeys")
+        
+        def restore_selected():
+            selected = snapshot_sheet.get_currently_selected()
+            if not selected:
+                messagebox.showerror("Error", "Please select a backup!")
+                return
+            snapshot_id = snapshots[selected[0]]["id"]
+            if not messagebox.askyesno(
+                "Confirm",
+                f"Restore backup {snapshot_id}? Current products, sales, settings and users will be replaced."
+            ):
                 return
+            try:
+                products, sales = load_store_state(repository, snapshot_id)
+                files = repository.load(snapshot_id)["files"]
+                archived = [name for name in files if name.startswith(ARCHIVE_DIR + "/")]
+                if archived:
+                    # Unmap the archive's index tables before they are overwritten
+                    self.sales_archive.close()
+                    repository.restore(snapshot_id, self.store.data_dir, archived)
+                    self.sales_archive.refresh()
+                for name, path in self.backup_extra_files().items():
+                    if name in files:
+                        repository.restore(snapshot_id, os.path.dirname(path), [name])
+                        
+                # Every till sharing the data reloads the restored state
+                self.store.replace_all(products, sales)
+                self.inventory.release_all()
+                self.cart = []
+                self.cart_started = None
                 
-            backup_path = filedialog.askdirectory(
-                title="Select Backup Directory",
-                initialdir=backup_dir
-            )
-            
-            if not backup_path:
+                # Reload data
+                self.products = self.load_products()
+                self.sales_history = self.load_sales_history()
+                self.settings = self.load_settings()
+                self.user_roles = self.load_user_roles()
+                self.update_spreadsheet()
+                
+                self.audit.record(self.current_user, "data_restore", snapshot_id)
+                dialog.destroy()
+                messagebox.showinfo("Success", "Data restored successfully!")
+            except (BackupError, OSError, ValueError) as e:
+                messagebox.showerror("Error", f"Restore failed: {str(e)}")
+                
+        def verify_selected():
+            selected = snapshot_sheet.get_currently_selected()
+            if not selected:
+                messagebox.showerror("Error", "Please select a backup!")
                 return
+            snapshot_id = snapshots[selected[0]]["id"]
+            problems = repository.verify(snapshot_id)
+            if problems:
+                messagebox.showerror("Verify", f"Backup {snapshot_id} is damaged:\n" + "\n".join(problems[:10]))
+            else:
+                messagebox.showinfo("Verify", f"Backup {snapshot_id} is intact.")
                 
-            # Restore files
-            files_to_restore = ["products.json", "sales_history.json", "settings.json", "users.json"]
-            for file in files_to_restore:
-                backup_file = os.path.join(backup_path, file)
-                if os.path.exists(backup_file):
-                    shutil.copy2(backup_file, ".")
-                    
-            # Reload data
-            self.products = self.load_products()
-            self.sales_history = self.load_sales_history()
-            self.settings = self.load_settings()
-            self.user_roles = self.load_user_roles()
-            
-            messagebox.showinfo("Success", "Data restored successfully!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Restore failed: {str(e)}")
+        button_frame = ctk.CTkFrame(dialog)
+        button_frame.pack(pady=10)
+        ctk.CTkButton(
+            button_frame,
+            text="Restore Selected",
+            command=restore_selected
+        ).pack(side="left", padx=5)
+        ctk.CTkButton(
+            button_frame,
+            text="Verify Selected",
+            command=verify_selected
+        ).pack(side="left", padx=5)
             
     def remove_from_cart(self, row):
         if 0 <= row < len(self.cart):
             # Restore stock
             item = self.cart[row]
-            if item["barcode"] in self.products:
-                self.products[item["barcode"]]["stock"] += item["quantity"]
-                self.save_products()
+            self.inventory.release(item["barcode"], item["quantity"])
                 
             del self.cart[row]
             self.update_spreadsheet()
             
     def logout(self):
         if messagebox.askyesno("Confirm", "Are you sure you want to logout?"):
-            self.window.destroy()
-            self.__init__()  # Restart the application
+            self.audit.record(self.current_user, "logout", self.current_user)
+            self.end_session()
+            self.show_login()
             
     def show_user_management(self):
         dialog = ctk.CTkToplevel(self.window)
@@ -1768,7 +2760,7 @@ class POSSystem:
                 
             # Add new user
             self.user_roles[username] = {
-                "password": self.hash_password(password),
+                "password": self.credentials.hash_password(password),
                 "role": role,
                 "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "last_login": None
@@ -1776,6 +2768,7 @@ class POSSystem:
             
             # Save changes
             self.save_user_roles()
+            self.audit.record(self.current_user, "user_add", username, role=role)
             
             # Update user list
             update_user_list()
@@ -1830,8 +2823,9 @@ class POSSystem:
                 return
                 
             if messagebox.askyesno("Confirm", f"Delete user {username}?"):
-                del self.user_roles[username]
+                role = self.user_roles.pop(username).get("role")
                 self.save_user_roles()
+                self.audit.record(self.current_user, "user_delete", username, role=role)
                 update_user_list()
                 messagebox.showinfo("Success", f"User {username} deleted successfully!")
         
@@ -1862,24 +2856,19 @@ class POSSystem:
         headers = ["Time", "Items", "Total"]
         history_sheet.headers(headers)
         
-        # Get today's date
+        # Today's sales straight from the date index
         today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Add today's sales to sheet
-        for sale in self.sales_history:
-            if sale["date"].startswith(today):
-                history_sheet.insert_row([
-                        sale["date"].split()[1],  # Time only
-                        len(sale["items"]),
-                        f"UGX {sale['total']:,.0f}"
-                ])
-                
-        # Calculate today's total
-        today_total = sum(
-            sale["total"] for sale in self.sales_history
-            if sale["date"].startswith(today)
-        )
-        
+        sales = list(self.sale_index.between(today, today))
+        history_sheet.set_sheet_data([
+            [
+                sale["date"].split()[1],  # Time only
+                len(sale["items"]),
+                f"UGX {sale['total']:,.0f}"
+            ]
+            for sale in sales
+        ])
+        today_total = sum(sale["total"] for sale in sales)
+
         # Add total at the bottom
         total_frame = ctk.CTkFrame(dialog)
         total_frame.pack(fill="x", padx=5, pady=5)
@@ -1899,13 +2888,25 @@ class POSSystem:
         
     def run(self):
         self.window.mainloop()
+        # Anything audited in the last moments before the window closed
+        self.audit.close()
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Start the till; --data-dir/--shared-dir choose where its data lives"""
+    locations = DataLocations.from_args(sys.argv[1:] if argv is None else argv)
+    # Logging goes through a queue to a background writer, so the UI never waits on it
+    log_listener = setup_logging(locations.log_dir)
     try:
         logging.info("Starting POS System...")
-        pos = POSSystem()
+        pos = POSSystem(locations)
         pos.run()
     except Exception as e:
         error_msg = f"An error occurred: {str(e)}\n\n{traceback.format_exc()}"
         logging.error(error_msg)
-        show_error_and_exit(error_msg) 
\ No newline at end of file
+        log_listener.stop()
+        show_error_and_exit(error_msg)
+    log_listener.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
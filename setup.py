@@ -4,6 +4,7 @@ setup(
     name="modern_pos",
     version="1.0.0",
     packages=find_packages(),
+    py_modules=["pos_system"],
     install_requires=[
         "customtkinter==5.2.1",
         "pillow==10.2.0",
@@ -15,6 +16,7 @@ setup(
     entry_points={
         'console_scripts': [
             'modern_pos=pos_system:main',
+            'modern_pos_cli=pos_core.cli:main',
         ],
     },
     author="Ssemwanga Haruna Moses",
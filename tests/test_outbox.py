@@ -0,0 +1,114 @@
+"""The head-office outbox against a MockHeadOffice on localhost."""
+
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pos_core.outbox import MockHeadOffice, SalesOutbox
+from pos_core.store import DataStore
+
+BARCODE = "8000000000001"
+
+
+class RecordingStop:
+    """Stands in for the flusher's stop event: records each backoff and stops after a few"""
+
+    def __init__(self, waits):
+        self.waits = waits
+        self.delays = []
+
+    def is_set(self):
+        return len(self.delays) >= self.waits
+
+    def set(self):
+        pass
+
+    def wait(self, delay):
+        self.delays.append(delay)
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="pos_outbox_test_")
+        self.store = DataStore(self.root, till_id="till1")
+        self.store.upsert_product(BARCODE, {"name": "Soap", "price": 1000, "stock": 100})
+        self.head_office = MockHeadOffice().start()
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            outbox.stop()
+            if outbox._thread is not None:
+                outbox._thread.join(5)
+        self.head_office.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def outbox(self, **kwargs):
+        outbox = SalesOutbox(self.store, self.head_office.url, timeout=2, **kwargs)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def sell(self, count):
+        for _ in range(count):
+            sale = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "cashier": "test",
+                    "items": [{"barcode": BARCODE, "name": "Soap", "price": 1000, "quantity": 1}],
+                    "subtotal": 1000, "discount": 0, "total": 1000, "payment": 1000, "change": 0}
+            self.store.commit_sale(sale, [(BARCODE, -1)])
+
+    def wait_for(self, condition, message):
+        deadline = time.monotonic() + 10
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, message)
+            time.sleep(0.02)
+
+    def test_backlog_goes_out_after_an_outage(self):
+        self.head_office.fail = True
+        outbox = self.outbox(batch_size=4, max_backoff=1)
+        self.sell(10)
+        outbox.start()
+        self.wait_for(lambda: outbox.online is False, "upload did not fail")
+        self.assertEqual(self.head_office.received, {})
+        self.assertGreater(outbox.pending_bytes(), 0)
+
+        self.head_office.fail = False
+        self.wait_for(lambda: len(self.head_office.received) == 10, "backlog was not sent")
+        self.wait_for(lambda: outbox.pending_bytes() == 0, "backlog was not acknowledged")
+        self.assertTrue(outbox.online)
+        self.assertEqual(self.head_office.duplicates, 0)
+
+    def test_resent_batch_is_not_counted_twice(self):
+        outbox = self.outbox()
+        self.sell(5)
+        # Head office took the batch but the answer never arrived, so the offset stayed put
+        entries, _ = outbox._read_batch()
+        outbox._send(entries)
+        self.assertEqual(outbox.flush_once(), 5)
+        self.assertEqual(len(self.head_office.received), 5)
+        self.assertEqual(self.head_office.duplicates, 5)
+
+        # A restarted till picks up where it left off instead of queueing the sales again
+        outbox.stop()
+        self.sell(3)
+        restarted = self.outbox()
+        self.assertEqual(restarted.flush_once(), 3)
+        self.assertEqual(len(self.head_office.received), 8)
+        self.assertEqual(self.head_office.duplicates, 5)
+        self.assertEqual(restarted.flush_once(), 0)
+
+    def test_backoff_is_capped(self):
+        self.head_office.fail = True
+        outbox = self.outbox(max_backoff=8)
+        self.sell(1)
+        outbox._stop = RecordingStop(waits=7)
+        with mock.patch("pos_core.outbox.random.uniform", side_effect=lambda low, high: high):
+            outbox._flush_loop()
+        self.assertEqual(outbox._stop.delays, [1, 2, 4, 8, 8, 8, 8])
+        self.assertEqual(self.head_office.requests, 7)
+        self.assertFalse(outbox.online)
+
+
+if __name__ == "__main__":
+    unittest.main()
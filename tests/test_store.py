@@ -0,0 +1,59 @@
+"""Several till processes writing to one data folder."""
+
+import multiprocessing
+import shutil
+import tempfile
+import unittest
+
+from pos_core.store import DataStore
+
+BARCODE = "8000000000001"
+TILLS = 4
+SALES = 300
+
+
+def sell(data_dir, till_id):
+    # Checkpoints every 100 records, so tills rotate the journal under each other
+    store = DataStore(data_dir, till_id=till_id, checkpoint_every=100)
+    for _ in range(SALES):
+        sale = {"date": "2026-10-19 12:00:00", "cashier": till_id,
+                "items": [{"barcode": BARCODE, "name": "Soap", "price": 1000, "quantity": 1}],
+                "subtotal": 1000, "discount": 0, "total": 1000, "payment": 1000, "change": 0}
+        store.commit_sale(sale, [(BARCODE, -1)])
+
+
+class SharedFolderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="pos_store_test_")
+        DataStore(self.root, till_id="setup").upsert_product(
+            BARCODE, {"name": "Soap", "price": 1000, "stock": TILLS * SALES})
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_tills_do_not_lose_each_others_sales(self):
+        watcher = DataStore(self.root, till_id="watcher")
+        seen = []
+        watcher.subscribe(lambda records: seen.extend(r["sale"]["id"] for r in records if r["op"] == "sale"))
+
+        context = multiprocessing.get_context("spawn")
+        tills = [context.Process(target=sell, args=(self.root, f"till{n}")) for n in range(TILLS)]
+        for till in tills:
+            till.start()
+        for till in tills:
+            till.join(120)
+            self.assertEqual(till.exitcode, 0)
+
+        watcher.poll()
+        self.assertEqual(watcher.products[BARCODE]["stock"], 0)
+        self.assertEqual(len(seen), TILLS * SALES)
+        self.assertEqual(len(set(seen)), TILLS * SALES)
+
+        reopened = DataStore(self.root, till_id="reopened")
+        self.assertEqual(reopened.products[BARCODE]["stock"], 0)
+        self.assertEqual(len({sale["id"] for sale in reopened.sales}), TILLS * SALES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Several tills syncing through a SyncServer on localhost."""
+
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from pos_core.store import DataStore
+from pos_core.sync import SyncClient, SyncServer
+
+BARCODE = "8000000000001"
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="pos_sync_test_")
+        self.server_store = DataStore(f"{self.root}/server", till_id="server")
+        self.server_store.upsert_product(BARCODE, {"name": "Soap", "price": 1000, "stock": 100})
+        self.server = SyncServer(self.server_store, host="127.0.0.1", port=0, poll_interval=0.05)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result(5)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop()
+        for client in self.clients:
+            client.join(5)
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    async def shutdown(self):
+        await self.server.stop()
+        # Long-polls still waiting for a change
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def till(self, name, start=True, store=None):
+        store = store or DataStore(f"{self.root}/{name}", till_id=name)
+        client = SyncClient(store, f"http://127.0.0.1:{self.server.port}", auto_apply=True, wait=1)
+        self.clients.append(client)
+        if start:
+            client.start()
+        return store, client
+
+    def sell(self, store, quantity=1):
+        sale = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "cashier": "test",
+                "items": [{"barcode": BARCODE, "name": "Soap", "price": 1000, "quantity": quantity}],
+                "subtotal": 1000 * quantity, "discount": 0, "total": 1000 * quantity,
+                "payment": 1000 * quantity, "change": 0}
+        store.commit_sale(sale, [(BARCODE, -quantity)])
+
+    def stock(self, store):
+        product = store.products.get(BARCODE)
+        return product.get("stock", 0) if product else None
+
+    def wait_for(self, expected, *stores):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if all(self.stock(store) == expected for store in stores):
+                return
+            time.sleep(0.05)
+        self.fail(f"stock {[self.stock(store) for store in stores]}, expected {expected}")
+
+    def test_tills_converge(self):
+        tills = [self.till(f"till{n}") for n in range(3)]
+        self.wait_for(100, self.server_store, *(store for store, _ in tills))
+        for n, (store, _) in enumerate(tills):
+            for _ in range(n + 1):
+                self.sell(store)
+        self.wait_for(94, self.server_store, *(store for store, _ in tills))
+
+    def test_catalogue_edit_reaches_other_tills(self):
+        (first, _), (second, _) = self.till("till1"), self.till("till2")
+        self.wait_for(100, first, second)
+        first.upsert_product(BARCODE, {"name": "Soap", "price": 1200}, moves=[])
+        deadline = time.monotonic() + 2
+        while second.products[BARCODE].get("price") != 1200:
+            self.assertLess(time.monotonic(), deadline, "price change did not arrive")
+            time.sleep(0.02)
+
+    def test_sales_before_sync_are_pushed(self):
+        store = DataStore(f"{self.root}/till1", till_id="till1")
+        # Same catalogue as the server, as if products.json had been copied across
+        store.replace_all(products={BARCODE: {"name": "Soap", "price": 1000, "stock": 100}})
+        for _ in range(3):
+            self.sell(store, 5)
+        self.till("till1", store=store)
+        self.wait_for(85, self.server_store, store)
+
+    def test_snapshot_keeps_unacked_moves(self):
+        store, client = self.till("till1", start=False)
+        client._apply(self.server.collect(0, "till1"))
+        self.assertEqual(self.stock(store), 100)
+        # Sold while the push has not gone through; then the server sends a snapshot
+        self.sell(store)
+        client._apply(self.server.collect(0, "till1"))
+        self.assertEqual(self.stock(store), 99)
+        client.start()
+        self.wait_for(99, self.server_store, store)
+
+
+if __name__ == "__main__":
+    unittest.main()